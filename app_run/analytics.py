@@ -0,0 +1,86 @@
+"""
+Coach dashboard: the leading athletes of a coach by longest run, total distance and average speed.
+
+Each leader is picked by an ordered subquery over the athletes' ``AthleteStats``, so the whole
+dashboard is one single-row query. The result is cached per coach until one of the coach's
+athletes finishes a run, the athletes' stats are rebuilt or the coach's subscriptions change.
+The cached entry is dropped once the change commits; with several worker processes the cache
+has to be a shared backend (Memcached, Redis), the per-process locmem default only clears the
+copy of the worker that made the change.
+
+Trends are rolled up from the per-day ``AthleteDailyStats`` rows, so their cost depends on the
+requested range and not on the length of the history.
+"""
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Value, Sum, Subquery, IntegerField, DecimalField, FloatField
+from django.db.models.functions import Coalesce, Cast, TruncWeek, TruncMonth
+
+from app_run.models import AthleteStats, AthleteDailyStats, Subscribe
+
+ANALYTICS_CACHE_TIMEOUT = 60 * 60
+
+LEADERS = {
+    'longest_run': (F('longest_distance'), DecimalField()),
+    'total_run': (F('total_distance'), DecimalField()),
+    'speed_avg': (Cast('speed_sum', FloatField()) / F('runs_finished'), FloatField()),
+}
+
+
+TREND_PERIODS = {
+    'day': F('day'),
+    'week': TruncWeek('day'),
+    'month': TruncMonth('day'),
+}
+
+
+def _analytics_key(coach_id):
+    return f'coach:{coach_id}:analytics'
+
+
+def _leaders(coach_id):
+    athletes = AthleteStats.objects.filter(athlete__coaches__coach=coach_id, runs_finished__gt=0)
+    columns = {}
+    for name, (value, output_field) in LEADERS.items():
+        leaders = athletes.annotate(value=value).filter(value__gt=0).order_by('-value', 'athlete_id')
+        columns[f'{name}_user'] = Coalesce(Subquery(leaders.values('athlete_id')[:1]), Value(0),
+                                           output_field=IntegerField())
+        columns[f'{name}_value'] = Coalesce(Subquery(leaders.values('value')[:1]), Value(0),
+                                            output_field=output_field)
+    return User.objects.filter(pk=coach_id).values(**columns).get()
+
+
+def coach_analytics(coach):
+    key = _analytics_key(coach.pk)
+    analytics = cache.get(key)
+    if analytics is None:
+        analytics = _leaders(coach.pk)
+        cache.set(key, analytics, ANALYTICS_CACHE_TIMEOUT)
+    return analytics
+
+
+def invalidate_coach_analytics(coach_ids):
+    """Drop the cached dashboards of the given coaches once the current transaction commits."""
+    keys = [_analytics_key(coach_id) for coach_id in coach_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def invalidate_athlete_coaches(athlete_ids=None):
+    """Drop the cached dashboards of every coach the given athletes (all when None) are subscribed to."""
+    subscriptions = Subscribe.objects.all()
+    if athlete_ids is not None:
+        subscriptions = subscriptions.filter(athlete_id__in=athlete_ids)
+    invalidate_coach_analytics(subscriptions.order_by().values_list('coach_id', flat=True).distinct())
+
+
+def coach_trends(coach, start, end, period, athlete_id=None):
+    """Run count, distance and average speed of the coach's athletes per ``period`` bucket of [start, end]."""
+    days = AthleteDailyStats.objects.filter(athlete__coaches__coach=coach.pk, day__range=(start, end))
+    if athlete_id is not None:
+        days = days.filter(athlete_id=athlete_id)
+    rows = days.annotate(period=TREND_PERIODS[period]).values('athlete', 'period').annotate(
+        runs=Sum('runs'), distance=Sum('distance'), speed_sum=Sum('speed_sum')).order_by('athlete', 'period')
+    return [{'athlete': row['athlete'], 'period': row['period'], 'runs': row['runs'], 'distance': row['distance'],
+             'avg_speed': round(row['speed_sum'] / row['runs'], 2) if row['runs'] else 0}
+            for row in rows]
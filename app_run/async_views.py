@@ -0,0 +1,108 @@
+"""
+Native async versions of the hot endpoints, served by the ASGI application.
+
+Reads and simple updates go through the async ORM. Writes that need a transaction
+(the async ORM has none) and the geo math run in worker threads, off the event loop.
+The sync DRF views stay the reference implementation; responses here match them.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework import status
+
+from app_run.finalization import complete_run, enqueue_finalization
+from app_run.models import Run, PendingPosition
+from app_run.serializers import PositionFixSerializer, PositionSerializer, RunSerializer, \
+    RunFinalizationJobSerializer
+from app_run.tracking import save_position, ingest_bulk, RunNotInProgress
+
+
+def _json_body(request):
+    try:
+        return json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+
+
+def _run_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+@csrf_exempt
+@require_POST
+async def create_position(request):
+    data = _json_body(request)
+    if not isinstance(data, dict):
+        return JsonResponse({'error': 'Неверный JSON'}, status=status.HTTP_400_BAD_REQUEST)
+
+    fix = PositionFixSerializer(data=data)
+    errors = {} if fix.is_valid() else dict(fix.errors)
+    run_id = _run_id(data.get('run'))
+    run = await Run.objects.select_related('athlete').filter(pk=run_id).afirst() if run_id else None
+    if run is None:
+        errors['run'] = ['Забег не найден']
+    elif run.status != Run.STATUS_IN_PROGRESS:
+        errors['run'] = ['Забег не запущен']
+    if errors:
+        return JsonResponse(errors, status=status.HTTP_400_BAD_REQUEST)
+
+    fix = fix.validated_data
+    if settings.POSITIONS_WRITE_BEHIND:
+        pending = await PendingPosition.objects.acreate(run=run, **fix)
+        return JsonResponse({'run': run.id, 'queued': pending.id}, status=status.HTTP_202_ACCEPTED)
+
+    try:
+        position = await sync_to_async(save_position)(run, fix)
+    except RunNotInProgress:
+        return JsonResponse({'run': ['Забег не запущен']}, status=status.HTTP_400_BAD_REQUEST)
+    return JsonResponse(PositionSerializer(position).data, status=status.HTTP_201_CREATED)
+
+
+@csrf_exempt
+@require_POST
+async def bulk_create_positions(request):
+    data = _json_body(request)
+    if data is None:
+        return JsonResponse({'error': 'Неверный JSON'}, status=status.HTTP_400_BAD_REQUEST)
+    results, response_status = await sync_to_async(ingest_bulk)(data)
+    return JsonResponse(results, status=response_status, safe=False)
+
+
+@require_GET
+async def retrieve_run(request, run_id):
+    run = await Run.objects.select_related('athlete').filter(pk=run_id).afirst()
+    if run is None:
+        return JsonResponse({'detail': 'No Run matches the given query.'}, status=status.HTTP_404_NOT_FOUND)
+    return JsonResponse(RunSerializer(run).data)
+
+
+@csrf_exempt
+@require_POST
+async def start_run(request, run_id):
+    if not await Run.objects.filter(pk=run_id).aexists():
+        return JsonResponse({'detail': 'No Run matches the given query.'}, status=status.HTTP_404_NOT_FOUND)
+    if await Run.objects.filter(pk=run_id, status=Run.STATUS_INIT).aupdate(status=Run.STATUS_IN_PROGRESS):
+        return JsonResponse({'message': 'Забег начат'})
+    return JsonResponse({}, status=status.HTTP_400_BAD_REQUEST)
+
+
+@csrf_exempt
+@require_POST
+async def stop_run(request, run_id):
+    run = await Run.objects.select_related('athlete').filter(pk=run_id).afirst()
+    if run is None:
+        return JsonResponse({'detail': 'No Run matches the given query.'}, status=status.HTTP_404_NOT_FOUND)
+    if run.status != Run.STATUS_IN_PROGRESS:
+        return JsonResponse({}, status=status.HTTP_400_BAD_REQUEST)
+    if settings.RUN_FINALIZATION_ASYNC:
+        job = await sync_to_async(enqueue_finalization)(run)
+        return JsonResponse(RunFinalizationJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+    await sync_to_async(complete_run)(run)
+    return JsonResponse(RunSerializer(run).data)
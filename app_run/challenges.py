@@ -0,0 +1,92 @@
+"""
+Challenge rules.
+
+Every rule names a field of the athlete's ``AthleteStats`` (the lifetime totals of their
+finished runs, see app_run/stats.py) and the threshold that earns it. When a run is finished,
+the rules the athlete has not earned yet are checked against that one row and the new awards
+are inserted in one ``bulk_create``. Adding a challenge means adding a rule, and a stats field
+if none fits.
+
+The public summary (who holds which challenge) is read with one grouped count query and one
+windowed query for a page of athletes per challenge. Pages are cached under the highest id and
+the number of the ``Challenge`` rows, read from the database on every request, so an award or a
+removal made by any process is seen by the next read.
+"""
+import operator
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.db.models import Count, F, Max, Window
+from django.db.models.functions import RowNumber
+
+from app_run.models import Challenge
+from app_run.serializers import AthleteChallengeSerializer
+from app_run.stats import athlete_stats
+
+SUMMARY_ATHLETES_LIMIT = 100
+SUMMARY_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+class ChallengeRule:
+    def __init__(self, name, metric, threshold, compare=operator.ge):
+        self.name = name
+        self.metric = metric
+        self.threshold = threshold
+        self.compare = compare
+
+    def is_met(self, stats):
+        value = getattr(stats, self.metric)
+        return value is not None and self.compare(value, self.threshold)
+
+
+RULES = [
+    ChallengeRule(Challenge.CHALLENGE_10_RUNS, 'runs_finished', 10),
+    ChallengeRule(Challenge.CHALLENGE_50KM, 'total_distance', 50),
+    ChallengeRule(Challenge.CHALLENGE_2KM_10MIN, 'best_2km_time', 600, operator.le),
+]
+
+
+def award_challenges(athlete):
+    """Award every challenge the athlete has earned and does not hold yet; returns the new awards."""
+    held = set(Challenge.objects.filter(athlete=athlete).values_list('full_name', flat=True))
+    rules = [rule for rule in RULES if rule.name not in held]
+    if not rules:
+        return []
+
+    stats = athlete_stats(athlete)
+    awards = [Challenge(athlete=athlete, full_name=rule.name) for rule in rules if rule.is_met(stats)]
+    # The unique (athlete, full_name) constraint settles races between concurrent finishes
+    Challenge.objects.bulk_create(awards, ignore_conflicts=True)
+    return awards
+
+
+def _summary_version():
+    version = Challenge.objects.aggregate(last_id=Max('id'), count=Count('id'))
+    return f"{version['last_id']}:{version['count']}"
+
+
+def _build_summary(offset, limit):
+    counts = Challenge.objects.order_by('full_name').values('full_name').annotate(athletes_count=Count('id'))
+    page = Challenge.objects.select_related('athlete').annotate(
+        position=Window(RowNumber(), partition_by=F('full_name'), order_by=F('id').asc())).filter(
+        position__gt=offset, position__lte=offset + limit).order_by('full_name', 'position')
+    athletes = defaultdict(list)
+    for challenge in page:
+        athletes[challenge.full_name].append(challenge.athlete)
+    return [{
+        'name_to_display': row['full_name'],
+        'athletes_count': row['athletes_count'],
+        'athletes': [dict(athlete) for athlete in
+                     AthleteChallengeSerializer(athletes[row['full_name']], many=True).data],
+        'next_offset': offset + limit if row['athletes_count'] > offset + limit else None,
+    } for row in counts]
+
+
+def challenge_summary(offset=0, limit=SUMMARY_ATHLETES_LIMIT):
+    """Every challenge with its number of holders and the holders from ``offset`` on, at most ``limit``."""
+    key = f'challenges:summary:{_summary_version()}:{offset}:{limit}'
+    summary = cache.get(key)
+    if summary is None:
+        summary = _build_summary(offset, limit)
+        cache.set(key, summary, SUMMARY_CACHE_TIMEOUT)
+    return summary
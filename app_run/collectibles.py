@@ -0,0 +1,93 @@
+import math
+import time
+import uuid
+from collections import defaultdict
+
+from app_run.distance import point_distance
+from app_run.models import CollectibleItem, CollectibleIndexState
+
+PICKUP_RADIUS_METERS = 100
+
+# Grid cell size of the in-process index: ~1.1 km along a meridian, so a pickup circle touches at most a few cells
+CELL_DEGREES = 0.01
+METERS_PER_DEGREE = 111320
+_CELLS_AROUND = round(360 / CELL_DEGREES)
+# Writes of other processes reach this process's index within this many seconds
+INDEX_CHECK_SECONDS = 10
+
+_index = None
+_checked_at = None
+
+
+def _row(latitude):
+    return math.floor(latitude / CELL_DEGREES)
+
+
+def _col(longitude):
+    return (math.floor(longitude / CELL_DEGREES) + _CELLS_AROUND // 2) % _CELLS_AROUND - _CELLS_AROUND // 2
+
+
+class CollectibleIndex:
+    """Grid of collectible items bucketed by (row, col) cells of ``CELL_DEGREES``."""
+
+    def __init__(self, items, token=None):
+        self.token = token
+        self.cells = defaultdict(list)
+        for item_id, latitude, longitude in items:
+            latitude, longitude = float(latitude), float(longitude)
+            self.cells[(_row(latitude), _col(longitude))].append((item_id, latitude, longitude))
+
+    def candidates(self, latitude, longitude, radius=PICKUP_RADIUS_METERS):
+        latitude, longitude = float(latitude), float(longitude)
+        d_lat = radius / METERS_PER_DEGREE
+        rows = range(_row(latitude - d_lat), _row(latitude + d_lat) + 1)
+
+        cos_lat = math.cos(math.radians(min(abs(latitude) + d_lat, 90)))
+        d_lon = radius / (METERS_PER_DEGREE * cos_lat) if cos_lat > 1e-9 else 180
+        if d_lon >= 180:
+            rows = set(rows)
+            cells = [cell for cell in self.cells if cell[0] in rows]
+        else:
+            first, last = math.floor((longitude - d_lon) / CELL_DEGREES), math.floor((longitude + d_lon) / CELL_DEGREES)
+            cols = {_col((col + 0.5) * CELL_DEGREES) for col in range(first, last + 1)}
+            cells = [(row, col) for row in rows for col in cols]
+
+        for cell in cells:
+            yield from self.cells.get(cell, ())
+
+    def nearby(self, latitude, longitude, radius=PICKUP_RADIUS_METERS):
+        return [item_id for item_id, item_latitude, item_longitude in self.candidates(latitude, longitude, radius)
+                if point_distance([latitude, longitude], [item_latitude, item_longitude], 'haversine') <= radius]
+
+
+def invalidate_index():
+    """Give the items a new token; call in the transaction that changed them."""
+    global _checked_at
+    token = uuid.uuid4().hex
+    if not CollectibleIndexState.objects.filter(pk=1).update(token=token):
+        CollectibleIndexState.objects.create(pk=1, token=token)
+    _checked_at = None
+
+
+def get_index():
+    """Process-wide index, rebuilt when the token in the database no longer matches it.
+
+    The token is read at most every ``INDEX_CHECK_SECONDS``, and right after this process changed the items.
+    """
+    global _index, _checked_at
+    now = time.monotonic()
+    if _index is None or _checked_at is None or now - _checked_at >= INDEX_CHECK_SECONDS:
+        token = CollectibleIndexState.objects.filter(pk=1).values_list('token', flat=True).first()
+        if _index is None or _index.token != token:
+            _index = CollectibleIndex(CollectibleItem.objects.values_list('id', 'latitude', 'longitude'), token)
+        _checked_at = now
+    return _index
+
+
+def collect_items(athlete, points):
+    index = get_index()
+    found = set()
+    for latitude, longitude in points:
+        found.update(index.nearby(latitude, longitude))
+    if found:
+        athlete.items.add(*CollectibleItem.objects.filter(id__in=found))
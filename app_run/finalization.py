@@ -0,0 +1,154 @@
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from app_run import heatmap
+from app_run.analytics import invalidate_athlete_coaches
+from app_run.challenges import award_challenges
+from app_run.distance import track_length
+from app_run.leaderboards import record_run
+from app_run.models import Run, RunFinalizationJob
+from app_run.profiles import invalidate_user_detail
+from app_run.splits import record_splits
+from app_run.stats import apply_finished_run
+from app_run.tracking import forget_tail, flush_pending
+from app_run.tracks import track_points, pack_track, runs_track_points
+
+# Accumulated totals follow the fixes in the order they arrived, recomputed ones the track ordered by time;
+# fixes that arrive out of order make them differ
+DRIFT_TOLERANCE = {
+    'positions_count': 0,
+    'distance': Decimal('0.01'),
+    'run_time_seconds': 1,
+    'speed': Decimal('0.01'),
+}
+
+
+def _time_and_speed(count, first_at, last_at, speed_avg):
+    if count >= 2 and first_at and last_at:
+        time = (last_at - first_at).total_seconds()
+        if time > 0:
+            return int(time), round(speed_avg, 2) if speed_avg else 0
+    return 0, 0
+
+
+def _point_totals(points):
+    count = len(points)
+    speed_avg = sum(point[3] for point in points) / count if count else None
+    run_time_seconds, speed = _time_and_speed(count, points[0][2] if points else None,
+                                              points[-1][2] if points else None, speed_avg)
+    return {'positions_count': count, 'distance': track_length(point[:2] for point in points) / 1000,
+            'run_time_seconds': run_time_seconds, 'speed': speed}
+
+
+def accumulated_totals(run):
+    """Totals from the aggregates kept up to date while the run's positions were ingested."""
+    speed_avg = run.speed_sum / run.positions_count if run.positions_count else None
+    run_time_seconds, speed = _time_and_speed(run.positions_count, run.first_position_at, run.last_position_at,
+                                              speed_avg)
+    return {'positions_count': run.positions_count, 'distance': run.distance_meters / 1000,
+            'run_time_seconds': run_time_seconds, 'speed': speed}
+
+
+def recomputed_totals(run):
+    """Totals recomputed from the raw positions (or the packed track) of the run."""
+    return _point_totals(track_points(run))
+
+
+def recomputed_totals_many(run_ids):
+    """{run_id: totals} recomputed for several runs, with their points read in bulk."""
+    return {run_id: _point_totals(points) for run_id, points in runs_track_points(run_ids).items()}
+
+
+def verify_run_totals(run, tolerance=None):
+    """Fields whose accumulated value drifted from the raw positions, as {field: (accumulated, recomputed)}."""
+    tolerance = {**DRIFT_TOLERANCE, **(tolerance or {})}
+    accumulated, recomputed = accumulated_totals(run), recomputed_totals(run)
+    return {field: (accumulated[field], recomputed[field]) for field in accumulated
+            if abs(Decimal(str(accumulated[field])) - Decimal(str(recomputed[field]))) > tolerance[field]}
+
+
+def finalize_run(run):
+    # Runs whose positions were not ingested through the API (or predate the aggregates) have nothing accumulated
+    totals = accumulated_totals(run) if run.positions_count else recomputed_totals(run)
+    run.status = Run.STATUS_FINISHED
+    # Quantized as stored, so what later steps of the stop add up matches the column
+    run.distance = Decimal(str(totals['distance'])).quantize(Decimal('0.0001'))
+    run.run_time_seconds = totals['run_time_seconds']
+    run.speed = totals['speed']
+    # Only the fields set here: the aggregates belong to ingestion
+    run.save(update_fields=['status', 'distance', 'run_time_seconds', 'speed'])
+    forget_tail(run)
+    if settings.PACK_FINISHED_TRACKS:
+        pack_track(run)
+    return run
+
+
+def complete_run(run):
+    """Everything that happens when an athlete stops a run."""
+    with transaction.atomic():
+        # Ingestion waits from here on, and the instance carries every aggregate committed before
+        run.refresh_from_db(from_queryset=Run.objects.select_for_update())
+        if flush_pending(run=run, skip_locked=False):
+            run.refresh_from_db()
+        finalize_run(run)
+        points = track_points(run)
+        record_splits(run, points)
+        if apply_finished_run(run):
+            record_run(run)
+        # Outside the stop transaction: tiles are shared by every run, their locks must not wait on it
+        transaction.on_commit(lambda: heatmap.add_run(run.pk, points), robust=True)
+        award_challenges(run.athlete)
+    invalidate_athlete_coaches([run.athlete_id])
+    invalidate_user_detail([run.athlete_id])
+    return run
+
+
+def enqueue_finalization(run):
+    """Mark the run finished right away and leave the heavy part to the worker."""
+    with transaction.atomic():
+        flush_pending(run=run, skip_locked=False)
+        run.status = Run.STATUS_FINISHED
+        run.save(update_fields=['status'])
+        job, _ = RunFinalizationJob.objects.update_or_create(
+            run=run, defaults={'status': RunFinalizationJob.STATUS_QUEUED, 'attempts': 0, 'error': ''})
+    return job
+
+
+def claim_jobs(limit, stale_after=timedelta(minutes=15)):
+    """Ids of up to ``limit`` queued jobs (and jobs of workers that died), now marked running."""
+    now = timezone.now()
+    jobs = RunFinalizationJob.objects.filter(
+        Q(status=RunFinalizationJob.STATUS_QUEUED)
+        | Q(status=RunFinalizationJob.STATUS_RUNNING, started_at__lt=now - stale_after)).order_by('id')
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            jobs = jobs.select_for_update(skip_locked=True)
+        ids = list(jobs.values_list('id', flat=True)[:limit])
+        RunFinalizationJob.objects.filter(id__in=ids).update(status=RunFinalizationJob.STATUS_RUNNING,
+                                                             started_at=now, attempts=F('attempts') + 1)
+    return ids
+
+
+def process_job(job_id):
+    """Finalize the run of a claimed job; failures are retried until RUN_FINALIZATION_MAX_ATTEMPTS."""
+    job = RunFinalizationJob.objects.select_related('run__athlete').get(pk=job_id)
+    started = time.monotonic()
+    try:
+        complete_run(job.run)
+    except Exception as exc:
+        job.status = RunFinalizationJob.STATUS_QUEUED \
+            if job.attempts < settings.RUN_FINALIZATION_MAX_ATTEMPTS else RunFinalizationJob.STATUS_FAILED
+        job.error = repr(exc)
+    else:
+        job.status = RunFinalizationJob.STATUS_DONE
+        job.error = ''
+    job.finished_at = timezone.now()
+    job.duration_ms = int((time.monotonic() - started) * 1000)
+    job.save(update_fields=['status', 'error', 'finished_at', 'duration_ms'])
+    return job.status
@@ -0,0 +1,194 @@
+"""
+Heatmap of where athletes run.
+
+Positions are binned into the web mercator tiles (z/x/y, as used by map clients) of every zoom
+in ``ZOOMS``; each tile is split into ``TILE_CELLS`` x ``TILE_CELLS`` cells and stores the
+number of positions per non-empty cell. A point's cell is computed once at the deepest zoom;
+coarser zooms are bit shifts of it. Cells are stored sparse: sorted cell indexes and their
+counts as varints, zlib compressed, so serving a tile never touches ``Position``.
+
+A finished run is added after its stop has committed, so the stop transaction holds no tile
+locks. Additions and ``rebuild_heatmap`` take the ``HeatmapState`` row lock first, and
+``Run.heatmap_applied`` keeps a run from being counted twice. A stop never waits for that lock:
+if a rebuild or another addition holds it, the run is left for ``add_pending_runs``, which the
+rebuild runs when it is done and ``rebuild_heatmap --pending`` runs on its own.
+"""
+import math
+import zlib
+from collections import defaultdict, Counter
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from app_run.models import Run, RunFinalizationJob, HeatmapTile, HeatmapState
+from app_run.tracks import write_varint, read_varint, runs_track_points
+
+ZOOMS = range(10, 17)
+_CELL_BITS = 6
+TILE_CELLS = 1 << _CELL_BITS
+MAX_LATITUDE = 85.05112878
+FORMAT_VERSION = 1
+
+
+def _global_cell(latitude, longitude):
+    """Cell coordinates of a point at the deepest zoom, over the whole world."""
+    latitude = max(-MAX_LATITUDE, min(MAX_LATITUDE, float(latitude)))
+    scale = 1 << (ZOOMS[-1] + _CELL_BITS)
+    x = (float(longitude) + 180) / 360 * scale
+    radians = math.radians(latitude)
+    y = (1 - math.log(math.tan(radians) + 1 / math.cos(radians)) / math.pi) / 2 * scale
+    return min(int(x), scale - 1), min(int(y), scale - 1)
+
+
+def bin_points(points, counts=None):
+    """Add (latitude, longitude, ...) points to ``counts``: {(zoom, x, y): Counter of cell index}."""
+    counts = defaultdict(Counter) if counts is None else counts
+    for point in points:
+        gx, gy = _global_cell(point[0], point[1])
+        for zoom in ZOOMS:
+            shift = ZOOMS[-1] - zoom
+            cx, cy = gx >> shift, gy >> shift
+            tile = (zoom, cx >> _CELL_BITS, cy >> _CELL_BITS)
+            counts[tile][(cy % TILE_CELLS) * TILE_CELLS + cx % TILE_CELLS] += 1
+    return counts
+
+
+def encode_cells(cells):
+    out = bytearray([FORMAT_VERSION])
+    indexes = sorted(cells)
+    write_varint(out, len(indexes))
+    previous = 0
+    for index in indexes:
+        write_varint(out, index - previous)
+        previous = index
+    for index in indexes:
+        write_varint(out, cells[index])
+    return zlib.compress(bytes(out))
+
+
+def decode_cells(data):
+    """{cell index: count} packed by ``encode_cells``."""
+    data = zlib.decompress(bytes(data))
+    if data[0] != FORMAT_VERSION:
+        raise ValueError(f'Unknown heatmap format {data[0]}')
+    count, offset = read_varint(data, 1)
+    indexes, index = [], 0
+    for _ in range(count):
+        delta, offset = read_varint(data, offset)
+        index += delta
+        indexes.append(index)
+    cells = {}
+    for index in indexes:
+        cells[index], offset = read_varint(data, offset)
+    return cells
+
+
+def merge_counts(counts, batch_size=500):
+    """Add binned counts to the stored tiles, creating the missing ones; tiles are locked in (zoom, x, y) order."""
+    tiles = sorted(counts)
+    for start in range(0, len(tiles), batch_size):
+        batch = tiles[start:start + batch_size]
+        query = Q()
+        for zoom, x, y in batch:
+            query |= Q(zoom=zoom, x=x, y=y)
+        with transaction.atomic():
+            existing = {(tile.zoom, tile.x, tile.y): tile for tile in
+                        HeatmapTile.objects.select_for_update().filter(query).order_by('zoom', 'x', 'y')}
+            updated, created = [], []
+            for key in batch:
+                tile = existing.get(key)
+                if tile is None:
+                    cells = counts[key]
+                    created.append(HeatmapTile(zoom=key[0], x=key[1], y=key[2], cells=encode_cells(cells),
+                                               total=sum(cells.values())))
+                else:
+                    cells = Counter(decode_cells(tile.cells))
+                    cells.update(counts[key])
+                    tile.cells, tile.total = encode_cells(cells), sum(cells.values())
+                    updated.append(tile)
+            HeatmapTile.objects.bulk_update(updated, ['cells', 'total'])
+            HeatmapTile.objects.bulk_create(created)
+
+
+def _lock(skip_locked=False):
+    """Lock the ``HeatmapState`` row; call inside a transaction. None if ``skip_locked`` and it is held."""
+    if skip_locked:
+        return HeatmapState.objects.select_for_update(skip_locked=True).filter(pk=1).first()
+    return HeatmapState.objects.select_for_update().get_or_create(pk=1)[0]
+
+
+def _finalizing():
+    return Q(finalization_job__status__in=[RunFinalizationJob.STATUS_QUEUED, RunFinalizationJob.STATUS_RUNNING])
+
+
+def _add_runs(run_ids, counts=None):
+    """Bin the points of the runs into ``counts`` and mark the runs added; merge the counts in the same transaction."""
+    counts = defaultdict(Counter) if counts is None else counts
+    for points in runs_track_points(run_ids).values():
+        bin_points(points, counts)
+    Run.objects.filter(id__in=run_ids, heatmap_applied=False).update(heatmap_applied=True)
+    return counts
+
+
+def add_run(run_id, points):
+    """Add the points of a finished run to the heatmap, once; call after the run's stop has committed.
+
+    Returns False if the run had been added already, or if the lock is held and the run is left for
+    ``add_pending_runs``.
+    """
+    with transaction.atomic():
+        if _lock(skip_locked=True) is None:
+            return False
+        if not Run.objects.filter(pk=run_id, heatmap_applied=False).update(heatmap_applied=True):
+            return False
+        if points:
+            merge_counts(bin_points(points))
+    return True
+
+
+def add_pending_runs(chunk=500):
+    """Add the finished runs whose addition met a held lock; returns the number of runs added."""
+    added = 0
+    while True:
+        with transaction.atomic():
+            _lock()
+            run_ids = list(Run.objects.filter(status=Run.STATUS_FINISHED, heatmap_applied=False).exclude(
+                _finalizing()).order_by('id').values_list('id', flat=True)[:chunk])
+            if not run_ids:
+                return added
+            merge_counts(_add_runs(run_ids))
+        added += len(run_ids)
+
+
+def rebuild_heatmap(chunk=500, max_tiles=50000):
+    """Recompute all tiles from the finished runs, holding at most ``max_tiles`` in memory; returns the tile count.
+
+    Runs one transaction under the ``HeatmapState`` lock; runs stopped meanwhile are added right after it.
+    """
+    with transaction.atomic():
+        state = _lock()
+        HeatmapTile.objects.all().delete()
+        # Runs already added stay in even if their finalization job has not been marked done yet
+        runs = Run.objects.filter(status=Run.STATUS_FINISHED).exclude(_finalizing() & Q(heatmap_applied=False))
+        run_ids = list(runs.order_by('id').values_list('id', flat=True))
+        Run.objects.filter(heatmap_applied=True).exclude(id__in=runs.values('id')).update(heatmap_applied=False)
+
+        counts = defaultdict(Counter)
+        for start in range(0, len(run_ids), chunk):
+            _add_runs(run_ids[start:start + chunk], counts)
+            if len(counts) >= max_tiles:
+                merge_counts(counts)
+                counts = defaultdict(Counter)
+        merge_counts(counts)
+        state.rebuilt_at = timezone.now()
+        state.save(update_fields=['rebuilt_at'])
+    add_pending_runs(chunk)
+    return HeatmapTile.objects.count()
+
+
+def tile_cells(zoom, x, y):
+    """Parallel lists of the non-empty cell indexes of a tile (row-major) and their counts."""
+    data = HeatmapTile.objects.filter(zoom=zoom, x=x, y=y).values_list('cells', flat=True).first()
+    cells = decode_cells(data) if data is not None else {}
+    return list(cells), list(cells.values())
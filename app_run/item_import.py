@@ -0,0 +1,89 @@
+"""
+Import of collectible items from an XLSX upload.
+
+The sheet is read in openpyxl read-only mode one row at a time, so memory does not grow with
+the file. Rows are validated ``batch_size`` at a time and every batch is written in its own
+transaction. By default every valid row is inserted with one ``bulk_create`` per batch; with
+``upsert`` items whose ``uid`` already exists are updated in place instead. Only the invalid
+rows are kept for the response. A failure partway raises ``ItemImportError`` with the number of
+rows the earlier, committed batches stored.
+"""
+from itertools import islice
+
+from django.db import transaction
+from openpyxl import load_workbook
+
+from app_run.collectibles import invalidate_index
+from app_run.models import CollectibleItem
+from app_run.profiles import invalidate_user_detail
+from app_run.serializers import CollectibleItemSerializer
+
+COLUMNS = ['name', 'uid', 'value', 'latitude', 'longitude', 'picture']
+IMPORT_BATCH_SIZE = 1000
+
+
+def sheet_rows(file):
+    """Value tuples of the active sheet's rows after the header; raises right away if ``file`` is not a workbook."""
+    workbook = load_workbook(file, read_only=True, data_only=True)
+
+    def rows():
+        try:
+            yield from workbook.active.iter_rows(min_row=2, values_only=True)
+        finally:
+            workbook.close()
+    return rows()
+
+
+def _save_batch(items, upsert):
+    """Store validated items; returns the ids of the updated ones."""
+    existing = []
+    if upsert:
+        # The last row of a uid wins
+        by_uid = {item['uid']: item for item in items}
+        existing = list(CollectibleItem.objects.filter(uid__in=by_uid))
+        for item in existing:
+            for field, value in by_uid[item.uid].items():
+                setattr(item, field, value)
+        found = {item.uid for item in existing}
+        items = [item for uid, item in by_uid.items() if uid not in found]
+    with transaction.atomic():
+        CollectibleItem.objects.bulk_update(existing, COLUMNS, batch_size=IMPORT_BATCH_SIZE)
+        CollectibleItem.objects.bulk_create([CollectibleItem(**item) for item in items], batch_size=IMPORT_BATCH_SIZE)
+    return [item.pk for item in existing]
+
+
+class ItemImportError(Exception):
+    def __init__(self, imported, cause):
+        super().__init__(str(cause))
+        self.imported = imported
+        self.cause = cause
+
+
+def import_items(rows, upsert=False, batch_size=IMPORT_BATCH_SIZE):
+    """Validate and store (name, uid, value, latitude, longitude, picture) rows.
+
+    Returns the number of stored rows and the invalid rows as lists.
+    """
+    rows = iter(rows)
+    imported, invalid = 0, []
+    try:
+        while batch := list(islice(rows, batch_size)):
+            valid = []
+            for row in batch:
+                serializer = CollectibleItemSerializer(data=dict(zip(COLUMNS, tuple(row) + (None,) * len(COLUMNS))))
+                if serializer.is_valid():
+                    valid.append(serializer.validated_data)
+                else:
+                    invalid.append(list(row))
+            if valid:
+                updated = _save_batch(valid, upsert)
+                imported += len(valid)
+                # bulk writes send no signals
+                invalidate_user_detail(CollectibleItem.user.through.objects.filter(
+                    collectibleitem_id__in=updated).values_list('user_id', flat=True).distinct())
+    except Exception as exc:
+        raise ItemImportError(imported, exc) from exc
+    finally:
+        if imported:
+            invalidate_index()
+    return imported, invalid
@@ -0,0 +1,153 @@
+"""
+Leaderboards.
+
+Every board keeps one ``LeaderboardEntry`` per athlete and period, scored by an aggregate over the
+athlete's finished runs of that period. Finishing a run folds the run into the entries of the
+current periods (one F-expression update per board), so reads never aggregate ``Run``: a top page
+is an index range scan over (board, period, score) and an athlete's rank is one indexed count of
+the better scores. Weekly and monthly boards rotate by their period key; old periods are dropped by
+``prune_leaderboards``. ``rebuild_leaderboards`` recomputes everything from ``Run``.
+"""
+from django.db import transaction
+from django.db.models import Count, Sum, Min, Q, F, Value, ExpressionWrapper, DecimalField
+from django.db.models.functions import Least, TruncWeek, TruncMonth
+from django.utils import timezone
+
+from app_run.models import Run, LeaderboardEntry
+from app_run.stats import counted_runs
+
+ALL_TIME = 'all'
+
+
+def period_key(period, day):
+    if period == 'week':
+        year, week, _ = day.isocalendar()
+        return f'{year}-W{week:02}'
+    if period == 'month':
+        return f'{day.year}-{day.month:02}'
+    return ALL_TIME
+
+
+class Leaderboard:
+    """``aggregate`` scores the runs of one athlete and period; ``lowest_first`` boards keep the minimum."""
+    TRUNC = {'week': TruncWeek, 'month': TruncMonth}
+
+    def __init__(self, name, period, aggregate, lowest_first=False):
+        self.name = name
+        self.period = period
+        self.aggregate = aggregate
+        self.lowest_first = lowest_first
+
+    def ordering(self):
+        return ['score', 'athlete_id'] if self.lowest_first else ['-score', 'athlete_id']
+
+    def better_than(self, score):
+        return Q(score__lt=score) if self.lowest_first else Q(score__gt=score)
+
+    def combine(self, score):
+        return Least(F('score'), Value(score)) if self.lowest_first else F('score') + score
+
+
+BOARDS = {board.name: board for board in [
+    Leaderboard('distance_week', 'week', Sum('distance')),
+    Leaderboard('distance_month', 'month', Sum('distance')),
+    # Projected 5 km time at the run's average pace, over runs of at least 5 km
+    Leaderboard('fastest_5km', ALL_TIME, Min(
+        ExpressionWrapper(F('run_time_seconds') * 5 / F('distance'), output_field=DecimalField()),
+        filter=Q(distance__gte=5, run_time_seconds__gt=0)), lowest_first=True),
+    Leaderboard('most_runs', ALL_TIME, Count('id')),
+]}
+
+
+def record_run(run):
+    """Fold a just finished run into every board; call once per run, inside the stop transaction."""
+    day = timezone.localdate(run.created_at)
+    scores = Run.objects.filter(pk=run.pk).aggregate(**{name: board.aggregate for name, board in BOARDS.items()})
+    for name, board in BOARDS.items():
+        score = scores[name]
+        if not score:
+            continue
+        score = round(score, 4)
+        period = period_key(board.period, day)
+        entry, created = LeaderboardEntry.objects.get_or_create(board=name, period=period, athlete_id=run.athlete_id,
+                                                                defaults={'score': score})
+        if not created:
+            LeaderboardEntry.objects.filter(pk=entry.pk).update(score=board.combine(score))
+
+
+def rebuild_leaderboards(names=None, athlete_ids=None):
+    """Recompute the given boards (all by default) from the finished runs; returns the number of entries.
+
+    With ``athlete_ids`` only the entries of those athletes are recomputed.
+    """
+    entries = []
+    for name in names or BOARDS:
+        board = BOARDS[name]
+        runs = counted_runs().order_by()
+        if athlete_ids is not None:
+            runs = runs.filter(athlete_id__in=athlete_ids)
+        if board.period == ALL_TIME:
+            rows = runs.values('athlete').annotate(score=board.aggregate)
+        else:
+            rows = runs.annotate(day=board.TRUNC[board.period]('created_at')).values('athlete', 'day').annotate(
+                score=board.aggregate)
+        entries += [LeaderboardEntry(board=name, period=period_key(board.period, row.get('day')),
+                                     athlete_id=row['athlete'], score=round(row['score'], 4))
+                    for row in rows if row['score']]
+
+    with transaction.atomic():
+        existing = LeaderboardEntry.objects.filter(board__in=names or BOARDS)
+        if athlete_ids is not None:
+            existing = existing.filter(athlete_id__in=athlete_ids)
+        existing.delete()
+        LeaderboardEntry.objects.bulk_create(entries, batch_size=1000)
+    return len(entries)
+
+
+def prune_leaderboards(keep=12):
+    """Drop entries of periodic boards older than the ``keep`` most recent periods; returns the number deleted."""
+    deleted = 0
+    for name, board in BOARDS.items():
+        if board.period == ALL_TIME:
+            continue
+        periods = list(LeaderboardEntry.objects.filter(board=name).values_list('period', flat=True).distinct()
+                       .order_by('-period')[keep:])
+        if periods:
+            deleted += LeaderboardEntry.objects.filter(board=name, period__in=periods).delete()[0]
+    return deleted
+
+
+def current_period(board):
+    return period_key(board.period, timezone.localdate())
+
+
+def _ranked(entries, first_rank, offset):
+    """Competition ranks ("1, 2, 2, 4") of a page of entries starting at ``offset``; the first has ``first_rank``."""
+    ranked, rank, previous = [], first_rank, None
+    for position, entry in enumerate(entries, start=offset + 1):
+        if previous is not None and entry.score != previous:
+            rank = position
+        previous = entry.score
+        ranked.append((rank, entry))
+    return ranked
+
+
+def top_entries(board, period, limit, offset=0):
+    entries = list(LeaderboardEntry.objects.filter(board=board.name, period=period).select_related('athlete')
+                   .order_by(*board.ordering())[offset:offset + limit])
+    if not entries:
+        return []
+    first_rank = rank_of_score(board, period, entries[0].score)
+    return _ranked(entries, first_rank, offset)
+
+
+def rank_of_score(board, period, score):
+    return LeaderboardEntry.objects.filter(board.better_than(score), board=board.name, period=period).count() + 1
+
+
+def athlete_rank(board, period, athlete_id):
+    """(rank, entry) of the athlete, or None if they are not on the board for this period."""
+    entry = LeaderboardEntry.objects.filter(board=board.name, period=period, athlete_id=athlete_id).first()
+    if entry is None:
+        return None
+    return rank_of_score(board, period, entry.score), entry
@@ -0,0 +1,45 @@
+import math
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from app_run.distance import MODELS, segment_lengths
+
+
+class Command(BaseCommand):
+    help = 'Compare speed and accuracy of the track distance models on a synthetic 1 Hz track'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--points', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        latitude, longitude, heading = 55.75, 37.61, 0.0
+        points = []
+        for _ in range(options['points']):
+            points.append((round(latitude, 6), round(longitude, 6)))
+            heading += rng.uniform(-0.3, 0.3)
+            step = rng.uniform(2, 5) / 111320
+            latitude += step * math.cos(heading)
+            longitude += step * math.sin(heading) / math.cos(math.radians(latitude))
+
+        reference = segment_lengths(points, 'karney')
+        reference_total = sum(reference)
+        segments = len(points) - 1
+        self.stdout.write(f'{len(points)} points, {reference_total / 1000:.3f} km')
+        self.stdout.write(f'{"model":<10} {"total, ms":>10} {"per segment, us":>16} {"track error":>12} '
+                          f'{"max segment error, m":>21}')
+        for model in MODELS:
+            best = None
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                lengths = segment_lengths(points, model)
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            track_error = abs(sum(lengths) - reference_total) / reference_total
+            segment_error = max(abs(a - b) for a, b in zip(lengths, reference))
+            self.stdout.write(f'{model:<10} {best * 1000:>10.1f} {best / segments * 1e6:>16.2f} '
+                              f'{track_error:>12.2e} {segment_error:>21.2e}')
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app_run.tracking import flush_pending, pending_stats
+
+
+class Command(BaseCommand):
+    help = 'Store queued positions (POSITIONS_WRITE_BEHIND) in per-run ordered batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep draining the queue until interrupted')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--batch', type=int, default=5000, help='Fixes per flush transaction')
+        parser.add_argument('--stats-every', type=float, default=60.0, help='Seconds between queue reports')
+
+    def handle(self, *args, **options):
+        flushed_total, reported_at = 0, time.monotonic()
+        while True:
+            flushed = flush_pending(limit=options['batch'])
+            flushed_total += flushed
+            drained = flushed < options['batch']
+            if not options['loop'] and drained:
+                self.report(flushed_total)
+                return
+            if time.monotonic() - reported_at >= options['stats_every']:
+                self.report(flushed_total)
+                flushed_total, reported_at = 0, time.monotonic()
+            if drained:
+                time.sleep(options['interval'])
+
+    def report(self, flushed):
+        stats = pending_stats()
+        self.stdout.write(f'Flushed {flushed}, queue depth {stats["queue_depth"]}, '
+                          f'lag {stats["flush_lag_seconds"]:.1f} s')
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from app_run.models import Run, Position
+from app_run.tracks import pack_track
+
+
+class Command(BaseCommand):
+    help = 'Pack the positions of finished runs into RunTrack and optionally drop the per-fix rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drop-positions', action='store_true',
+                            help='Delete Position rows of runs once their track is packed')
+        parser.add_argument('--before', help='Only runs created before this date (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        runs = Run.objects.filter(status=Run.STATUS_FINISHED).order_by('id')
+        if options['before']:
+            runs = runs.filter(created_at__date__lt=options['before'])
+
+        packed, dropped = 0, 0
+        for run in runs.filter(track__isnull=True).iterator():
+            if pack_track(run):
+                packed += 1
+        if options['drop_positions']:
+            for run in runs.filter(track__isnull=False).select_related('track').iterator():
+                with transaction.atomic():
+                    positions = Position.objects.filter(run=run)
+                    count = positions.count()
+                    if count and count != run.track.points:
+                        pack_track(run)
+                    dropped += positions.delete()[0]
+        self.stdout.write(f'Packed {packed} runs, dropped {dropped} positions')
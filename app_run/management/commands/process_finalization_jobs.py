@@ -0,0 +1,46 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from app_run.finalization import claim_jobs, process_job
+
+
+def _process_job(job_id):
+    try:
+        return process_job(job_id)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = 'Finalize stopped runs queued by RUN_FINALIZATION_ASYNC'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Jobs processed concurrently')
+        parser.add_argument('--processes', action='store_true', help='Use worker processes instead of threads')
+        parser.add_argument('--loop', action='store_true', help='Keep polling for jobs until interrupted')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to sleep when there are no jobs')
+        parser.add_argument('--stale-after', type=int, default=900,
+                            help='Seconds after which a running job is considered abandoned and retried')
+
+    def handle(self, *args, **options):
+        executor_class = ProcessPoolExecutor if options['processes'] else ThreadPoolExecutor
+        executor = executor_class(max_workers=options['workers'])
+
+        with executor:
+            while True:
+                job_ids = claim_jobs(options['workers'] * 4, timedelta(seconds=options['stale_after']))
+                if job_ids:
+                    if options['processes']:
+                        # Forked workers must not inherit the parent's database connection
+                        connections.close_all()
+                    statuses = list(executor.map(_process_job, job_ids))
+                    self.stdout.write(f'Processed {len(job_ids)} jobs: '
+                                      + ', '.join(f'{s} {statuses.count(s)}' for s in sorted(set(statuses))))
+                elif not options['loop']:
+                    return
+                else:
+                    time.sleep(options['interval'])
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from app_run.leaderboards import prune_leaderboards
+
+
+class Command(BaseCommand):
+    help = 'Delete entries of weekly and monthly leaderboards for periods that rotated out'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep', type=int, default=12, help='Most recent periods to keep per board')
+
+    def handle(self, *args, **options):
+        deleted = prune_leaderboards(options['keep'])
+        self.stdout.write(f'Deleted {deleted} leaderboard entries')
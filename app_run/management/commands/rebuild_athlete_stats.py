@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from app_run.stats import rebuild_athlete_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute AthleteStats from the finished runs of the given athletes (all athletes by default)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('athlete_ids', nargs='*', type=int)
+
+    def handle(self, *args, **options):
+        rebuilt = rebuild_athlete_stats(options['athlete_ids'] or None)
+        self.stdout.write(f'Rebuilt stats of {rebuilt} athletes')
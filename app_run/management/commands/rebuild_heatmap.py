@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from app_run.heatmap import rebuild_heatmap, add_pending_runs
+
+
+class Command(BaseCommand):
+    help = 'Recompute the heatmap tiles from the positions of all finished runs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk', type=int, default=500, help='Runs read per query batch')
+        parser.add_argument('--max-tiles', type=int, default=50000,
+                            help='Tiles accumulated in memory before they are written out')
+        parser.add_argument('--pending', action='store_true',
+                            help='Only add the finished runs that are not on the heatmap yet')
+
+    def handle(self, *args, **options):
+        if options['pending']:
+            added = add_pending_runs(options['chunk'])
+            self.stdout.write(f'Added {added} runs to the heatmap')
+            return
+        tiles = rebuild_heatmap(options['chunk'], options['max_tiles'])
+        self.stdout.write(f'Rebuilt {tiles} heatmap tiles')
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app_run.leaderboards import BOARDS, rebuild_leaderboards
+
+
+class Command(BaseCommand):
+    help = 'Recompute leaderboard entries from the finished runs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('boards', nargs='*', help=f'Boards to rebuild (all by default): {", ".join(BOARDS)}')
+
+    def handle(self, *args, **options):
+        unknown = set(options['boards']) - set(BOARDS)
+        if unknown:
+            raise CommandError(f'Unknown boards: {", ".join(sorted(unknown))}')
+        entries = rebuild_leaderboards(options['boards'] or None)
+        self.stdout.write(f'Rebuilt {entries} leaderboard entries')
@@ -0,0 +1,15 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from app_run.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Recompute the user name search tokens from first and last names'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk', type=int, default=1000, help='Tokens written per batch')
+
+    def handle(self, *args, **options):
+        tokens = rebuild_search_index(User.objects.all(), options['chunk'])
+        self.stdout.write(f'Indexed {tokens} search tokens')
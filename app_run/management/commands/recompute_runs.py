@@ -0,0 +1,113 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from decimal import Decimal
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections, transaction
+
+from app_run.finalization import recomputed_totals_many
+from app_run.leaderboards import rebuild_leaderboards
+from app_run.models import Run
+from app_run.profiles import invalidate_user_detail
+from app_run.splits import record_splits
+from app_run.stats import rebuild_athlete_stats
+from app_run.tracks import runs_track_points
+
+FIELDS = ['distance', 'run_time_seconds', 'speed']
+
+
+def _recompute_chunk(run_ids):
+    try:
+        return recomputed_totals_many(run_ids)
+    finally:
+        close_old_connections()
+
+
+def _stored_values(totals):
+    return {
+        'distance': Decimal(str(totals['distance'])).quantize(Decimal('0.0001')),
+        'run_time_seconds': totals['run_time_seconds'],
+        'speed': Decimal(str(totals['speed'])).quantize(Decimal('0.01')),
+    }
+
+
+class Command(BaseCommand):
+    help = ('Recompute distance, run_time_seconds and speed of finished runs from their positions, '
+            'then rebuild the splits, athlete stats and leaderboards built from them')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Only runs created on or after this date (YYYY-MM-DD)')
+        parser.add_argument('--athlete', type=int, action='append', help='Only runs of this athlete (repeatable)')
+        parser.add_argument('--chunk', type=int, default=200, help='Runs per worker task')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Worker processes; 0 recomputes in this process')
+        parser.add_argument('--checkpoint', help='File keeping the last processed run id; resumes from it if present')
+        parser.add_argument('--dry-run', action='store_true', help='Report the changes without writing them')
+
+    def handle(self, *args, **options):
+        runs = Run.objects.filter(status=Run.STATUS_FINISHED).order_by('id')
+        if options['since']:
+            runs = runs.filter(created_at__date__gte=options['since'])
+        if options['athlete']:
+            runs = runs.filter(athlete_id__in=options['athlete'])
+
+        checkpoint = Path(options['checkpoint']) if options['checkpoint'] else None
+        last_id = int(checkpoint.read_text()) if checkpoint and checkpoint.exists() else 0
+        chunk, dry_run = options['chunk'], options['dry_run']
+        checked, changed, athletes = 0, 0, set()
+        if last_id:
+            self.stdout.write(f'Resuming after run {last_id}')
+            # The interrupted pass may have changed runs of these athletes before rebuilding their stats
+            athletes.update(runs.filter(id__lte=last_id).order_by().values_list('athlete_id', flat=True).distinct())
+        workers = options['workers']
+        with ProcessPoolExecutor(max_workers=workers) if workers else nullcontext() as executor:
+            while True:
+                run_ids = list(runs.filter(id__gt=last_id).values_list('id', flat=True)[:chunk * max(workers, 1)])
+                if not run_ids:
+                    break
+                chunks = [run_ids[i:i + chunk] for i in range(0, len(run_ids), chunk)]
+                if executor:
+                    # Forked workers must not inherit the parent's database connection
+                    connections.close_all()
+                    results = executor.map(_recompute_chunk, chunks)
+                else:
+                    results = map(recomputed_totals_many, chunks)
+                totals = {}
+                for result in results:
+                    totals.update(result)
+
+                updates = []
+                for run in Run.objects.filter(id__in=run_ids).only('id', 'athlete_id', *FIELDS):
+                    values = _stored_values(totals[run.id])
+                    diff = {field: (getattr(run, field), value) for field, value in values.items()
+                            if getattr(run, field) != value}
+                    if not diff:
+                        continue
+                    if dry_run:
+                        self.stdout.write(f'Run {run.id}: ' + ', '.join(
+                            f'{field}: {old} -> {new}' for field, (old, new) in diff.items()))
+                    for field, value in values.items():
+                        setattr(run, field, value)
+                    updates.append(run)
+                    athletes.add(run.athlete_id)
+
+                if not dry_run:
+                    points = runs_track_points([run.id for run in updates])
+                    with transaction.atomic():
+                        Run.objects.bulk_update(updates, FIELDS, batch_size=1000)
+                        for run in updates:
+                            record_splits(run, points[run.id])
+                    if checkpoint:
+                        checkpoint.write_text(str(run_ids[-1]))
+                checked += len(run_ids)
+                changed += len(updates)
+                last_id = run_ids[-1]
+
+        if athletes and not dry_run:
+            # Everything else derived from the run totals still holds the old values
+            rebuild_athlete_stats(sorted(athletes))
+            rebuild_leaderboards()
+            invalidate_user_detail(sorted(athletes))
+        self.stdout.write(f'Checked {checked} runs, {"would change" if dry_run else "changed"} {changed}')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from app_run.ratings import reconcile_coach_ratings
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored coach rating sums and counts from the subscriptions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--coach', type=int, action='append', help='Only this coach (repeatable)')
+
+    def handle(self, *args, **options):
+        fixed = reconcile_coach_ratings(options['coach'])
+        self.stdout.write(f'Fixed {fixed} coach ratings')
@@ -0,0 +1,34 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from app_run.finalization import verify_run_totals
+from app_run.models import Run
+
+
+class Command(BaseCommand):
+    help = 'Recompute run totals from raw positions and report drift of the accumulated aggregates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('run_ids', nargs='*', type=int)
+        parser.add_argument('--distance-tolerance', type=Decimal, default=None,
+                            help='Allowed distance drift, km')
+
+    def handle(self, *args, **options):
+        runs = Run.objects.filter(positions_count__gt=0).order_by('id')
+        if options['run_ids']:
+            runs = runs.filter(id__in=options['run_ids'])
+        tolerance = {}
+        if options['distance_tolerance'] is not None:
+            tolerance['distance'] = options['distance_tolerance']
+
+        checked, drifted = 0, 0
+        for run in runs.iterator():
+            checked += 1
+            drift = verify_run_totals(run, tolerance)
+            if drift:
+                drifted += 1
+                details = ', '.join(f'{field}: {accumulated} != {recomputed}'
+                                    for field, (accumulated, recomputed) in drift.items())
+                self.stdout.write(f'Run {run.id}: {details}')
+        self.stdout.write(f'Checked {checked} runs, {drifted} drifted')
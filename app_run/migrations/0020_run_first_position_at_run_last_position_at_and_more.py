@@ -0,0 +1,47 @@
+# Generated by Django 5.2 on 2026-10-18 01:51
+
+from django.db import migrations, models
+from django.db.models import Count, Sum, Min, Max
+
+
+def fill_run_aggregates(apps, schema_editor):
+    Run = apps.get_model('app_run', 'Run')
+    Position = apps.get_model('app_run', 'Position')
+    aggregates = Position.objects.filter(run__status='in_progress').values('run').annotate(
+        count=Count('id'), speed_sum=Sum('speed'), first=Min('date_time'), last=Max('date_time'),
+        distance=Max('distance'))
+    for row in aggregates:
+        Run.objects.filter(pk=row['run']).update(positions_count=row['count'], speed_sum=row['speed_sum'] or 0,
+                                                 first_position_at=row['first'], last_position_at=row['last'],
+                                                 distance=row['distance'] or 0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0019_subscribe_rating'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='run',
+            name='first_position_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='last_position_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='positions_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='speed_sum',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=20),
+        ),
+        migrations.RunPython(fill_run_aggregates, migrations.RunPython.noop),
+    ]
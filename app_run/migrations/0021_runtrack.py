@@ -0,0 +1,22 @@
+# Generated by Django 5.2 on 2026-10-18 01:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0020_run_first_position_at_run_last_position_at_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RunTrack',
+            fields=[
+                ('run', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='track', serialize=False, to='app_run.run')),
+                ('points', models.IntegerField(default=0)),
+                ('data', models.BinaryField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2 on 2026-10-18 01:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0022_position_app_run_pos_run_id_a1bde1_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingPosition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('latitude', models.DecimalField(decimal_places=4, max_digits=6)),
+                ('longitude', models.DecimalField(decimal_places=4, max_digits=7)),
+                ('date_time', models.DateTimeField()),
+                ('received_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app_run.run')),
+            ],
+        ),
+    ]
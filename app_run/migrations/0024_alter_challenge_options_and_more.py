@@ -0,0 +1,31 @@
+# Generated by Django 5.2 on 2026-10-18 02:00
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def remove_duplicate_challenges(apps, schema_editor):
+    Challenge = apps.get_model('app_run', 'Challenge')
+    keep = Challenge.objects.values('athlete', 'full_name').annotate(first_id=Min('id')).values('first_id')
+    Challenge.objects.exclude(id__in=keep).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0023_pendingposition'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='challenge',
+            options={'ordering': ['id']},
+        ),
+        migrations.RunPython(remove_duplicate_challenges, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='challenge',
+            constraint=models.UniqueConstraint(fields=('athlete', 'full_name'), name='unique_athlete_challenge'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2 on 2026-10-18 02:03
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum, Max, Min, Q
+
+
+def fill_athlete_stats(apps, schema_editor):
+    Run = apps.get_model('app_run', 'Run')
+    AthleteStats = apps.get_model('app_run', 'AthleteStats')
+    runs = Run.objects.filter(status='finished').exclude(finalization_job__status__in=['queued', 'running'])
+    rows = runs.order_by().values('athlete').annotate(
+        runs_finished=Count('id'), total_distance=Sum('distance'), total_time_seconds=Sum('run_time_seconds'),
+        speed_sum=Sum('speed'), best_speed=Max('speed'), longest_distance=Max('distance'),
+        best_2km_time=Min('run_time_seconds', filter=Q(distance__gte=2, run_time_seconds__gt=0)),
+        last_run_at=Max('created_at'))
+    AthleteStats.objects.bulk_create([
+        AthleteStats(athlete_id=row['athlete'], runs_finished=row['runs_finished'],
+                     total_distance=row['total_distance'] or 0, total_time_seconds=row['total_time_seconds'] or 0,
+                     speed_sum=row['speed_sum'] or 0, best_speed=row['best_speed'] or 0,
+                     longest_distance=row['longest_distance'] or 0, best_2km_time=row['best_2km_time'],
+                     last_run_at=row['last_run_at'])
+        for row in rows], batch_size=1000)
+    runs.update(stats_applied=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0025_runfinalizationjob'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AthleteStats',
+            fields=[
+                ('athlete', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('runs_finished', models.IntegerField(default=0)),
+                ('total_distance', models.DecimalField(decimal_places=4, default=0, max_digits=20)),
+                ('total_time_seconds', models.BigIntegerField(default=0)),
+                ('speed_sum', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('best_speed', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('longest_distance', models.DecimalField(decimal_places=4, default=0, max_digits=20)),
+                ('best_2km_time', models.IntegerField(blank=True, null=True)),
+                ('last_run_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='stats_applied',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(fill_athlete_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2 on 2026-10-18 02:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def fill_daily_stats(apps, schema_editor):
+    Run = apps.get_model('app_run', 'Run')
+    AthleteDailyStats = apps.get_model('app_run', 'AthleteDailyStats')
+    rows = Run.objects.filter(stats_applied=True).annotate(day=TruncDate('created_at')).order_by().values(
+        'athlete', 'day').annotate(runs=Count('id'), distance=Sum('distance'), time_seconds=Sum('run_time_seconds'),
+                                   speed_sum=Sum('speed'))
+    AthleteDailyStats.objects.bulk_create([
+        AthleteDailyStats(athlete_id=row['athlete'], day=row['day'], runs=row['runs'], distance=row['distance'] or 0,
+                          time_seconds=row['time_seconds'] or 0, speed_sum=row['speed_sum'] or 0)
+        for row in rows], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0026_athletestats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AthleteDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('runs', models.IntegerField(default=0)),
+                ('distance', models.DecimalField(decimal_places=4, default=0, max_digits=20)),
+                ('time_seconds', models.BigIntegerField(default=0)),
+                ('speed_sum', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('athlete', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('athlete', 'day'), name='unique_athlete_day')],
+            },
+        ),
+        migrations.RunPython(fill_daily_stats, migrations.RunPython.noop),
+    ]
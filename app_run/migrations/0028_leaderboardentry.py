@@ -0,0 +1,30 @@
+# Generated by Django 5.2 on 2026-10-18 02:07
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0027_athletedailystats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('board', models.CharField(max_length=32)),
+                ('period', models.CharField(max_length=16)),
+                ('score', models.DecimalField(decimal_places=4, max_digits=20)),
+                ('athlete', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leaderboard_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['board', 'period', 'score', 'athlete'], name='app_run_lea_board_04dad4_idx')],
+                'constraints': [models.UniqueConstraint(fields=('board', 'period', 'athlete'), name='unique_board_entry')],
+            },
+        ),
+    ]
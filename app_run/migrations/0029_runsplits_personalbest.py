@@ -0,0 +1,40 @@
+# Generated by Django 5.2 on 2026-10-18 02:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0028_leaderboardentry'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RunSplits',
+            fields=[
+                ('run', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='splits', serialize=False, to='app_run.run')),
+                ('splits', models.JSONField(default=list)),
+                ('best_1km', models.FloatField(blank=True, null=True)),
+                ('best_5km', models.FloatField(blank=True, null=True)),
+                ('best_10km', models.FloatField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PersonalBest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('distance', models.IntegerField()),
+                ('seconds', models.FloatField()),
+                ('athlete', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='personal_bests', to=settings.AUTH_USER_MODEL)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='personal_bests', to='app_run.run')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['distance', 'seconds'], name='app_run_per_distanc_b2ae7e_idx')],
+                'constraints': [models.UniqueConstraint(fields=('athlete', 'distance'), name='unique_personal_best')],
+            },
+        ),
+    ]
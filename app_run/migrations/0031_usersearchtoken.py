@@ -0,0 +1,62 @@
+# Generated by Django 5.2 on 2026-10-18 02:16
+
+import re
+import unicodedata
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# The tokenizer of app_run/search.py as of this migration, so later changes to it don't alter the backfill
+MAX_TOKEN_LENGTH = 20
+WORD_WEIGHT = 2
+PREFIX_WEIGHT = 1
+_WORD = re.compile(r'\w+')
+
+
+def _words(text):
+    text = unicodedata.normalize('NFKC', text or '').casefold().replace('ё', 'е')
+    return [word[:MAX_TOKEN_LENGTH] for word in _WORD.findall(text)]
+
+
+def name_tokens(first_name, last_name):
+    tokens = {}
+    for word in _words(first_name) + _words(last_name):
+        for length in range(1, len(word) + 1):
+            weight = WORD_WEIGHT if length == len(word) else PREFIX_WEIGHT
+            tokens[word[:length]] = max(weight, tokens.get(word[:length], 0))
+    return tokens
+
+
+def fill_search_tokens(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    UserSearchToken = apps.get_model('app_run', 'UserSearchToken')
+    UserSearchToken.objects.bulk_create([
+        UserSearchToken(user_id=user_id, token=token, weight=weight)
+        for user_id, first_name, last_name in User.objects.values_list('id', 'first_name', 'last_name').iterator()
+        for token, weight in name_tokens(first_name, last_name).items()], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0030_heatmaptile'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=20)),
+                ('weight', models.SmallIntegerField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['token', '-weight', 'user'], name='user_search_token_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'token'), name='unique_user_token')],
+            },
+        ),
+        migrations.RunPython(fill_search_tokens, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2 on 2026-10-18 02:17
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def fill_coach_ratings(apps, schema_editor):
+    Subscribe = apps.get_model('app_run', 'Subscribe')
+    CoachRating = apps.get_model('app_run', 'CoachRating')
+    rows = Subscribe.objects.order_by().values('coach').annotate(rating_sum=Sum('rating'), rating_count=Count('rating'))
+    CoachRating.objects.bulk_create([
+        CoachRating(coach_id=row['coach'], rating_sum=row['rating_sum'] or 0, rating_count=row['rating_count'])
+        for row in rows], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0031_usersearchtoken'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoachRating',
+            fields=[
+                ('coach', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_totals', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('rating_sum', models.IntegerField(default=0)),
+                ('rating_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(fill_coach_ratings, migrations.RunPython.noop),
+    ]
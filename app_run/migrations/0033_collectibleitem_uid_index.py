@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 02:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0032_coachrating'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='collectibleitem',
+            name='uid',
+            field=models.CharField(db_index=True, max_length=8),
+        ),
+    ]
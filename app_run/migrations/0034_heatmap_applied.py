@@ -0,0 +1,34 @@
+# Generated by Django 5.2 on 2026-10-18 02:28
+
+from django.db import migrations, models
+
+
+def mark_applied_runs(apps, schema_editor):
+    Run = apps.get_model('app_run', 'Run')
+    HeatmapState = apps.get_model('app_run', 'HeatmapState')
+    # Finished runs were added to the tiles together with their stats
+    Run.objects.filter(status='finished', stats_applied=True).update(heatmap_applied=True)
+    HeatmapState.objects.create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0033_collectibleitem_uid_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HeatmapState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rebuilt_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='heatmap_applied',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(mark_applied_runs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2 on 2026-10-18 02:44
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_distance_meters(apps, schema_editor):
+    Run = apps.get_model('app_run', 'Run')
+    # Runs in progress keep chaining from what they have accumulated so far
+    Run.objects.filter(positions_count__gt=0).update(distance_meters=F('distance') * 1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0034_heatmap_applied'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='run',
+            name='distance_meters',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(fill_distance_meters, migrations.RunPython.noop),
+    ]
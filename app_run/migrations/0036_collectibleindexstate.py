@@ -0,0 +1,27 @@
+# Generated by Django 5.2 on 2026-10-18 02:46
+
+import uuid
+
+from django.db import migrations, models
+
+
+def create_state(apps, schema_editor):
+    apps.get_model('app_run', 'CollectibleIndexState').objects.create(pk=1, token=uuid.uuid4().hex)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0035_run_distance_meters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CollectibleIndexState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(default='', max_length=32)),
+            ],
+        ),
+        migrations.RunPython(create_state, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2 on 2026-10-18 02:48
+
+from django.db import migrations, models
+
+
+def create_state(apps, schema_editor):
+    apps.get_model('app_run', 'PositionFlushState').objects.create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0036_collectibleindexstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PositionFlushState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_flush_at', models.DateTimeField(blank=True, null=True)),
+                ('last_flush_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_state, migrations.RunPython.noop),
+    ]
@@ -22,10 +22,72 @@ class Run(models.Model):
     run_time_seconds = models.IntegerField(default=0)
     speed = models.DecimalField(max_digits=10, decimal_places=2, default=0)
 
+    # Running aggregates of the ingested positions, so finishing a run does not re-read them
+    positions_count = models.IntegerField(default=0)
+    # Unrounded length (m) of the chained segments; ``distance`` of each fix is rounded to 0.1 m
+    distance_meters = models.FloatField(default=0)
+    speed_sum = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    first_position_at = models.DateTimeField(null=True, blank=True)
+    last_position_at = models.DateTimeField(null=True, blank=True)
+    # Set once the finished run has been added to the athlete's AthleteStats
+    stats_applied = models.BooleanField(default=False)
+    # Set once the finished run's positions have been added to the heatmap tiles
+    heatmap_applied = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [models.Index(fields=['created_at', 'id'])]
+
     def __str__(self):
         return f'Забег {self.id}, {self.athlete}: {self.status}'
 
 
+class AthleteStats(models.Model):
+    """Lifetime totals of the athlete's finished runs, updated as runs finish, see app_run/stats.py."""
+    athlete = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    runs_finished = models.IntegerField(default=0)
+    total_distance = models.DecimalField(max_digits=20, decimal_places=4, default=0)
+    total_time_seconds = models.BigIntegerField(default=0)
+    speed_sum = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    best_speed = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    longest_distance = models.DecimalField(max_digits=20, decimal_places=4, default=0)
+    best_2km_time = models.IntegerField(null=True, blank=True)
+    last_run_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.athlete}: {self.runs_finished} забегов'
+
+
+class AthleteDailyStats(models.Model):
+    """Totals of the runs an athlete finished, per day the run was started; rolled up by the trends endpoint."""
+    athlete = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_stats')
+    day = models.DateField()
+    runs = models.IntegerField(default=0)
+    distance = models.DecimalField(max_digits=20, decimal_places=4, default=0)
+    time_seconds = models.BigIntegerField(default=0)
+    speed_sum = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['athlete', 'day'], name='unique_athlete_day')]
+
+    def __str__(self):
+        return f'{self.athlete}, {self.day}: {self.runs} забегов'
+
+
+class LeaderboardEntry(models.Model):
+    """Score of an athlete on one period of a leaderboard, see app_run/leaderboards.py."""
+    board = models.CharField(max_length=32)
+    period = models.CharField(max_length=16)
+    athlete = models.ForeignKey(User, on_delete=models.CASCADE, related_name='leaderboard_entries')
+    score = models.DecimalField(max_digits=20, decimal_places=4)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['board', 'period', 'athlete'], name='unique_board_entry')]
+        indexes = [models.Index(fields=['board', 'period', 'score', 'athlete'])]
+
+    def __str__(self):
+        return f'{self.board} {self.period}, {self.athlete}: {self.score}'
+
+
 class AthleteInfo(models.Model):
     weight = models.IntegerField(null=True)
     goals = models.CharField(max_length=1024, null=True, blank=True)
@@ -46,6 +108,10 @@ class Challenge(models.Model):
     full_name = models.CharField(max_length=255, choices=CHALLENGE_CHOICES, blank=False, null=False)
     athlete = models.ForeignKey(User, on_delete=models.CASCADE)
 
+    class Meta:
+        ordering = ['id']
+        constraints = [models.UniqueConstraint(fields=['athlete', 'full_name'], name='unique_athlete_challenge')]
+
     def __str__(self):
         return f'{self.athlete}: {self.full_name}'
 
@@ -58,13 +124,137 @@ class Position(models.Model):
     speed = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     distance = models.DecimalField(max_digits=20, decimal_places=4, default=0)
 
+    class Meta:
+        indexes = [models.Index(fields=['run', 'date_time', 'id'])]
+
+    def __str__(self):
+        return f'{self.run}, lat: {self.latitude} long: {self.longitude}'
+
+
+class PendingPosition(models.Model):
+    """Validated fix waiting for the flush_positions worker when POSITIONS_WRITE_BEHIND is on."""
+    run = models.ForeignKey(Run, on_delete=models.CASCADE)
+    latitude = models.DecimalField(decimal_places=4, max_digits=6)
+    longitude = models.DecimalField(decimal_places=4, max_digits=7)
+    date_time = models.DateTimeField()
+    received_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
     def __str__(self):
         return f'{self.run}, lat: {self.latitude} long: {self.longitude}'
 
 
+class RunFinalizationJob(models.Model):
+    """Deferred finalization of a stopped run, processed by the process_finalization_jobs worker."""
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = (
+        (STATUS_QUEUED, 'queued'),
+        (STATUS_RUNNING, 'running'),
+        (STATUS_DONE, 'done'),
+        (STATUS_FAILED, 'failed'),
+    )
+
+    run = models.OneToOneField(Run, on_delete=models.CASCADE, related_name='finalization_job')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED, db_index=True)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration_ms = models.IntegerField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.run}: {self.status}'
+
+
+class RunTrack(models.Model):
+    """Packed positions of a finished run, see app_run/tracks.py."""
+    run = models.OneToOneField(Run, on_delete=models.CASCADE, primary_key=True, related_name='track')
+    points = models.IntegerField(default=0)
+    data = models.BinaryField()
+
+    def __str__(self):
+        return f'{self.run}: {self.points} точек'
+
+
+class RunSplits(models.Model):
+    """Per-km split times and best efforts of a finished run, see app_run/splits.py."""
+    run = models.OneToOneField(Run, on_delete=models.CASCADE, primary_key=True, related_name='splits')
+    splits = models.JSONField(default=list)
+    best_1km = models.FloatField(null=True, blank=True)
+    best_5km = models.FloatField(null=True, blank=True)
+    best_10km = models.FloatField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.run}: {len(self.splits)} км'
+
+
+class PersonalBest(models.Model):
+    athlete = models.ForeignKey(User, on_delete=models.CASCADE, related_name='personal_bests')
+    distance = models.IntegerField()
+    seconds = models.FloatField()
+    run = models.ForeignKey(Run, on_delete=models.CASCADE, related_name='personal_bests')
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['athlete', 'distance'], name='unique_personal_best')]
+        indexes = [models.Index(fields=['distance', 'seconds'])]
+
+    def __str__(self):
+        return f'{self.athlete}, {self.distance} м: {self.seconds} с'
+
+
+class HeatmapTile(models.Model):
+    """Position counts per grid cell of one web map tile, see app_run/heatmap.py."""
+    zoom = models.SmallIntegerField()
+    x = models.IntegerField()
+    y = models.IntegerField()
+    cells = models.BinaryField()
+    total = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['zoom', 'x', 'y'], name='unique_heatmap_tile')]
+
+    def __str__(self):
+        return f'{self.zoom}/{self.x}/{self.y}: {self.total}'
+
+
+class HeatmapState(models.Model):
+    """Single row that heatmap writers lock, so adding a run never interleaves with a rebuild."""
+    rebuilt_at = models.DateTimeField(null=True, blank=True)
+
+
+class PositionFlushState(models.Model):
+    """Single row with the last flush of the write-behind queue, so every process reports the same one."""
+    last_flush_at = models.DateTimeField(null=True, blank=True)
+    last_flush_count = models.IntegerField(default=0)
+
+
+class CollectibleIndexState(models.Model):
+    """Single row whose token changes with every write to the collectible items; see app_run/collectibles.py."""
+    token = models.CharField(max_length=32, default='')
+
+
+class UserSearchToken(models.Model):
+    """A case-folded word of a user's name or a prefix of one, see app_run/search.py."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='search_tokens')
+    token = models.CharField(max_length=20)
+    weight = models.SmallIntegerField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user', 'token'], name='unique_user_token')]
+        indexes = [models.Index(fields=['token', '-weight', 'user'], name='user_search_token_idx')]
+
+    def __str__(self):
+        return f'{self.token}: {self.user}'
+
+
 class CollectibleItem(models.Model):
     name = models.CharField(max_length=255, blank=False, null=False)
-    uid = models.CharField(max_length=8, blank=False, null=False)
+    # Not unique in existing data; indexed for the upsert of uploads
+    uid = models.CharField(max_length=8, blank=False, null=False, db_index=True)
     latitude = models.DecimalField(decimal_places=4, max_digits=6)
     longitude = models.DecimalField(decimal_places=4, max_digits=7)
     picture = models.URLField()
@@ -85,3 +275,13 @@ class Subscribe(models.Model):
     athlete = models.ForeignKey(User, on_delete=models.CASCADE, related_name='coaches')
     rating = models.PositiveSmallIntegerField(null=True, choices=CHOICES_RATE, default=None)
     coach = models.ForeignKey(User, on_delete=models.CASCADE, related_name='athletes')
+
+
+class CoachRating(models.Model):
+    """Sum and count of the ratings a coach got from subscribed athletes, see app_run/ratings.py."""
+    coach = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='rating_totals')
+    rating_sum = models.IntegerField(default=0)
+    rating_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.coach}: {self.rating_sum}/{self.rating_count}'
@@ -0,0 +1,107 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from bisect import bisect_left
+
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Forward cursor pagination keyed on ``(ordering_field, seq)``.
+
+    ``seq`` numbers the rows sharing a value of the field, in id order, so the same key
+    addresses a position whether the track is read from ``Position`` or decoded from its
+    packed form: a cursor handed out before a run is packed keeps working after. Each page
+    is a range scan that starts right after the last row of the previous page, so it costs
+    the same at any depth and does not skip or repeat rows when new ones are inserted. Like
+    RunUserPagination it only kicks in when the client passes ``size``. A descending
+    ``ordering`` on the field is supported. Pages carry ``next`` and ``results`` only: there
+    is no ``count`` (that is the COUNT query this avoids) and no ``previous``.
+    """
+    ordering_field = None
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'size'
+    max_page_size = 1000
+    invalid_cursor_message = 'Неверный курсор'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return None
+        return min(size, self.max_page_size) if size > 0 else None
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            value, seq = json.loads(urlsafe_b64decode(encoded.encode()))
+            value = parse_datetime(value)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if value is None or not isinstance(seq, int) or seq < 0:
+            raise NotFound(self.invalid_cursor_message)
+        return value, seq
+
+    def encode_cursor(self, value, seq):
+        return urlsafe_b64encode(json.dumps([value.isoformat(), seq]).encode()).decode()
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.request = request
+        cursor = self.decode_cursor(request)
+        field = self.ordering_field
+
+        if isinstance(queryset, list):
+            # Rows already ordered by (field, id) without ids: a decoded packed track
+            start = 0
+            if cursor:
+                start = bisect_left(queryset, cursor[0], key=lambda item: getattr(item, field)) + cursor[1] + 1
+            page = queryset[start:start + self.page_size + 1]
+        else:
+            descending = bool(queryset.query.order_by) and queryset.query.order_by[0] == f'-{field}'
+            queryset = queryset.order_by(f'-{field}', '-id') if descending else queryset.order_by(field, 'id')
+            start = 0
+            if cursor:
+                # Rows equal to the cursor's value come first; the cursor's seq of them were already served
+                queryset = queryset.filter(**{f'{field}__{"lte" if descending else "gte"}': cursor[0]})
+                start = cursor[1] + 1
+            page = list(queryset[start:start + self.page_size + 1])
+        keys = self._keys(page, field, cursor)
+
+        self.next_cursor = self.encode_cursor(*keys[self.page_size - 1]) if len(page) > self.page_size else None
+        return page[:self.page_size]
+
+    @staticmethod
+    def _keys(page, field, cursor):
+        previous, seq = cursor if cursor else (None, -1)
+        keys = []
+        for item in page:
+            value = getattr(item, field)
+            seq = seq + 1 if value == previous else 0
+            previous = value
+            keys.append((value, seq))
+        return keys
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+
+class RunCursorPagination(KeysetPagination):
+    ordering_field = 'created_at'
+
+
+class PositionCursorPagination(KeysetPagination):
+    ordering_field = 'date_time'
@@ -0,0 +1,64 @@
+"""
+User detail read model.
+
+The detail of a user is one annotated query (runs_finished from ``AthleteStats``, the coach
+rating from ``CoachRating``, the athlete's latest coach) plus one prefetch (an athlete's items
+or a coach's athlete ids). With ``USER_DETAIL_CACHE`` on, the serialized detail is cached per user and dropped when
+the user's subscriptions, collected items or finished runs change.
+"""
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import OuterRef, Subquery, prefetch_related_objects
+from django.db.models.functions import Coalesce
+
+from app_run.models import Subscribe
+from app_run.ratings import coach_rating
+from app_run.serializers import AthleteDetailSerializer, CoachDetailSerializer
+
+USER_DETAIL_CACHE_TIMEOUT = 60 * 60
+
+
+def _detail_key(user_id):
+    return f'user:{user_id}:detail'
+
+
+def detail_queryset():
+    return User.objects.filter(is_superuser=False).annotate(
+        runs_finished=Coalesce('stats__runs_finished', 0),
+        rating=coach_rating(),
+        coach=Subquery(Subscribe.objects.filter(athlete=OuterRef('pk')).order_by('-id').values('coach_id')[:1]))
+
+
+def _build_detail(user_id):
+    user = detail_queryset().filter(pk=user_id).first()
+    if user is None:
+        return None
+    prefetch_related_objects([user], 'athletes' if user.is_staff else 'items')
+    serializer_class = CoachDetailSerializer if user.is_staff else AthleteDetailSerializer
+    return serializer_class(user).data
+
+
+def user_detail(user_id):
+    """Serialized detail of a non-superuser, or None if there is no such user."""
+    if not settings.USER_DETAIL_CACHE:
+        return _build_detail(user_id)
+    key = _detail_key(user_id)
+    detail = cache.get(key)
+    if detail is None:
+        detail = _build_detail(user_id)
+        if detail is not None:
+            cache.set(key, detail, USER_DETAIL_CACHE_TIMEOUT)
+    return detail
+
+
+def invalidate_user_detail(user_ids):
+    """Drop the cached details once the current transaction commits.
+
+    ``user_ids`` may be a lazy queryset: it is not evaluated while the cache is off, and otherwise it is
+    evaluated right away, while the rows it reads (e.g. holders of an item being deleted) still exist.
+    """
+    if settings.USER_DETAIL_CACHE:
+        keys = [_detail_key(user_id) for user_id in user_ids]
+        transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,85 @@
+"""
+Coach ratings.
+
+Every coach's ``CoachRating`` row keeps the sum and count of the ratings given by subscribed
+athletes. Subscribing and rating update it with F-expressions in the same transaction as the
+subscription, and a deleted rated subscription is subtracted by a signal. The user list and
+detail read ``rating_sum / rating_count`` instead of averaging ``Subscribe``.
+``reconcile_coach_ratings`` recomputes the rows from the subscriptions.
+"""
+from django.db import transaction
+from django.db.models import Count, Sum, F, FloatField
+from django.db.models.functions import Cast, NullIf
+
+from app_run.models import Subscribe, CoachRating
+
+
+def coach_rating():
+    """Average rating of the coach of a User queryset row; None without ratings, as ``Avg`` would give."""
+    return Cast('rating_totals__rating_sum', FloatField()) / NullIf('rating_totals__rating_count', 0)
+
+
+def _add(coach_id, rating_sum, rating_count):
+    CoachRating.objects.get_or_create(coach_id=coach_id)
+    if rating_sum or rating_count:
+        CoachRating.objects.filter(coach_id=coach_id).update(rating_sum=F('rating_sum') + rating_sum,
+                                                             rating_count=F('rating_count') + rating_count)
+
+
+def subscribe(athlete, coach):
+    with transaction.atomic():
+        subscription = Subscribe.objects.create(athlete=athlete, coach=coach)
+        _add(coach.id, 0, 0)
+    return subscription
+
+
+def rate(subscription, rating):
+    """Set the athlete's rating of the coach, replacing the previous one in the coach's totals."""
+    with transaction.atomic():
+        subscription = Subscribe.objects.select_for_update().get(pk=subscription.pk)
+        previous = subscription.rating
+        subscription.rating = rating
+        subscription.save(update_fields=['rating'])
+        if previous is None:
+            _add(subscription.coach_id, rating, 1)
+        else:
+            _add(subscription.coach_id, rating - previous, 0)
+    return subscription
+
+
+def subscription_deleted(subscription):
+    if subscription.rating is not None:
+        CoachRating.objects.filter(coach_id=subscription.coach_id).update(
+            rating_sum=F('rating_sum') - subscription.rating, rating_count=F('rating_count') - 1)
+
+
+def reconcile_coach_ratings(coach_ids=None):
+    """Recompute the totals of the given coaches (all when None) from the subscriptions; returns the fixed ones."""
+    subscriptions = Subscribe.objects.all()
+    existing = CoachRating.objects.all()
+    if coach_ids is not None:
+        subscriptions = subscriptions.filter(coach_id__in=coach_ids)
+        existing = existing.filter(coach_id__in=coach_ids)
+    expected = {row['coach']: (row['rating_sum'] or 0, row['rating_count'])
+                for row in subscriptions.order_by().values('coach').annotate(
+                    rating_sum=Sum('rating'), rating_count=Count('rating'))}
+    stored = {row.coach_id: row for row in existing}
+
+    fixed = []
+    for coach_id, (rating_sum, rating_count) in expected.items():
+        row = stored.pop(coach_id, None) or CoachRating(coach_id=coach_id)
+        if row._state.adding or (row.rating_sum, row.rating_count) != (rating_sum, rating_count):
+            row.rating_sum, row.rating_count = rating_sum, rating_count
+            fixed.append(row)
+    # Rows of coaches left without subscriptions
+    for row in stored.values():
+        if row.rating_sum or row.rating_count:
+            row.rating_sum = row.rating_count = 0
+            fixed.append(row)
+
+    created = [row for row in fixed if row._state.adding]
+    updated = [row for row in fixed if not row._state.adding]
+    with transaction.atomic():
+        CoachRating.objects.bulk_create(created, batch_size=1000)
+        CoachRating.objects.bulk_update(updated, ['rating_sum', 'rating_count'], batch_size=1000)
+    return len(fixed)
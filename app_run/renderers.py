@@ -0,0 +1,13 @@
+from rest_framework.renderers import JSONRenderer
+
+
+class PolylineRenderer(JSONRenderer):
+    """Track as a Google encoded polyline, selected with ?format=polyline or the Accept header."""
+    media_type = 'application/vnd.polyline+json'
+    format = 'polyline'
+
+
+class ColumnarRenderer(JSONRenderer):
+    """Track as parallel arrays, selected with ?format=columnar or the Accept header."""
+    media_type = 'application/vnd.columnar+json'
+    format = 'columnar'
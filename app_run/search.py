@@ -0,0 +1,110 @@
+"""
+Name search over users.
+
+Every word of a user's first and last name is case-folded and stored in ``UserSearchToken``
+together with all of its prefixes (edge n-grams), so a search term is an equality lookup on an
+indexed column instead of an ``icontains`` scan of ``auth_user``. A user matches when every term
+of the query is a prefix of one of their name words; users whose whole words match more terms
+rank first. A ``User`` post_save signal keeps the tokens current; ``rebuild_search_index``
+recomputes them.
+"""
+import re
+import unicodedata
+
+from django.db import transaction
+from django.db.models import Count, Sum, OuterRef, Subquery
+from rest_framework.filters import BaseFilterBackend
+
+from app_run.models import UserSearchToken
+
+MAX_TOKEN_LENGTH = 20
+WORD_WEIGHT = 2
+PREFIX_WEIGHT = 1
+_WORD = re.compile(r'\w+')
+
+
+def normalize(text):
+    return unicodedata.normalize('NFKC', text or '').casefold().replace('ё', 'е')
+
+
+def _words(text):
+    return [word[:MAX_TOKEN_LENGTH] for word in _WORD.findall(normalize(text))]
+
+
+def name_tokens(first_name, last_name):
+    """{token: weight} of a name: every word and every prefix of it; a whole word outweighs a prefix."""
+    tokens = {}
+    for word in _words(first_name) + _words(last_name):
+        for length in range(1, len(word) + 1):
+            weight = WORD_WEIGHT if length == len(word) else PREFIX_WEIGHT
+            tokens[word[:length]] = max(weight, tokens.get(word[:length], 0))
+    return tokens
+
+
+def query_tokens(query):
+    return list(dict.fromkeys(_words(query)))
+
+
+def _user_tokens(user_id, first_name, last_name):
+    return [UserSearchToken(user_id=user_id, token=token, weight=weight)
+            for token, weight in name_tokens(first_name, last_name).items()]
+
+
+def index_user(user):
+    with transaction.atomic():
+        UserSearchToken.objects.filter(user=user).delete()
+        UserSearchToken.objects.bulk_create(_user_tokens(user.pk, user.first_name, user.last_name))
+
+
+def rebuild_search_index(users, chunk=1000):
+    """Recompute the tokens of all ``users`` (a User queryset); returns the number of tokens."""
+    UserSearchToken.objects.all().delete()
+    created, batch = 0, []
+    for row in users.order_by('id').values_list('id', 'first_name', 'last_name').iterator(chunk_size=chunk):
+        batch += _user_tokens(*row)
+        if len(batch) >= chunk:
+            created += len(UserSearchToken.objects.bulk_create(batch))
+            batch = []
+    created += len(UserSearchToken.objects.bulk_create(batch))
+    return created
+
+
+def _matches(tokens):
+    """Per user rank of the users whose tokens cover every query token."""
+    return (UserSearchToken.objects.filter(token__in=tokens).values('user')
+            .annotate(matched=Count('id'), rank=Sum('weight')).filter(matched=len(tokens)))
+
+
+def search_users(queryset, query):
+    """``queryset`` narrowed to the users matching ``query``, best ranked first."""
+    tokens = query_tokens(query)
+    if not tokens:
+        return queryset
+    matches = _matches(tokens)
+    return queryset.filter(pk__in=matches.values('user')).annotate(
+        search_rank=Subquery(matches.filter(user=OuterRef('pk')).values('rank'))).order_by('-search_rank', 'id')
+
+
+def autocomplete(queryset, query, limit):
+    """The best ``limit`` users of ``queryset`` whose names start with the words of ``query``."""
+    tokens = query_tokens(query)
+    if not tokens:
+        return []
+    if len(tokens) == 1:
+        # Walks the (token, -weight, user) index and stops after ``limit`` hits
+        ranked = (UserSearchToken.objects.filter(token=tokens[0], user__in=queryset).order_by('-weight', 'user')
+                  .values_list('user', flat=True)[:limit])
+    else:
+        ranked = (_matches(tokens).filter(user__in=queryset).order_by('-rank', 'user')
+                  .values_list('user', flat=True)[:limit])
+    user_ids = list(ranked)
+    users = queryset.in_bulk(user_ids)
+    return [users[user_id] for user_id in user_ids]
+
+
+class UserSearchFilter(BaseFilterBackend):
+    """Drop-in for ``SearchFilter`` on user names, backed by the token index."""
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        return search_users(queryset, request.query_params.get(self.search_param, ''))
@@ -1,10 +1,11 @@
 from django.contrib.auth.models import User
-from geopy.distance import geodesic
 from rest_framework import serializers
 from rest_framework.fields import SerializerMethodField
 from rest_framework.serializers import ModelSerializer
 
-from app_run.models import Run, AthleteInfo, Challenge, Position, CollectibleItem, Subscribe
+from app_run.collectibles import collect_items
+from app_run.models import Run, AthleteInfo, Challenge, Position, CollectibleItem, Subscribe, RunFinalizationJob, \
+    RunSplits, PersonalBest
 
 
 class CollectibleItemSerializer(ModelSerializer):
@@ -44,22 +45,17 @@ class CoachDetailSerializer(UserSerializer):
         fields = UserSerializer.Meta.fields + ['athletes']
 
     def get_athletes(self, obj):
-        subscribes = obj.athletes.all()
-        athletes = [s.athlete.id for s in subscribes]
-        return athletes
+        return [subscribe.athlete_id for subscribe in obj.athletes.all()]
 
 
 class AthleteDetailSerializer(UserSerializer):
     items = CollectibleItemSerializer(read_only=True, many=True)
-    coach = SerializerMethodField()
+    # Id of the athlete's latest coach, annotated by app_run.profiles.detail_queryset
+    coach = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = User
-        fields = UserSerializer.Meta.fields + ['items', 'coach']
-
-    def get_coach(self, obj):
-        subscribe = obj.coaches.last()
-        return subscribe.coach.id if subscribe else None
+        fields = [field for field in UserSerializer.Meta.fields if field != 'rating'] + ['items', 'coach']
 
 
 class AthleteSerializer(ModelSerializer):
@@ -106,7 +102,25 @@ class AthleteChallengeSerializer(ModelSerializer):
         return f'{obj.first_name} {obj.last_name}'
 
 
-class PositionSerializer(ModelSerializer):
+class PositionFixSerializer(ModelSerializer):
+    date_time = serializers.DateTimeField()
+
+    class Meta:
+        model = Position
+        fields = ['latitude', 'longitude', 'date_time']
+
+    def validate_latitude(self, value):
+        if not (-90 <= value <= 90):
+            raise serializers.ValidationError('Недопустимое значение широты')
+        return value
+
+    def validate_longitude(self, value):
+        if not (-180 <= value <= 180):
+            raise serializers.ValidationError('Недопустимое значение долготы')
+        return value
+
+
+class PositionSerializer(PositionFixSerializer):
     date_time = serializers.DateTimeField(format='%Y-%m-%dT%H:%M:%S.%f')
 
     class Meta:
@@ -116,10 +130,7 @@ class PositionSerializer(ModelSerializer):
 
     def create(self, validated_data):
         athlete_position = [validated_data.get('latitude'), validated_data.get('longitude')]
-        athlete = validated_data.get('run').athlete
-        for item in CollectibleItem.objects.all():
-            if geodesic(athlete_position, [item.latitude, item.longitude]).m <= 100:
-                athlete.items.add(item)
+        collect_items(validated_data.get('run').athlete, [athlete_position])
         return super().create(validated_data)
 
     def validate_run(self, value):
@@ -127,14 +138,14 @@ class PositionSerializer(ModelSerializer):
             raise serializers.ValidationError('Забег не запущен')
         return value
 
-    def validate_latitude(self, value):
-        if not (-90 <= value <= 90):
-            raise serializers.ValidationError('Недопустимое значение широты')
-        return value
 
-    def validate_longitude(self, value):
-        if not (-180 <= value <= 180):
-            raise serializers.ValidationError('Недопустимое значение долготы')
+class BulkPositionSerializer(serializers.Serializer):
+    run = serializers.PrimaryKeyRelatedField(queryset=Run.objects.select_related('athlete'))
+    positions = serializers.ListField(child=serializers.DictField(), allow_empty=False, max_length=1000)
+
+    def validate_run(self, value):
+        if value.status != 'in_progress':
+            raise serializers.ValidationError('Забег не запущен')
         return value
 
 
@@ -148,4 +159,25 @@ class SubscribeSerializer(ModelSerializer):
             raise serializers.ValidationError('Поле рейтинг обязательно')
         if not (1 <= value <= 5):
             raise serializers.ValidationError('Недопустимое значение для рейтинга (1-5)')
-        return value
\ No newline at end of file
+        return value
+
+
+class RunFinalizationJobSerializer(ModelSerializer):
+    class Meta:
+        model = RunFinalizationJob
+        fields = ['id', 'run', 'status', 'attempts', 'error', 'created_at', 'started_at', 'finished_at',
+                  'duration_ms']
+
+
+class RunSplitsSerializer(ModelSerializer):
+    class Meta:
+        model = RunSplits
+        fields = ['run', 'splits', 'best_1km', 'best_5km', 'best_10km']
+
+
+class PersonalBestSerializer(ModelSerializer):
+    achieved_at = serializers.DateTimeField(source='run.created_at', read_only=True)
+
+    class Meta:
+        model = PersonalBest
+        fields = ['distance', 'seconds', 'run', 'achieved_at']
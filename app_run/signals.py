@@ -0,0 +1,85 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from app_run.analytics import invalidate_coach_analytics
+from app_run.collectibles import invalidate_index
+from app_run.leaderboards import rebuild_leaderboards
+from app_run.models import CollectibleItem, Subscribe, Run
+from app_run.profiles import invalidate_user_detail
+from app_run.ratings import subscription_deleted
+from app_run.search import index_user
+from app_run.stats import rebuild_athlete_stats
+
+
+@receiver(post_save, sender=CollectibleItem)
+@receiver(post_delete, sender=CollectibleItem)
+def collectible_items_changed(sender, **kwargs):
+    invalidate_index()
+
+
+@receiver(post_save, sender=Subscribe)
+@receiver(post_delete, sender=Subscribe)
+def subscriptions_changed(sender, instance, **kwargs):
+    invalidate_coach_analytics([instance.coach_id])
+    invalidate_user_detail([instance.athlete_id, instance.coach_id])
+
+
+@receiver(post_delete, sender=Subscribe)
+def subscription_removed(sender, instance, **kwargs):
+    subscription_deleted(instance)
+
+
+@receiver(post_save, sender=CollectibleItem)
+def collectible_item_saved(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_user_detail(instance.user.values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=CollectibleItem)
+def collectible_item_deleting(sender, instance, **kwargs):
+    invalidate_user_detail(instance.user.values_list('id', flat=True))
+
+
+@receiver(m2m_changed, sender=CollectibleItem.user.through)
+def collected_items_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # reverse: ``user.items`` changed; otherwise ``item.user``
+    if action in ('post_add', 'post_remove'):
+        invalidate_user_detail([instance.pk] if reverse else pk_set)
+    elif action == 'pre_clear':
+        invalidate_user_detail([instance.pk] if reverse else instance.user.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, update_fields, **kwargs):
+    invalidate_user_detail([instance.pk])
+    # Logins save only last_login
+    if update_fields is None or {'first_name', 'last_name'} & set(update_fields):
+        index_user(instance)
+
+
+def _rebuild_athlete_totals(athlete_id):
+    """Recompute the stats, daily rollups and leaderboard entries of the athlete once the change commits."""
+    def rebuild():
+        # The athlete may be gone with the run (user deletion cascades)
+        athlete_ids = list(User.objects.filter(pk=athlete_id).values_list('pk', flat=True))
+        if athlete_ids:
+            rebuild_athlete_stats(athlete_ids)
+            rebuild_leaderboards(athlete_ids=athlete_ids)
+            invalidate_user_detail(athlete_ids)
+    transaction.on_commit(rebuild)
+
+
+@receiver(post_save, sender=Run)
+def run_saved(sender, instance, update_fields, **kwargs):
+    # The stop path saves named fields and adds the run to the totals itself; full saves come from
+    # the runs API and the admin, which can create, edit or reopen finished runs
+    if update_fields is None and (instance.status == Run.STATUS_FINISHED or instance.stats_applied):
+        _rebuild_athlete_totals(instance.athlete_id)
+
+
+@receiver(post_delete, sender=Run)
+def run_deleted(sender, instance, **kwargs):
+    if instance.stats_applied:
+        _rebuild_athlete_totals(instance.athlete_id)
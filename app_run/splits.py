@@ -0,0 +1,74 @@
+"""
+Per-km splits and best efforts of a run.
+
+Both come out of one pass over the cumulative distance and elapsed time of the run's points:
+splits are the times at which each full kilometre is crossed, and every best effort keeps a
+trailing pointer to the last point at least that distance behind the current one. Crossing
+times are interpolated linearly between points. Results are stored per run in ``RunSplits``;
+``PersonalBest`` keeps each athlete's best time per effort distance.
+"""
+from app_run.distance import segment_lengths
+from app_run.models import RunSplits, PersonalBest
+from app_run.tracks import track_points
+
+EFFORTS = {'best_1km': 1000, 'best_5km': 5000, 'best_10km': 10000}
+
+
+def _interpolate(distances, times, i, target):
+    """Time at which ``target`` metres were reached, between points i and i + 1."""
+    span = distances[i + 1] - distances[i]
+    if not span:
+        return times[i + 1]
+    return times[i] + (times[i + 1] - times[i]) * (target - distances[i]) / span
+
+
+def splits_and_efforts(distances, times):
+    """Split seconds of every full km and {effort: seconds or None} from cumulative metres and elapsed seconds."""
+    splits, next_km, last_crossing = [], 1000, 0.0
+    starts = dict.fromkeys(EFFORTS, 0)
+    best = dict.fromkeys(EFFORTS)
+    for j in range(1, len(distances)):
+        while distances[j] >= next_km:
+            crossing = _interpolate(distances, times, j - 1, next_km)
+            splits.append(round(crossing - last_crossing, 1))
+            last_crossing, next_km = crossing, next_km + 1000
+
+        for name, length in EFFORTS.items():
+            if distances[j] < length:
+                continue
+            i = starts[name]
+            while distances[j] - distances[i + 1] >= length:
+                i += 1
+            starts[name] = i
+            elapsed = times[j] - _interpolate(distances, times, i, distances[j] - length)
+            if best[name] is None or elapsed < best[name]:
+                best[name] = elapsed
+    return splits, {name: round(value, 1) if value is not None else None for name, value in best.items()}
+
+
+def _cumulative(points):
+    # From the coordinates under the current distance model, like the recomputed run totals; the stored
+    # distance chain follows the order the fixes arrived in and the model they were ingested with
+    distances, total = [0.0], 0.0
+    for length in segment_lengths([point[:2] for point in points]):
+        total += length
+        distances.append(total)
+    times = [(point[2] - points[0][2]).total_seconds() for point in points]
+    return distances, times
+
+
+def record_splits(run, points=None):
+    """Store the splits of a just finished run and raise the athlete's personal bests it beat."""
+    points = track_points(run) if points is None else points
+    splits, efforts = splits_and_efforts(*_cumulative(points)) if points else ([], dict.fromkeys(EFFORTS))
+    run_splits, _ = RunSplits.objects.update_or_create(run=run, defaults={'splits': splits, **efforts})
+
+    for name, seconds in efforts.items():
+        if seconds is None:
+            continue
+        distance = EFFORTS[name]
+        if not PersonalBest.objects.filter(athlete_id=run.athlete_id, distance=distance, seconds__gt=seconds).update(
+                seconds=seconds, run=run):
+            PersonalBest.objects.get_or_create(athlete_id=run.athlete_id, distance=distance,
+                                               defaults={'seconds': seconds, 'run': run})
+    return run_splits
@@ -0,0 +1,146 @@
+"""
+Per-athlete lifetime totals (``AthleteStats``).
+
+Finishing a run adds it to the athlete's row with one F-expression update inside the stop
+transaction, so the user list, challenge checks and coach analytics never aggregate the whole
+run history. ``Run.stats_applied`` makes that step idempotent when finalization is retried.
+The same step adds the run to the athlete's ``AthleteDailyStats`` row of the day it was started,
+which the coach trends are rolled up from. ``rebuild_athlete_stats`` recomputes both from the runs.
+"""
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, Sum, Max, Min, Q, F, Value
+from django.db.models.functions import Coalesce, Greatest, Least, TruncDate
+from django.utils import timezone
+
+from app_run.analytics import invalidate_athlete_coaches
+from app_run.models import Run, AthleteStats, AthleteDailyStats, RunFinalizationJob
+
+TOTALS = {
+    'runs_finished': Count('id'),
+    'total_distance': Sum('distance'),
+    'total_time_seconds': Sum('run_time_seconds'),
+    'speed_sum': Sum('speed'),
+    'best_speed': Max('speed'),
+    'longest_distance': Max('distance'),
+    'best_2km_time': Min('run_time_seconds', filter=Q(distance__gte=2, run_time_seconds__gt=0)),
+    'last_run_at': Max('created_at'),
+}
+
+NULLABLE_TOTALS = {'best_2km_time', 'last_run_at'}
+
+DAILY_TOTALS = {
+    'runs': Count('id'),
+    'distance': Sum('distance'),
+    'time_seconds': Sum('run_time_seconds'),
+    'speed_sum': Sum('speed'),
+}
+
+
+def counted_runs():
+    """Finished runs that belong in the stats.
+
+    Runs still waiting for their finalization job are not final yet, unless the job has already added them
+    and only has to be marked done.
+    """
+    return Run.objects.filter(status=Run.STATUS_FINISHED).exclude(
+        Q(finalization_job__status__in=[RunFinalizationJob.STATUS_QUEUED, RunFinalizationJob.STATUS_RUNNING])
+        & Q(stats_applied=False))
+
+
+def _lock_athletes(athlete_ids=None):
+    """Lock the user rows of the athletes (all when None); every writer of their stats takes this lock first."""
+    users = User.objects.select_for_update().order_by('pk')
+    if athlete_ids is not None:
+        users = users.filter(pk__in=athlete_ids)
+    list(users.values_list('pk', flat=True))
+
+
+def rebuild_athlete_stats(athlete_ids=None, excluding_run_id=None):
+    """Recompute the stats of the given athletes (all when None) from their runs; returns the number of rows.
+
+    ``excluding_run_id`` leaves one run (and its ``stats_applied`` flag) out, for the caller to add.
+    """
+    runs, all_runs = counted_runs(), Run.objects.all()
+    if excluding_run_id is not None:
+        runs, all_runs = runs.exclude(pk=excluding_run_id), all_runs.exclude(pk=excluding_run_id)
+    existing, existing_days = AthleteStats.objects.all(), AthleteDailyStats.objects.all()
+    if athlete_ids is not None:
+        runs = runs.filter(athlete_id__in=athlete_ids)
+        all_runs = all_runs.filter(athlete_id__in=athlete_ids)
+        existing = existing.filter(athlete_id__in=athlete_ids)
+        existing_days = existing_days.filter(athlete_id__in=athlete_ids)
+
+    with transaction.atomic():
+        # A stop adding a run waits for the rebuild, or the rebuild reads the runs after the stop committed
+        _lock_athletes(athlete_ids)
+        rows = runs.order_by().values('athlete').annotate(**TOTALS)
+        stats = [AthleteStats(athlete_id=row.pop('athlete'),
+                              **{field: value if value is not None or field in NULLABLE_TOTALS else 0
+                                 for field, value in row.items()})
+                 for row in rows]
+        # Athletes asked for by id get a row even without finished runs, so the next read is a plain lookup
+        found = {item.athlete_id for item in stats}
+        stats += [AthleteStats(athlete_id=athlete_id) for athlete_id in athlete_ids or () if athlete_id not in found]
+        days = [AthleteDailyStats(athlete_id=row.pop('athlete'),
+                                  **{field: value or 0 for field, value in row.items()})
+                for row in runs.annotate(day=TruncDate('created_at')).order_by().values('athlete', 'day').annotate(
+                    **DAILY_TOTALS)]
+
+        existing.delete()
+        existing_days.delete()
+        AthleteStats.objects.bulk_create(stats, batch_size=1000)
+        AthleteDailyStats.objects.bulk_create(days, batch_size=1000)
+        runs.update(stats_applied=True)
+        all_runs.filter(stats_applied=True).exclude(id__in=runs.values('id')).update(stats_applied=False)
+        invalidate_athlete_coaches(athlete_ids)
+    return len(stats)
+
+
+def athlete_stats(athlete):
+    stats = AthleteStats.objects.filter(athlete=athlete).first()
+    if stats is None:
+        rebuild_athlete_stats([athlete.pk])
+        stats = AthleteStats.objects.get(athlete=athlete)
+    return stats
+
+
+def apply_finished_run(run):
+    """Add a just finished run to its athlete's stats, once; call inside the stop transaction.
+
+    Returns False if the run had already been added, so callers can hang other once-per-run work on it.
+    """
+    _lock_athletes([run.athlete_id])
+    if not Run.objects.filter(pk=run.pk, stats_applied=False).update(stats_applied=True):
+        return False
+    if not AthleteStats.objects.filter(athlete_id=run.athlete_id).exists():
+        # First finished run since the stats were introduced: build the row from the rest of the history
+        rebuild_athlete_stats([run.athlete_id], excluding_run_id=run.pk)
+
+    distance = Decimal(str(run.distance))
+    speed = Decimal(str(run.speed))
+    changes = {
+        'runs_finished': F('runs_finished') + 1,
+        'total_distance': F('total_distance') + distance,
+        'total_time_seconds': F('total_time_seconds') + run.run_time_seconds,
+        'speed_sum': F('speed_sum') + speed,
+        'best_speed': Greatest(F('best_speed'), Value(speed)),
+        'longest_distance': Greatest(F('longest_distance'), Value(distance)),
+        'last_run_at': Coalesce(Greatest(F('last_run_at'), Value(run.created_at)), Value(run.created_at)),
+    }
+    if distance >= 2 and run.run_time_seconds > 0:
+        changes['best_2km_time'] = Coalesce(Least(F('best_2km_time'), Value(run.run_time_seconds)),
+                                            Value(run.run_time_seconds))
+    AthleteStats.objects.filter(athlete_id=run.athlete_id).update(**changes)
+
+    day = timezone.localdate(run.created_at)
+    AthleteDailyStats.objects.get_or_create(athlete_id=run.athlete_id, day=day)
+    AthleteDailyStats.objects.filter(athlete_id=run.athlete_id, day=day).update(
+        runs=F('runs') + 1,
+        distance=F('distance') + distance,
+        time_seconds=F('time_seconds') + run.run_time_seconds,
+        speed_sum=F('speed_sum') + speed,
+    )
+    return True
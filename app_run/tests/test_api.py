@@ -1,19 +1,45 @@
+import io
 import json
+import tempfile
 import time
 from decimal import Decimal
+from pathlib import Path
+from unittest import mock
 
 from django.contrib.auth.models import User
-from django.db.models import Count, Q
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.db.models import Count, F, Q
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from geopy.distance import geodesic
+from openpyxl import Workbook
 from rest_framework import status
 from rest_framework.test import APITestCase
 
-from app_run.distance import calculate_distance
-from app_run.models import Run, AthleteInfo, Challenge, Position, CollectibleItem, Subscribe
-from app_run.serializers import RunSerializer, UserSerializer, ChallengeSerializer, AthleteInfoSerializer
+from app_run.challenges import award_challenges
+from app_run.collectibles import collect_items, get_index, INDEX_CHECK_SECONDS
+from app_run.distance import calculate_distance, segment_lengths, point_distance
+from app_run.tracking import last_position, flush_pending, save_position, RunNotInProgress
+from app_run.tracks import encode_track, decode_track, track_points, simplify_track, encode_polyline, pack_track
+from app_run.finalization import accumulated_totals, recomputed_totals, recomputed_totals_many, verify_run_totals, \
+    claim_jobs, process_job, complete_run
+from app_run.models import Run, AthleteInfo, Challenge, Position, CollectibleItem, Subscribe, RunTrack, \
+    RunFinalizationJob, AthleteStats, AthleteDailyStats, LeaderboardEntry, PersonalBest, \
+    HeatmapTile, UserSearchToken, CoachRating, PendingPosition, CollectibleIndexState, RunSplits
+from app_run import item_import
+from app_run.item_import import import_items, ItemImportError
+from app_run.heatmap import add_run, add_pending_runs, bin_points, encode_cells, decode_cells, rebuild_heatmap, ZOOMS
+from app_run.leaderboards import rebuild_leaderboards, prune_leaderboards, current_period, BOARDS
+from app_run.ratings import reconcile_coach_ratings
+from app_run.search import name_tokens, rebuild_search_index
+from app_run.splits import splits_and_efforts, record_splits
+from app_run.stats import rebuild_athlete_stats, apply_finished_run
+from app_run.serializers import RunSerializer, UserSerializer, ChallengeSerializer, AthleteInfoSerializer, \
+    PositionSerializer, BulkPositionSerializer
 
 
 class RunApiTestCase(APITestCase):
@@ -212,7 +238,26 @@ class LogicTestCase(TestCase):
         d += geodesic([test_pos_2.latitude, test_pos_2.longitude], [test_pos_3.latitude, test_pos_3.longitude]).km
         d += geodesic([test_pos_3.latitude, test_pos_3.longitude], [test_pos_4.latitude, test_pos_4.longitude]).km
 
-        self.assertEqual(d, calculate_distance(run_1))
+        self.assertAlmostEqual(d, calculate_distance(run_1), places=6)
+
+
+class DistanceModelsTestCase(TestCase):
+    points = [(55.7500, 37.6100), (55.7512, 37.6131), (55.7530, 37.6102), (55.7530, 37.6102), (12.3, 50.15)]
+
+    def test_models_agree_with_geodesic(self):
+        reference = [geodesic(a, b).m for a, b in zip(self.points, self.points[1:])]
+        for length, expected in zip(segment_lengths(self.points, 'vincenty'), reference):
+            self.assertAlmostEqual(expected, length, places=3)
+        for length, expected in zip(segment_lengths(self.points, 'haversine'), reference):
+            self.assertLessEqual(abs(expected - length), expected * 0.005)
+
+    def test_coincident_points(self):
+        for model in ('haversine', 'vincenty', 'karney'):
+            self.assertEqual(0, point_distance(self.points[2], self.points[3], model))
+
+    def test_antipodal_points_fall_back_to_karney(self):
+        self.assertAlmostEqual(geodesic((0, 0), (0.5, 179.7)).m, point_distance((0, 0), (0.5, 179.7), 'vincenty'),
+                               places=3)
 
 
 class PositionCollectibleTestCase(TestCase):
@@ -314,3 +359,1259 @@ class ExtraApiTestCase(APITestCase):
         response = self.client.get(url, {'athlete': self.athlete.id})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertTrue(all(c['athlete'] == self.athlete.id for c in response.data))
+
+
+class BulkPositionApiTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.athlete = User.objects.create(username='us', first_name='Ivan', last_name='Ivanov')
+        self.run = Run.objects.create(athlete=self.athlete, status='in_progress')
+        self.fixes = [
+            {'latitude': 55.7500, 'longitude': 37.6100, 'date_time': '2025-08-08T14:05:00.00'},
+            {'latitude': 55.7510, 'longitude': 37.6110, 'date_time': '2025-08-08T14:05:30.00'},
+            {'latitude': 55.7520, 'longitude': 37.6125, 'date_time': '2025-08-08T14:06:00.00'},
+        ]
+
+    def test_bulk_matches_single_posts(self):
+        other_run = Run.objects.create(athlete=self.athlete, status='in_progress')
+        for fix in self.fixes:
+            self.client.post(reverse('position-list'), data=json.dumps({'run': other_run.id, **fix}),
+                             content_type='application/json')
+
+        response = self.client.post(reverse('position-bulk'),
+                                    data=json.dumps({'run': self.run.id, 'positions': self.fixes}),
+                                    content_type='application/json')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        self.assertEqual(3, len(response.data))
+
+        single = Position.objects.filter(run=other_run).order_by('date_time').values_list('distance', 'speed')
+        bulk = Position.objects.filter(run=self.run).order_by('date_time').values_list('distance', 'speed')
+        self.assertEqual(list(single), list(bulk))
+
+    def test_bulk_seeded_from_last_position(self):
+        Position.objects.create(run=self.run, latitude=55.7490, longitude=37.6090,
+                                date_time='2025-08-08T14:04:30.00')
+        response = self.client.post(reverse('position-bulk'),
+                                    data=json.dumps({'run': self.run.id, 'positions': self.fixes[:1]}),
+                                    content_type='application/json')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        self.assertGreater(Decimal(response.data[0]['data']['distance']), 0)
+
+    def test_bulk_reports_invalid_items(self):
+        fixes = self.fixes + [{'latitude': 200, 'longitude': 0, 'date_time': '2025-08-08T14:07:00.00'}]
+        response = self.client.post(reverse('position-bulk'),
+                                    data=json.dumps({'run': self.run.id, 'positions': fixes}),
+                                    content_type='application/json')
+        self.assertEqual(status.HTTP_207_MULTI_STATUS, response.status_code)
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.data[3]['status'])
+        self.assertIn('latitude', response.data[3]['errors'])
+        self.assertEqual(3, Position.objects.filter(run=self.run).count())
+
+    def test_bulk_run_not_started(self):
+        self.run.status = 'init'
+        self.run.save()
+        response = self.client.post(reverse('position-bulk'),
+                                    data=json.dumps({'run': self.run.id, 'positions': self.fixes}),
+                                    content_type='application/json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertFalse(Position.objects.filter(run=self.run).exists())
+
+    def test_run_stopped_after_validation(self):
+        # The validators saw the run in progress; the stop committed before the fix got the run's lock
+        Run.objects.filter(pk=self.run.pk).update(status='finished', distance=1)
+        with mock.patch.object(PositionSerializer, 'validate_run', lambda serializer, value: value), \
+                mock.patch.object(BulkPositionSerializer, 'validate_run', lambda serializer, value: value):
+            single = self.client.post(reverse('position-list'), data=json.dumps({'run': self.run.id, **self.fixes[0]}),
+                                      content_type='application/json')
+            bulk = self.client.post(reverse('position-bulk'),
+                                    data=json.dumps({'run': self.run.id, 'positions': self.fixes}),
+                                    content_type='application/json')
+        self.assertEqual((status.HTTP_400_BAD_REQUEST, status.HTTP_400_BAD_REQUEST),
+                         (single.status_code, bulk.status_code))
+        self.assertRaises(RunNotInProgress, save_position, self.run, {
+            'latitude': Decimal('55.75'), 'longitude': Decimal('37.61'), 'date_time': timezone.now()})
+        self.assertFalse(Position.objects.filter(run=self.run).exists())
+        self.run.refresh_from_db()
+        self.assertEqual((1, 0), (self.run.distance, self.run.positions_count))
+
+
+class CollectibleIndexTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.athlete = User.objects.create(username='us', first_name='Ivan', last_name='Ivanov')
+
+    def create_item(self, uid, latitude, longitude):
+        return CollectibleItem.objects.create(name=uid, uid=uid, latitude=latitude, longitude=longitude,
+                                              picture='https://example.com/item.png', value=1)
+
+    def test_only_items_within_radius(self):
+        near = self.create_item('near', Decimal('55.7507'), Decimal('37.6100'))
+        self.create_item('far', Decimal('55.7520'), Decimal('37.6100'))
+        collect_items(self.athlete, [[Decimal('55.7500'), Decimal('37.6100')]])
+        self.assertEqual([near], list(self.athlete.items.all()))
+
+    def test_neighbouring_cell(self):
+        item = self.create_item('edge', Decimal('55.7600'), Decimal('37.6200'))
+        self.assertEqual([item.id], get_index().nearby(Decimal('55.7599'), Decimal('37.6199')))
+
+    def test_antimeridian(self):
+        item = self.create_item('east', Decimal('10.0000'), Decimal('179.9999'))
+        self.assertEqual([item.id], get_index().nearby(Decimal('10.0000'), Decimal('-179.9999')))
+
+    def test_index_rebuilt_after_change(self):
+        self.assertEqual([], get_index().nearby(0, 0))
+        item = self.create_item('new', 0, 0)
+        self.assertEqual([item.id], get_index().nearby(0, 0))
+        item.delete()
+        self.assertEqual([], get_index().nearby(0, 0))
+
+    def test_other_processes_writes_seen_after_interval(self):
+        get_index()
+        # Written by another process: this one gets no signal, only the new token in the database
+        item = CollectibleItem.objects.bulk_create([CollectibleItem(
+            name='other', uid='other', latitude=0, longitude=0, picture='https://example.com/item.png', value=1)])[0]
+        CollectibleIndexState.objects.filter(pk=1).update(token='other')
+        self.assertEqual([], get_index().nearby(0, 0))
+        with mock.patch('app_run.collectibles.time.monotonic', return_value=time.monotonic() + INDEX_CHECK_SECONDS):
+            self.assertEqual([item.id], get_index().nearby(0, 0))
+
+
+class RunAccumulatorTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.athlete = User.objects.create(username='us', first_name='Ivan', last_name='Ivanov')
+        self.run = Run.objects.create(athlete=self.athlete, status='in_progress')
+        for i, (latitude, longitude) in enumerate([(55.7500, 37.6100), (55.7510, 37.6110), (55.7530, 37.6120)]):
+            data = {'run': self.run.id, 'latitude': latitude, 'longitude': longitude,
+                    'date_time': f'2025-08-08T14:05:{i * 10:02}.00'}
+            self.client.post(reverse('position-list'), data=json.dumps(data), content_type='application/json')
+        self.run.refresh_from_db()
+
+    def test_aggregates_follow_ingest(self):
+        self.assertEqual(3, self.run.positions_count)
+        self.assertEqual(20, (self.run.last_position_at - self.run.first_position_at).total_seconds())
+        self.assertEqual(Position.objects.filter(run=self.run).order_by('date_time').last().distance,
+                         self.run.distance)
+        self.assertEqual({}, verify_run_totals(self.run))
+
+    def test_stop_uses_accumulated_totals(self):
+        expected = accumulated_totals(self.run)
+        response = self.client.post(reverse('run-stop', kwargs={'run_id': self.run.id}))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.run.refresh_from_db()
+        self.assertEqual(20, self.run.run_time_seconds)
+        self.assertEqual(Decimal(str(expected['distance'])).quantize(Decimal('0.0001')), self.run.distance)
+        self.assertEqual(expected['speed'], self.run.speed)
+
+    def test_long_chain_does_not_drift(self):
+        fixes = [{'latitude': 55.76 + i * 0.00003, 'longitude': 37.61,
+                  'date_time': f'2025-08-08T15:{i // 60:02}:{i % 60:02}'} for i in range(1000)]
+        self.client.post(reverse('position-bulk'), data=json.dumps({'run': self.run.id, 'positions': fixes}),
+                         content_type='application/json')
+        self.run.refresh_from_db()
+        self.assertEqual({}, verify_run_totals(self.run, {'distance': Decimal('0.0001')}))
+
+    def test_stop_keeps_fixes_stored_after_loading(self):
+        stale = Run.objects.get(pk=self.run.pk)
+        data = {'run': self.run.id, 'latitude': 55.7540, 'longitude': 37.6130, 'date_time': '2025-08-08T14:05:30.00'}
+        self.client.post(reverse('position-list'), data=json.dumps(data), content_type='application/json')
+        complete_run(stale)
+        self.run.refresh_from_db()
+        self.assertEqual((4, 30), (self.run.positions_count, self.run.run_time_seconds))
+
+    def test_verify_reports_drift(self):
+        Position.objects.create(run=self.run, latitude=55.7600, longitude=37.6200,
+                                date_time='2025-08-08T14:06:00.00')
+        drift = verify_run_totals(self.run)
+        self.assertEqual((3, 4), drift['positions_count'])
+        self.assertIn('distance', drift)
+        self.assertEqual(recomputed_totals(self.run)['run_time_seconds'], drift['run_time_seconds'][1])
+
+
+class TailCacheTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.athlete = User.objects.create(username='us', first_name='Ivan', last_name='Ivanov')
+        self.run = Run.objects.create(athlete=self.athlete, status='in_progress')
+
+    def post_fix(self, latitude, longitude, date_time):
+        data = {'run': self.run.id, 'latitude': latitude, 'longitude': longitude, 'date_time': date_time}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('position-list'), data=json.dumps(data),
+                                        content_type='application/json')
+        self.run.refresh_from_db()
+        return response
+
+    def test_tail_written_through(self):
+        self.post_fix(55.7500, 37.6100, '2025-08-08T14:05:00.00')
+        self.post_fix(55.7510, 37.6110, '2025-08-08T14:05:10.00')
+        stored = Position.objects.filter(run=self.run).order_by('date_time').last()
+        with self.assertNumQueries(0):
+            tail = last_position(self.run)
+        self.assertEqual((stored.date_time, stored.distance, stored.speed),
+                         (tail.date_time, tail.distance, tail.speed))
+
+    def test_out_of_order_fix_keeps_tail(self):
+        self.post_fix(55.7510, 37.6110, '2025-08-08T14:05:10.00')
+        self.post_fix(55.7500, 37.6100, '2025-08-08T14:05:00.00')
+        self.assertEqual(Decimal('55.7510'), last_position(self.run).latitude)
+
+    def test_repopulated_after_eviction(self):
+        self.post_fix(55.7500, 37.6100, '2025-08-08T14:05:00.00')
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(Decimal('55.7500'), last_position(self.run).latitude)
+        with self.assertNumQueries(0):
+            last_position(self.run)
+
+    def test_stale_tail_ignored(self):
+        self.post_fix(55.7500, 37.6100, '2025-08-08T14:05:00.00')
+        stale = cache.get('run:%d:tail' % self.run.id)
+        self.post_fix(55.7510, 37.6110, '2025-08-08T14:05:10.00')
+        # Another process's cache that never saw the second fix
+        cache.set('run:%d:tail' % self.run.id, stale)
+        self.assertEqual(Decimal('55.7510'), last_position(self.run).latitude)
+
+    def test_evicted_on_stop(self):
+        self.post_fix(55.7500, 37.6100, '2025-08-08T14:05:00.00')
+        self.client.post(reverse('run-stop', kwargs={'run_id': self.run.id}))
+        Position.objects.filter(run=self.run).delete()
+        self.assertIsNone(last_position(self.run))
+
+
+class PackedTrackTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.athlete = User.objects.create(username='us', first_name='Ivan', last_name='Ivanov')
+        self.run = Run.objects.create(athlete=self.athlete, status='in_progress')
+        fixes = [{'latitude': 55.75 + i / 1000, 'longitude': -37.61 - i / 2000,
+                  'date_time': f'2025-08-08T14:05:{i:02}.{i * 7919 % 1000000:06}'} for i in range(20)]
+        self.client.post(reverse('position-bulk'), data=json.dumps({'run': self.run.id, 'positions': fixes}),
+                         content_type='application/json')
+
+    def test_round_trip(self):
+        points = track_points(self.run)
+        self.assertEqual(points, list(decode_track(encode_track(points))))
+
+    def test_stop_packs_track(self):
+        self.client.post(reverse('run-stop', kwargs={'run_id': self.run.id}))
+        self.assertEqual(20, RunTrack.objects.get(run=self.run).points)
+
+    def test_reads_same_without_rows(self):
+        url = reverse('position-list')
+        before = self.client.get(url, {'run': self.run.id}).data
+        distance = calculate_distance(self.run)
+        self.client.post(reverse('run-stop', kwargs={'run_id': self.run.id}))
+        Position.objects.filter(run=self.run).delete()
+
+        self.assertEqual(before, self.client.get(url, {'run': self.run.id}).data)
+        self.assertEqual(distance, calculate_distance(self.run))
+
+    def test_bulk_recompute_matches_single(self):
+        other = Run.objects.create(athlete=self.athlete, status='in_progress')
+        Position.objects.create(run=other, latitude=1, longitude=1, date_time='2025-08-08T14:05:00Z')
+        Position.objects.create(run=other, latitude=1.01, longitude=1, date_time='2025-08-08T14:05:10Z', speed=2)
+        pack_track(self.run)
+        with self.assertNumQueries(2):
+            totals = recomputed_totals_many([self.run.id, other.id])
+        self.assertEqual({self.run.id: recomputed_totals(self.run), other.id: recomputed_totals(other)}, totals)
+
+
+class KeysetPaginationTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.athlete = User.objects.create(username='us', first_name='Ivan', last_name='Ivanov')
+        self.run = Run.objects.create(athlete=self.athlete, status='in_progress')
+        fixes = [{'latitude': 55.75 + i / 1000, 'longitude': 37.61,
+                  'date_time': f'2025-08-08T14:05:{i // 2:02}.00'} for i in range(7)]
+        self.client.post(reverse('position-bulk'), data=json.dumps({'run': self.run.id, 'positions': fixes}),
+                         content_type='application/json')
+
+    def collect(self, url, params):
+        results, pages = [], 0
+        response = self.client.get(url, params)
+        while True:
+            pages += 1
+            results += response.data['results']
+            if not response.data['next']:
+                return results, pages
+            response = self.client.get(response.data['next'])
+
+    def test_positions_pages(self):
+        url = reverse('position-list')
+        expected = self.client.get(url, {'run': self.run.id}).data
+        results, pages = self.collect(url, {'run': self.run.id, 'size': 3})
+        self.assertEqual(3, pages)
+        self.assertEqual(sorted(expected, key=lambda p: p['date_time']), results)
+
+    def test_packed_track_pages(self):
+        url = reverse('position-list')
+        expected, _ = self.collect(url, {'run': self.run.id, 'size': 2})
+        self.client.post(reverse('run-stop', kwargs={'run_id': self.run.id}))
+        Position.objects.filter(run=self.run).delete()
+        self.assertEqual((expected, 4), self.collect(url, {'run': self.run.id, 'size': 2}))
+
+    def test_cursor_survives_packing(self):
+        url = reverse('position-list')
+        expected, _ = self.collect(url, {'run': self.run.id, 'size': 3})
+        # The cursor points into the group of two positions sharing 14:05:01
+        first = self.client.get(url, {'run': self.run.id, 'size': 3}).data
+        self.client.post(reverse('run-stop', kwargs={'run_id': self.run.id}))
+        Position.objects.filter(run=self.run).delete()
+        rest, _ = self.collect(first['next'], {})
+        self.assertEqual(expected, first['results'] + rest)
+
+    def test_runs_descending(self):
+        for _ in range(4):
+            Run.objects.create(athlete=self.athlete)
+        results, pages = self.collect(reverse('run-list'), {'size': 2, 'ordering': '-created_at'})
+        self.assertEqual(3, pages)
+        self.assertEqual(list(Run.objects.order_by('-created_at', '-id').values_list('id', flat=True)),
+                         [run['id'] for run in results])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('run-list'), {'size': 2, 'cursor': 'garbage'})
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+
+class TrackSimplificationTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.athlete = User.objects.create(username='us', first_name='Ivan', last_name='Ivanov')
+        self.run = Run.objects.create(athlete=self.athlete, status='in_progress')
+        # A straight leg north, then a straight leg east
+        fixes = [{'latitude': 55.75 + i / 10000, 'longitude': 37.61, 'date_time': f'2025-08-08T14:05:{i:02}.00'}
+                 for i in range(30)]
+        fixes += [{'latitude': 55.7529, 'longitude': 37.61 + i / 10000, 'date_time': f'2025-08-08T14:06:{i:02}.00'}
+                  for i in range(1, 30)]
+        self.client.post(reverse('position-bulk'), data=json.dumps({'run': self.run.id, 'positions': fixes}),
+                         content_type='application/json')
+
+    def test_simplify_track(self):
+        points = track_points(self.run)
+        simplified = simplify_track(points, 1)
+        self.assertEqual([points[0], points[29], points[-1]], simplified)
+        self.assertEqual([points[0], points[-1]], simplify_track(points, 1000))
+
+    def test_simplified_positions(self):
+        response = self.client.get(reverse('position-list'), {'run': self.run.id, 'simplify': 5})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(3, len(response.data))
+        self.assertEqual('55.7529', response.data[1]['latitude'])
+
+    def test_cached_for_finished_run(self):
+        self.client.post(reverse('run-stop', kwargs={'run_id': self.run.id}))
+        url = reverse('position-list')
+        first = self.client.get(url, {'run': self.run.id, 'simplify': 5}).data
+        Position.objects.filter(run=self.run).delete()
+        RunTrack.objects.filter(run=self.run).delete()
+        self.assertEqual(first, self.client.get(url, {'run': self.run.id, 'simplify': 5}).data)
+
+    def test_invalid_tolerance(self):
+        url = reverse('position-list')
+        for params in ({'run': self.run.id, 'simplify': 'abc'}, {'run': self.run.id, 'simplify': -1},
+                       {'simplify': 5}):
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, self.client.get(url, params).status_code)
+
+
+class CompactTrackFormatTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.athlete = User.objects.create(username='us', first_name='Ivan', last_name='Ivanov')
+        self.run = Run.objects.create(athlete=self.athlete, status='in_progress')
+        fixes = [{'latitude': 55.75 + i / 1000, 'longitude': 37.61, 'date_time': f'2025-08-08T14:05:{i:02}.50'}
+                 for i in range(5)]
+        self.client.post(reverse('position-bulk'), data=json.dumps({'run': self.run.id, 'positions': fixes}),
+                         content_type='application/json')
+
+    def test_encode_polyline(self):
+        points = [(Decimal('38.5'), Decimal('-120.2')), (Decimal('40.7'), Decimal('-120.95')),
+                  (Decimal('43.252'), Decimal('-126.453'))]
+        self.assertEqual('_p~iF~ps|U_ulLnnqC_mqNvxq`@', encode_polyline(points))
+
+    def test_polyline_format(self):
+        response = self.client.get(reverse('position-list'), {'run': self.run.id},
+                                   HTTP_ACCEPT='application/vnd.polyline+json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual('application/vnd.polyline+json', response['Content-Type'])
+        self.assertEqual(5, response.data['count'])
+        self.assertEqual(encode_polyline(track_points(self.run)), response.data['polyline'])
+
+    def test_columnar_format(self):
+        response = self.client.get(reverse('position-list'), {'run': self.run.id, 'format': 'columnar'})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        data = json.loads(response.content)
+        self.assertEqual('2025-08-08T14:05:00.500000+00:00', data['start'])
+        self.assertEqual([0, 1000, 2000, 3000, 4000], data['time_offset_ms'])
+        self.assertEqual([55.75, 55.751, 55.752, 55.753, 55.754], data['latitude'])
+        self.assertEqual(5, len(data['distance']))
+
+    def test_format_requires_run(self):
+        response = self.client.get(reverse('position-list'), {'format': 'columnar'})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+
+class AsyncApiTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.athlete = User.objects.create(username='us', first_name='Ivan', last_name='Ivanov')
+        self.run = Run.objects.create(athlete=self.athlete, status='in_progress')
+
+    async def test_create_position_matches_sync(self):
+        fixes = [{'latitude': 55.7500, 'longitude': 37.6100, 'date_time': '2025-08-08T14:05:00.00'},
+                 {'latitude': 55.7510, 'longitude': 37.6110, 'date_time': '2025-08-08T14:05:10.00'}]
+        sync_run = await Run.objects.acreate(athlete=self.athlete, status='in_progress')
+        for fix in fixes:
+            response = await self.async_client.post(reverse('async-position-create'), {'run': self.run.id, **fix},
+                                                    content_type='application/json')
+            self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+            await self.async_client.post(reverse('position-list'), {'run': sync_run.id, **fix},
+                                         content_type='application/json')
+
+        self.assertEqual(
+            [p async for p in Position.objects.filter(run=sync_run).order_by('date_time').values_list('distance', 'speed')],
+            [p async for p in Position.objects.filter(run=self.run).order_by('date_time').values_list('distance', 'speed')])
+        run = await Run.objects.aget(pk=self.run.pk)
+        self.assertEqual(2, run.positions_count)
+
+    async def test_create_position_invalid(self):
+        response = await self.async_client.post(reverse('async-position-create'),
+                                                {'run': self.run.id, 'latitude': 100, 'longitude': 0,
+                                                 'date_time': '2025-08-08T14:05:00.00'},
+                                                content_type='application/json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertIn('latitude', response.json())
+
+    async def test_bulk(self):
+        fixes = [{'latitude': 55.75, 'longitude': 37.61, 'date_time': '2025-08-08T14:05:00.00'}]
+        response = await self.async_client.post(reverse('async-position-bulk'),
+                                                {'run': self.run.id, 'positions': fixes},
+                                                content_type='application/json')
+        self.assertEqual(status.HTTP_201_CREATED, response.status_code)
+        self.assertEqual(status.HTTP_201_CREATED, response.json()[0]['status'])
+
+    async def test_start_retrieve_stop(self):
+        run = await Run.objects.acreate(athlete=self.athlete)
+        response = await self.async_client.post(reverse('async-run-start', kwargs={'run_id': run.id}))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        response = await self.async_client.post(reverse('async-run-start', kwargs={'run_id': run.id}))
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+        response = await self.async_client.get(reverse('async-run-detail', kwargs={'run_id': run.id}))
+        self.assertEqual('in_progress', response.json()['status'])
+
+        response = await self.async_client.post(reverse('async-run-stop', kwargs={'run_id': run.id}))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual('finished', response.json()['status'])
+
+    async def test_run_not_found(self):
+        response = await self.async_client.get(reverse('async-run-detail', kwargs={'run_id': 9999}))
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+
+@override_settings(POSITIONS_WRITE_BEHIND=True)
+class WriteBehindTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.athlete = User.objects.create(username='us', first_name='Ivan', last_name='Ivanov')
+        self.run = Run.objects.create(athlete=self.athlete, status='in_progress')
+        self.fixes = [{'run': self.run.id, 'latitude': 55.75 + i / 1000, 'longitude': 37.61,
+                       'date_time': f'2025-08-08T14:05:{i:02}.00'} for i in range(3)]
+
+    def post_fixes(self, fixes):
+        for fix in fixes:
+            response = self.client.post(reverse('position-list'), data=json.dumps(fix),
+                                        content_type='application/json')
+            self.assertEqual(status.HTTP_202_ACCEPTED, response.status_code)
+
+    def test_queued_then_flushed_in_order(self):
+        self.post_fixes(reversed(self.fixes))
+        self.assertFalse(Position.objects.filter(run=self.run).exists())
+        self.assertEqual(3, self.client.get(reverse('position-queue')).data['queue_depth'])
+
+        self.assertEqual(3, flush_pending())
+        distances = list(Position.objects.filter(run=self.run).order_by('date_time').values_list('distance', flat=True))
+        self.assertEqual(distances, sorted(distances))
+        self.assertGreater(distances[-1], 0)
+        # Reported from the database, not from the cache of the process that flushed
+        cache.clear()
+        queue = self.client.get(reverse('position-queue')).data
+        self.assertEqual((0, 3), (queue['queue_depth'], queue['last_flush_count']))
+        self.assertIsNotNone(queue['last_flush_at'])
+
+    def test_invalid_fix_rejected(self):
+        response = self.client.post(reverse('position-list'), data=json.dumps({**self.fixes[0], 'latitude': 100}),
+                                    content_type='application/json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+    def test_stop_flushes_run(self):
+        self.post_fixes(self.fixes)
+        response = self.client.post(reverse('run-stop', kwargs={'run_id': self.run.id}))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(2, response.data['run_time_seconds'])
+        self.assertEqual(3, Position.objects.filter(run=self.run).count())
+
+    def test_fixes_of_finished_run_dropped(self):
+        self.post_fixes(self.fixes)
+        Run.objects.filter(pk=self.run.pk).update(status='finished')
+        self.assertEqual(3, flush_pending())
+        self.assertFalse(Position.objects.filter(run=self.run).exists())
+        self.assertFalse(PendingPosition.objects.exists())
+
+
+class ChallengeRulesTestCase(TestCase):
+    def setUp(self):
+        self.athlete = User.objects.create(username='us', first_name='Ivan', last_name='Ivanov')
+
+    def test_rules_read_one_stats_row(self):
+        for _ in range(10):
+            Run.objects.create(athlete=self.athlete, status='finished', distance=5, run_time_seconds=1800)
+        Run.objects.create(athlete=self.athlete, status='finished', distance=2, run_time_seconds=590)
+        rebuild_athlete_stats()
+        with self.assertNumQueries(3):
+            awards = award_challenges(self.athlete)
+        self.assertEqual([Challenge.CHALLENGE_10_RUNS, Challenge.CHALLENGE_50KM, Challenge.CHALLENGE_2KM_10MIN],
+                         [award.full_name for award in awards])
+
+    def test_held_awards_skipped(self):
+        for _ in range(10):
+            Run.objects.create(athlete=self.athlete, status='finished', distance=1, run_time_seconds=0)
+        award_challenges(self.athlete)
+        with self.assertNumQueries(2):
+            self.assertEqual([], award_challenges(self.athlete))
+        self.assertEqual([Challenge.CHALLENGE_10_RUNS],
+                         list(Challenge.objects.filter(athlete=self.athlete).values_list('full_name', flat=True)))
+
+    def test_unfinished_runs_ignored(self):
+        Run.objects.create(athlete=self.athlete, status='in_progress', distance=60, run_time_seconds=300)
+        self.assertEqual([], award_challenges(self.athlete))
+
+
+@override_settings(RUN_FINALIZATION_ASYNC=True, RUN_FINALIZATION_MAX_ATTEMPTS=2)
+class FinalizationJobTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.athlete = User.objects.create(username='us', first_name='Ivan', last_name='Ivanov')
+        self.run = Run.objects.create(athlete=self.athlete, status='in_progress')
+        for i in range(3):
+            self.client.post(reverse('position-list'), data=json.dumps(
+                {'run': self.run.id, 'latitude': 55.75 + i / 1000, 'longitude': 37.61,
+                 'date_time': f'2025-08-08T14:05:{i:02}.00'}), content_type='application/json')
+
+    def stop(self):
+        response = self.client.post(reverse('run-stop', kwargs={'run_id': self.run.id}))
+        self.assertEqual(status.HTTP_202_ACCEPTED, response.status_code)
+        return response.data['id']
+
+    def test_stop_queues_job(self):
+        job_id = self.stop()
+        self.run.refresh_from_db()
+        self.assertEqual('finished', self.run.status)
+        response = self.client.get(reverse('finalization-job', kwargs={'job_id': job_id}))
+        self.assertEqual('queued', response.data['status'])
+
+        self.assertEqual([job_id], claim_jobs(10))
+        self.assertEqual([], claim_jobs(10))
+        self.assertEqual('done', process_job(job_id))
+        self.run.refresh_from_db()
+        self.assertEqual(2, self.run.run_time_seconds)
+        self.assertGreater(self.run.distance, 0)
+        response = self.client.get(reverse('finalization-job', kwargs={'job_id': job_id}))
+        self.assertEqual(1, response.data['attempts'])
+
+    def test_failed_job_retried(self):
+        job_id = self.stop()
+        with mock.patch('app_run.finalization.complete_run', side_effect=RuntimeError('boom')):
+            claim_jobs(10)
+            self.assertEqual('queued', process_job(job_id))
+            claim_jobs(10)
+            self.assertEqual('failed', process_job(job_id))
+        job = RunFinalizationJob.objects.get(pk=job_id)
+        self.assertEqual(2, job.attempts)
+        self.assertIn('boom', job.error)
+        self.assertEqual([], claim_jobs(10))
+
+    def test_second_stop_rejected(self):
+        self.stop()
+        response = self.client.post(reverse('run-stop', kwargs={'run_id': self.run.id}))
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+
+class AthleteStatsTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.athlete = User.objects.create(username='us', first_name='Ivan', last_name='Ivanov')
+        Run.objects.create(athlete=self.athlete, status='finished', distance=3, run_time_seconds=900, speed=3)
+
+    def run_and_stop(self, count):
+        run = Run.objects.create(athlete=self.athlete, status='in_progress')
+        for i in range(count):
+            self.client.post(reverse('position-list'), data=json.dumps(
+                {'run': run.id, 'latitude': 55.75 + i / 100, 'longitude': 37.61,
+                 'date_time': f'2025-08-08T14:{i:02}:00.00'}), content_type='application/json')
+        self.client.post(reverse('run-stop', kwargs={'run_id': run.id}))
+        run.refresh_from_db()
+        return run
+
+    def test_stop_updates_stats(self):
+        runs = [self.run_and_stop(3), self.run_and_stop(4)]
+        stats = AthleteStats.objects.get(athlete=self.athlete)
+        self.assertEqual(3, stats.runs_finished)
+        self.assertEqual(3 + sum(run.distance for run in runs), stats.total_distance)
+        self.assertEqual(900 + 120 + 180, stats.total_time_seconds)
+        self.assertEqual(runs[1].distance, stats.longest_distance)
+        self.assertEqual(max(Decimal(3), *(run.speed for run in runs)), stats.best_speed)
+        self.assertEqual(runs[1].created_at, stats.last_run_at)
+
+        incremental = AthleteStats.objects.values().get(athlete=self.athlete)
+        rebuild_athlete_stats()
+        self.assertEqual(incremental, AthleteStats.objects.values().get(athlete=self.athlete))
+
+    def test_apply_is_idempotent(self):
+        run = self.run_and_stop(3)
+        self.assertFalse(apply_finished_run(run))
+        self.assertEqual(2, AthleteStats.objects.get(athlete=self.athlete).runs_finished)
+
+    def test_user_list_reads_stats(self):
+        self.run_and_stop(2)
+        response = self.client.get(reverse('user-list'))
+        self.assertEqual(2, response.data[0]['runs_finished'])
+
+    def test_rebuild_reads_under_athlete_lock(self):
+        with CaptureQueriesContext(connection) as queries:
+            rebuild_athlete_stats([self.athlete.id])
+        sql = [query['sql'] for query in queries.captured_queries]
+        savepoint = next(i for i, query in enumerate(sql) if query.startswith('SAVEPOINT'))
+        lock = next(i for i, query in enumerate(sql) if 'FROM "auth_user"' in query)
+        totals = next(i for i, query in enumerate(sql) if 'SUM(' in query)
+        self.assertLess(savepoint, lock)
+        self.assertLess(lock, totals)
+
+    def test_rebuild_keeps_run_added_by_running_job(self):
+        run = self.run_and_stop(3)
+        # The job finalized the run and has yet to be marked done
+        RunFinalizationJob.objects.create(run=run, status=RunFinalizationJob.STATUS_RUNNING)
+        rebuild_athlete_stats()
+        run.refresh_from_db()
+        self.assertTrue(run.stats_applied)
+        self.assertEqual(2, AthleteStats.objects.get(athlete=self.athlete).runs_finished)
+
+    def test_deleted_run_leaves_stats(self):
+        run = self.run_and_stop(3)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(reverse('run-detail', args=(run.id,)))
+        self.assertEqual(status.HTTP_204_NO_CONTENT, response.status_code)
+        response = self.client.get(reverse('user-detail', args=(self.athlete.id,)))
+        self.assertEqual(1, response.data['runs_finished'])
+        self.assertEqual(3, AthleteStats.objects.get(athlete=self.athlete).total_distance)
+        self.assertFalse(LeaderboardEntry.objects.filter(athlete=self.athlete, score__gt=3).exists())
+
+    def test_finished_run_created_through_api_counted(self):
+        self.run_and_stop(2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('run-list'), data={'athlete': self.athlete.id, 'status': 'finished',
+                                                       'distance': 5})
+        stats = AthleteStats.objects.get(athlete=self.athlete)
+        self.assertEqual((3, 5), (stats.runs_finished, stats.longest_distance))
+
+
+class CoachAnalyticsTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.coach = User.objects.create(username='coach', is_staff=True)
+        self.athletes = [User.objects.create(username=f'athlete{i}') for i in range(3)]
+        for athlete, (distance, speed) in zip(self.athletes, [(10, 2), (4, 3), (3, 1)]):
+            Subscribe.objects.create(coach=self.coach, athlete=athlete)
+            Run.objects.create(athlete=athlete, status='finished', distance=distance, speed=speed)
+            Run.objects.create(athlete=athlete, status='finished', distance=distance, speed=speed + 1)
+        Run.objects.create(athlete=self.athletes[2], status='finished', distance=12, speed=0)
+        rebuild_athlete_stats()
+        self.url = reverse('analytics-coach', kwargs={'id': self.coach.id})
+
+    def test_leaders(self):
+        response = self.client.get(self.url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual((self.athletes[2].id, 12), (response.data['longest_run_user'],
+                                                    response.data['longest_run_value']))
+        self.assertEqual((self.athletes[0].id, 20), (response.data['total_run_user'],
+                                                    response.data['total_run_value']))
+        self.assertEqual(self.athletes[1].id, response.data['speed_avg_user'])
+        self.assertAlmostEqual(3.5, response.data['speed_avg_value'])
+
+    def test_no_runs(self):
+        coach = User.objects.create(username='coach2', is_staff=True)
+        response = self.client.get(reverse('analytics-coach', kwargs={'id': coach.id}))
+        self.assertEqual(0, response.data['longest_run_user'])
+        self.assertEqual(0, response.data['speed_avg_value'])
+
+    def test_cached_until_run_finished(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(1):
+            self.client.get(self.url)
+
+        run = Run.objects.create(athlete=self.athletes[1], status='in_progress')
+        Position.objects.create(run=run, latitude=0, longitude=0, date_time='2025-08-08T14:05:00Z')
+        Position.objects.create(run=run, latitude=0, longitude=0.2, date_time='2025-08-08T14:50:00Z')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('run-stop', kwargs={'run_id': run.id}))
+        self.assertEqual(self.athletes[1].id, self.client.get(self.url).data['longest_run_user'])
+
+    def test_subscription_invalidates(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Subscribe.objects.filter(athlete=self.athletes[2]).delete()
+        self.assertEqual(self.athletes[0].id, self.client.get(self.url).data['longest_run_user'])
+
+    def test_rebuild_invalidates(self):
+        self.client.get(self.url)
+        Run.objects.filter(athlete=self.athletes[2], distance=12).update(distance=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            rebuild_athlete_stats([self.athletes[2].id])
+        self.assertEqual(self.athletes[0].id, self.client.get(self.url).data['longest_run_user'])
+
+
+class CoachTrendsTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.coach = User.objects.create(username='coach', is_staff=True)
+        self.athlete = User.objects.create(username='athlete')
+        Subscribe.objects.create(coach=self.coach, athlete=self.athlete)
+        for day in ('2025-03-03', '2025-03-05', '2025-03-12'):
+            run = Run.objects.create(athlete=self.athlete, status='in_progress')
+            Run.objects.filter(pk=run.pk).update(created_at=f'{day}T10:00:00Z')
+            Position.objects.create(run=run, latitude=0, longitude=0, date_time=f'{day}T10:00:00Z')
+            Position.objects.create(run=run, latitude=0, longitude=0.01, date_time=f'{day}T10:10:00Z', speed=2)
+            self.client.post(reverse('run-stop', kwargs={'run_id': run.id}))
+        self.url = reverse('trends-coach', kwargs={'id': self.coach.id})
+
+    def trends(self, period):
+        response = self.client.get(self.url, {'period': period, 'start': '2025-03-01', 'end': '2025-03-31'})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        return [(str(row['period']), row['runs']) for row in response.data]
+
+    def test_periods(self):
+        self.assertEqual([('2025-03-03', 1), ('2025-03-05', 1), ('2025-03-12', 1)], self.trends('day'))
+        self.assertEqual([('2025-03-03', 2), ('2025-03-10', 1)], self.trends('week'))
+        self.assertEqual([('2025-03-01', 3)], self.trends('month'))
+        row = self.client.get(self.url, {'period': 'month', 'start': '2025-03-01', 'end': '2025-03-31'}).data[0]
+        self.assertEqual(Decimal('1.00'), row['avg_speed'])
+
+    def test_rebuild_matches_incremental(self):
+        incremental = list(AthleteDailyStats.objects.order_by('day').values('day', 'runs', 'distance', 'time_seconds'))
+        rebuild_athlete_stats()
+        self.assertEqual(incremental,
+                         list(AthleteDailyStats.objects.order_by('day').values('day', 'runs', 'distance', 'time_seconds')))
+
+    def test_invalid_params(self):
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, self.client.get(self.url, {'period': 'year'}).status_code)
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, self.client.get(self.url, {'start': '03.03.2025'}).status_code)
+
+
+class LeaderboardTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.athletes = [User.objects.create(username=f'athlete{i}') for i in range(4)]
+        # Degrees of longitude at the equator, one hour each: ~33, 2 x ~11 (twice) and ~4.5 km
+        for athlete, lengths in zip(self.athletes, [(0.3,), (0.1, 0.1), (0.1, 0.1), (0.04,)]):
+            for length in lengths:
+                run = Run.objects.create(athlete=athlete, status='in_progress')
+                Position.objects.create(run=run, latitude=0, longitude=0, date_time=timezone.now())
+                Position.objects.create(run=run, latitude=0, longitude=length,
+                                        date_time=timezone.now() + timezone.timedelta(hours=1))
+                self.client.post(reverse('run-stop', kwargs={'run_id': run.id}))
+
+    def board(self, name, **params):
+        response = self.client.get(reverse('leaderboard', kwargs={'board': name}), params)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        return response.data
+
+    def test_distance_ranks_with_ties(self):
+        data = self.board('distance_week')
+        self.assertEqual(current_period(BOARDS['distance_week']), data['period'])
+        self.assertEqual([(1, self.athletes[0].id), (2, self.athletes[1].id), (2, self.athletes[2].id),
+                          (4, self.athletes[3].id)],
+                         [(row['rank'], row['athlete']['id']) for row in data['results']])
+        self.assertEqual([2, 4], [row['rank'] for row in self.board('distance_week', limit=2, offset=2)['results']])
+        self.assertEqual(2, self.board('distance_week', athlete=self.athletes[2].id)['athlete_rank']['rank'])
+
+    def test_fastest_and_most_runs(self):
+        fastest = self.board('fastest_5km')['results']
+        self.assertEqual([self.athletes[0].id, self.athletes[1].id, self.athletes[2].id],
+                         [row['athlete']['id'] for row in fastest])
+        self.assertEqual([self.athletes[1].id, self.athletes[2].id, self.athletes[0].id, self.athletes[3].id],
+                         [row['athlete']['id'] for row in self.board('most_runs')['results']])
+        self.assertIsNone(self.board('fastest_5km', athlete=self.athletes[3].id)['athlete_rank'])
+
+    def test_rebuild_matches_incremental(self):
+        incremental = set(LeaderboardEntry.objects.values_list('board', 'period', 'athlete', 'score'))
+        rebuild_leaderboards()
+        self.assertEqual(incremental, set(LeaderboardEntry.objects.values_list('board', 'period', 'athlete', 'score')))
+
+    def test_prune_old_periods(self):
+        LeaderboardEntry.objects.create(board='distance_week', period='2020-W01', athlete=self.athletes[0], score=1)
+        self.assertEqual(1, prune_leaderboards(keep=1))
+        self.assertEqual(404, self.client.get(reverse('leaderboard', kwargs={'board': 'slowest'})).status_code)
+
+
+class ChallengeSummaryTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.athletes = [User.objects.create(username=f'athlete{i}', first_name='Ivan', last_name=f'Ivanov{i}')
+                         for i in range(3)]
+        for athlete in self.athletes:
+            Challenge.objects.create(full_name=Challenge.CHALLENGE_10_RUNS, athlete=athlete)
+        Challenge.objects.create(full_name=Challenge.CHALLENGE_50KM, athlete=self.athletes[1])
+        self.url = reverse('challenge-summary')
+
+    def test_counts_and_pages(self):
+        with self.assertNumQueries(3):
+            data = self.client.get(self.url, {'limit': 2}).data
+        by_name = {row['name_to_display']: row for row in data}
+        ten_runs = by_name[Challenge.CHALLENGE_10_RUNS]
+        self.assertEqual(3, ten_runs['athletes_count'])
+        self.assertEqual([self.athletes[0].id, self.athletes[1].id], [a['id'] for a in ten_runs['athletes']])
+        self.assertEqual(2, ten_runs['next_offset'])
+        self.assertIsNone(by_name[Challenge.CHALLENGE_50KM]['next_offset'])
+
+        data = self.client.get(self.url, {'limit': 2, 'offset': 2}).data
+        by_name = {row['name_to_display']: row for row in data}
+        self.assertEqual([self.athletes[2].id], [a['id'] for a in by_name[Challenge.CHALLENGE_10_RUNS]['athletes']])
+        self.assertEqual([], by_name[Challenge.CHALLENGE_50KM]['athletes'])
+
+    def test_cached_until_awarded(self):
+        self.client.get(self.url)
+        # Only the version of the challenges is read
+        with self.assertNumQueries(1):
+            self.client.get(self.url)
+        for _ in range(11):
+            Run.objects.create(athlete=self.athletes[0], status='finished', distance=5)
+        award_challenges(self.athletes[0])
+        by_name = {row['name_to_display']: row for row in self.client.get(self.url).data}
+        self.assertEqual(2, by_name[Challenge.CHALLENGE_50KM]['athletes_count'])
+
+    def test_removal_seen(self):
+        self.client.get(self.url)
+        Challenge.objects.filter(athlete=self.athletes[0], full_name=Challenge.CHALLENGE_10_RUNS).delete()
+        by_name = {row['name_to_display']: row for row in self.client.get(self.url).data}
+        self.assertEqual(2, by_name[Challenge.CHALLENGE_10_RUNS]['athletes_count'])
+
+    def test_invalid_limit(self):
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, self.client.get(self.url, {'limit': 0}).status_code)
+
+
+class SplitsTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.athlete = User.objects.create(username='us', first_name='Ivan', last_name='Ivanov')
+
+    def test_one_pass(self):
+        distances = [i * 100 for i in range(31)]
+        times, elapsed = [0], 0
+        for i in range(1, 31):
+            elapsed += 20 if 10 < i <= 20 else 30
+            times.append(elapsed)
+        splits, efforts = splits_and_efforts(distances, times)
+        self.assertEqual([300, 200, 300], splits)
+        self.assertEqual({'best_1km': 200, 'best_5km': None, 'best_10km': None}, efforts)
+
+    def test_interpolated_crossings(self):
+        splits, efforts = splits_and_efforts([0, 1500, 2500], [0, 300, 400])
+        self.assertEqual([200, 150], splits)
+        self.assertEqual(100, efforts['best_1km'])
+
+    def stop_run(self, seconds_per_point):
+        run = Run.objects.create(athlete=self.athlete, status='in_progress')
+        fixes = [{'latitude': 55.75 + i * 0.001, 'longitude': 37.61,
+                  'date_time': f'2025-08-08T14:{i * seconds_per_point // 60:02}:{i * seconds_per_point % 60:02}Z'}
+                 for i in range(30)]
+        self.client.post(reverse('position-bulk'), data=json.dumps({'run': run.id, 'positions': fixes}),
+                         content_type='application/json')
+        self.client.post(reverse('run-stop', kwargs={'run_id': run.id}))
+        return run
+
+    def test_stop_stores_splits_and_personal_bests(self):
+        slow = self.stop_run(30)
+        data = self.client.get(reverse('run-splits', kwargs={'pk': slow.id})).data
+        self.assertEqual(3, len(data['splits']))
+        self.assertEqual([1000], data['personal_bests'])
+
+        fast = self.stop_run(20)
+        self.assertEqual([], self.client.get(reverse('run-splits', kwargs={'pk': slow.id})).data['personal_bests'])
+        bests = self.client.get(reverse('user-personal-bests', kwargs={'pk': self.athlete.id})).data
+        self.assertEqual([(1000, fast.id)], [(best['distance'], best['run']) for best in bests])
+        self.assertLess(bests[0]['seconds'], data['best_1km'])
+        self.assertEqual(1, PersonalBest.objects.count())
+
+    def test_unfinished_run(self):
+        run = Run.objects.create(athlete=self.athlete, status='in_progress')
+        self.assertEqual(status.HTTP_404_NOT_FOUND,
+                         self.client.get(reverse('run-splits', kwargs={'pk': run.id})).status_code)
+
+    def test_current_distance_model(self):
+        run = self.stop_run(30)
+        # A stored chain from an older model is not used
+        Position.objects.filter(run=run).update(distance=F('distance') * 2)
+        splits = record_splits(run)
+        with override_settings(DISTANCE_MODEL='haversine'):
+            haversine = record_splits(run)
+        self.assertEqual(3, len(splits.splits))
+        self.assertNotEqual(splits.best_1km, haversine.best_1km)
+
+
+class HeatmapTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.athlete = User.objects.create(username='us', first_name='Ivan', last_name='Ivanov')
+
+    def stop_run(self, fixes):
+        run = Run.objects.create(athlete=self.athlete, status='in_progress')
+        self.client.post(reverse('position-bulk'), data=json.dumps({'run': run.id, 'positions': [
+            {'latitude': lat, 'longitude': lon, 'date_time': f'2025-08-08T14:05:{i:02}Z'}
+            for i, (lat, lon) in enumerate(fixes)]}), content_type='application/json')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('run-stop', kwargs={'run_id': run.id}))
+        return run
+
+    def test_binning(self):
+        counts = bin_points([(0, 0), (0, 0), (0.0001, -0.0001)])
+        self.assertEqual(len(ZOOMS) * 2, len(counts))
+        # Null Island is the top-left corner of tile (z, 2^(z-1), 2^(z-1))
+        self.assertEqual({0: 2}, dict(counts[(10, 512, 512)]))
+        self.assertEqual({64 * 64 - 1: 1}, dict(counts[(10, 511, 511)]))
+
+    def test_cells_round_trip(self):
+        cells = {0: 3, 17: 1, 4095: 250}
+        self.assertEqual(cells, decode_cells(encode_cells(cells)))
+
+    def test_tile_endpoint_and_rebuild(self):
+        self.stop_run([(55.7512, 37.6184)] * 3)
+        self.stop_run([(55.7512, 37.6184), (55.7558, 37.6173)])
+        url = reverse('heatmap-tile', kwargs={'zoom': 10, 'x': 619, 'y': 320})
+        with self.assertNumQueries(1):
+            data = self.client.get(url).data
+        self.assertEqual(5, sum(data['counts']))
+        self.assertEqual(64, data['size'])
+
+        tiles = {(tile.zoom, tile.x, tile.y): decode_cells(tile.cells) for tile in HeatmapTile.objects.all()}
+        rebuild_heatmap(chunk=1)
+        self.assertEqual(tiles, {(tile.zoom, tile.x, tile.y): decode_cells(tile.cells)
+                                 for tile in HeatmapTile.objects.all()})
+
+    def test_added_once(self):
+        run = self.stop_run([(55.7512, 37.6184)] * 2)
+        self.assertFalse(add_run(run.id, track_points(run)))
+        rebuild_heatmap()
+        self.assertFalse(add_run(run.id, track_points(run)))
+        self.assertEqual(2, HeatmapTile.objects.get(zoom=10, x=619, y=320).total)
+
+    def test_stop_does_not_wait_for_lock(self):
+        # A rebuild holds the lock: the stop leaves its run to the pending pass
+        with mock.patch('app_run.heatmap._lock', return_value=None):
+            run = self.stop_run([(55.7512, 37.6184)] * 2)
+        run.refresh_from_db()
+        self.assertEqual(('finished', False), (run.status, run.heatmap_applied))
+        self.assertFalse(HeatmapTile.objects.exists())
+        self.assertEqual(1, add_pending_runs())
+        self.assertEqual(0, add_pending_runs())
+        self.assertEqual(2, HeatmapTile.objects.get(zoom=10, x=619, y=320).total)
+
+    def test_unknown_zoom(self):
+        self.assertEqual(status.HTTP_404_NOT_FOUND,
+                         self.client.get(reverse('heatmap-tile', kwargs={'zoom': 3, 'x': 0, 'y': 0})).status_code)
+        empty = self.client.get(reverse('heatmap-tile', kwargs={'zoom': 12, 'x': 0, 'y': 0})).data
+        self.assertEqual([], empty['cells'])
+
+
+class UserDetailTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.coach = User.objects.create(username='coach', is_staff=True)
+        self.coach_2 = User.objects.create(username='coach2', is_staff=True)
+        self.athlete = User.objects.create(username='athlete')
+        self.athlete_2 = User.objects.create(username='athlete2')
+        Subscribe.objects.create(coach=self.coach, athlete=self.athlete, rating=4)
+        Subscribe.objects.create(coach=self.coach_2, athlete=self.athlete, rating=5)
+        Subscribe.objects.create(coach=self.coach, athlete=self.athlete_2, rating=3)
+        self.item = CollectibleItem.objects.create(name='item', uid='item1', latitude=1, longitude=1,
+                                                   picture='http://example.com/item.png', value=1)
+        self.item.user.add(self.athlete)
+        Run.objects.create(athlete=self.athlete, status='finished', distance=2)
+        rebuild_athlete_stats()
+        reconcile_coach_ratings()
+
+    def detail(self, user):
+        return self.client.get(reverse('user-detail', kwargs={'pk': user.id}))
+
+    def test_athlete(self):
+        with self.assertNumQueries(2):
+            response = self.detail(self.athlete)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(('athlete', 1, self.coach_2.id, ['item1']),
+                         (response.data['type'], response.data['runs_finished'], response.data['coach'],
+                          [item['uid'] for item in response.data['items']]))
+        self.assertNotIn('rating', response.data)
+
+    def test_coach(self):
+        with self.assertNumQueries(2):
+            response = self.detail(self.coach)
+        self.assertEqual(('coach', 0, 3.5, [self.athlete.id, self.athlete_2.id]),
+                         (response.data['type'], response.data['runs_finished'], response.data['rating'],
+                          response.data['athletes']))
+
+    def test_not_found(self):
+        superuser = User.objects.create(username='admin', is_superuser=True)
+        self.assertEqual(status.HTTP_404_NOT_FOUND, self.detail(superuser).status_code)
+        self.assertEqual(status.HTTP_404_NOT_FOUND,
+                         self.client.get(reverse('user-detail', kwargs={'pk': 99999})).status_code)
+
+    @override_settings(USER_DETAIL_CACHE=True)
+    def test_cached_until_changed(self):
+        self.detail(self.athlete)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.coach_2.id, self.detail(self.athlete).data['coach'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Subscribe.objects.create(coach=self.coach, athlete=self.athlete)
+        self.assertEqual(self.coach.id, self.detail(self.athlete).data['coach'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item.user.remove(self.athlete)
+            # Dropped only once committed
+            self.assertEqual(1, len(self.detail(self.athlete).data['items']))
+        self.assertEqual([], self.detail(self.athlete).data['items'])
+
+        run = Run.objects.create(athlete=self.athlete, status='in_progress')
+        Position.objects.create(run=run, latitude=0, longitude=0, date_time='2025-08-08T14:05:00Z')
+        Position.objects.create(run=run, latitude=0, longitude=0.01, date_time='2025-08-08T14:10:00Z')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('run-stop', kwargs={'run_id': run.id}))
+        self.assertEqual(2, self.detail(self.athlete).data['runs_finished'])
+
+
+class UserSearchTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.ivanov = User.objects.create(username='us1', first_name='Пётр', last_name='Иванов')
+        self.ivan = User.objects.create(username='us2', first_name='Иван', last_name='Петров')
+        self.coach = User.objects.create(username='us3', first_name='Иван', last_name='Сидоров', is_staff=True)
+        self.other = User.objects.create(username='us4', first_name='Anna', last_name='Smith')
+
+    def search(self, query, **params):
+        response = self.client.get(reverse('user-list'), data={'search': query, **params})
+        return [user['id'] for user in response.data]
+
+    def test_name_tokens(self):
+        self.assertEqual({'a': 1, 'an': 1, 'ann': 1, 'anna': 2, 'l': 1, 'le': 1, 'lee': 2},
+                         name_tokens('Anna', 'LEE'))
+
+    def test_ranked(self):
+        self.assertEqual([self.ivan.id, self.coach.id, self.ivanov.id], self.search('иван'))
+        self.assertEqual([self.ivan.id, self.ivanov.id], self.search('Иван Пет'))
+        self.assertEqual([self.ivanov.id], self.search('петр иванов'))
+        self.assertEqual([self.coach.id], self.search('иван', type='coach'))
+        self.assertEqual([], self.search('ванов'))
+
+    def test_rename_reindexes(self):
+        self.other.last_name = 'Ivanova'
+        self.other.save()
+        self.assertEqual([self.other.id], self.search('ivanova'))
+        self.assertEqual([], self.search('smith'))
+
+    def test_autocomplete(self):
+        url = reverse('user-autocomplete')
+        response = self.client.get(url, data={'q': 'Иван', 'limit': 2})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual([self.ivan.id, self.coach.id], [user['id'] for user in response.data])
+        response = self.client.get(url, data={'q': 'ив п', 'type': 'athlete'})
+        self.assertEqual([self.ivanov.id, self.ivan.id], [user['id'] for user in response.data])
+        self.assertEqual([], self.client.get(url, data={'q': ' '}).data)
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, self.client.get(url, data={'q': 'a', 'limit': 'x'}).status_code)
+
+    def test_rebuild(self):
+        tokens = set(UserSearchToken.objects.values_list('user', 'token', 'weight'))
+        UserSearchToken.objects.all().delete()
+        self.assertEqual(len(tokens), rebuild_search_index(User.objects.all(), chunk=3))
+        self.assertEqual(tokens, set(UserSearchToken.objects.values_list('user', 'token', 'weight')))
+
+
+class CoachRatingTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.coach = User.objects.create(username='coach', is_staff=True)
+        self.athletes = [User.objects.create(username=f'athlete{i}') for i in range(3)]
+        for athlete in self.athletes:
+            self.client.post(reverse('subscribe', kwargs={'id': self.coach.id}), data={'athlete': athlete.id})
+
+    def rate(self, athlete, rating):
+        return self.client.post(reverse('rate-coach', kwargs={'id': self.coach.id}),
+                                data={'athlete': athlete.id, 'rating': rating})
+
+    def listed_rating(self):
+        response = self.client.get(reverse('user-list'), {'type': 'coach'})
+        return response.data[0]['rating']
+
+    def test_maintained(self):
+        self.assertIsNone(self.listed_rating())
+        self.rate(self.athletes[0], 5)
+        self.rate(self.athletes[1], 2)
+        self.rate(self.athletes[1], 4)
+        self.assertEqual((9, 2), CoachRating.objects.filter(coach=self.coach).values_list(
+            'rating_sum', 'rating_count').get())
+        self.assertEqual(4.5, self.listed_rating())
+        self.assertEqual(4.5, self.client.get(reverse('user-detail', kwargs={'pk': self.coach.id})).data['rating'])
+
+        Subscribe.objects.filter(athlete=self.athletes[0]).delete()
+        self.assertEqual(4, self.listed_rating())
+
+    def test_invalid_rating_unchanged(self):
+        self.rate(self.athletes[0], 3)
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, self.rate(self.athletes[0], 7).status_code)
+        self.assertEqual(3, self.listed_rating())
+
+    def test_reconcile(self):
+        self.rate(self.athletes[0], 5)
+        Subscribe.objects.filter(athlete=self.athletes[1]).update(rating=1)
+        self.assertEqual(1, reconcile_coach_ratings())
+        self.assertEqual(3, self.listed_rating())
+        self.assertEqual(0, reconcile_coach_ratings())
+
+
+class CollectibleItemUploadTestCase(APITestCase):
+    HEADER = ['Name', 'UID', 'Value', 'Latitude', 'Longitude', 'URL']
+
+    def setUp(self):
+        cache.clear()
+        self.existing = CollectibleItem.objects.create(name='Old', uid='uid1', value=1, latitude=0, longitude=0,
+                                                       picture='https://example.com/old.png')
+
+    def upload_ok(self, rows, **params):
+        response = self.upload(rows, **params)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        return response.data
+
+    def upload(self, rows, **params):
+        workbook = Workbook()
+        sheet = workbook.active
+        for row in [self.HEADER] + rows:
+            sheet.append(row)
+        file = io.BytesIO()
+        workbook.save(file)
+        file.seek(0)
+        file.name = 'items.xlsx'
+        url = reverse('upload-collectible-items')
+        if params:
+            url += '?' + '&'.join(f'{key}={value}' for key, value in params.items())
+        return self.client.post(url, {'file': file}, format='multipart')
+
+    def test_upsert_and_invalid_rows(self):
+        get_index()
+        invalid = self.upload_ok([
+            ['New', 'uid1', 5, 10, 20, 'https://example.com/new.png'],
+            ['Second', 'uid2', 3, 1, 2, 'https://example.com/2.png'],
+            ['Bad', 'uid3', 3, 100, 2, 'https://example.com/3.png'],
+            ['Short', 'uid4'],
+        ], upsert=1)
+        self.assertEqual([['Bad', 'uid3', 3, 100, 2, 'https://example.com/3.png'],
+                          ['Short', 'uid4', None, None, None, None]], invalid)
+        self.assertEqual(['uid1', 'uid2'], list(CollectibleItem.objects.order_by('uid').values_list('uid', flat=True)))
+        self.existing.refresh_from_db()
+        self.assertEqual(('New', 5, Decimal('10.0000')), (self.existing.name, self.existing.value,
+                                                          self.existing.latitude))
+        self.assertEqual([self.existing.id], get_index().nearby(10, 20))
+
+    def test_insert_only_by_default(self):
+        self.assertEqual([], self.upload_ok([['Copy', 'uid1', 5, 10, 20, 'https://example.com/new.png']]))
+        self.assertEqual(2, CollectibleItem.objects.filter(uid='uid1').count())
+
+    def test_failure_partway_reported(self):
+        rows = [[f'Item {i}', f'id{i}', i, 1, 1, 'https://example.com/i.png'] for i in range(3)]
+        save_batch = item_import._save_batch
+
+        def failing(items, upsert):
+            if items[0]['uid'] == 'id2':
+                raise DatabaseError('connection lost')
+            return save_batch(items, upsert)
+
+        with mock.patch.object(item_import, '_save_batch', failing):
+            with self.assertRaises(ItemImportError) as raised:
+                import_items(rows, batch_size=2)
+            self.assertEqual(2, raised.exception.imported)
+            response = self.upload(rows[2:])
+        self.assertEqual(status.HTTP_500_INTERNAL_SERVER_ERROR, response.status_code)
+        self.assertEqual(0, response.data['imported'])
+
+    def test_batches(self):
+        rows = [(f'Item {i}', f'id{i}', i, 1, 1, 'https://example.com/i.png') for i in range(5)] + [(None,) * 6]
+        # Per batch with valid rows: the insert and the savepoint around it; then the index token
+        with self.assertNumQueries(3 * 3 + 1):
+            imported, invalid = import_items(rows, batch_size=2)
+        self.assertEqual((5, [[None] * 6]), (imported, invalid))
+        self.assertEqual(6, CollectibleItem.objects.count())
+
+    def test_not_a_workbook(self):
+        file = io.BytesIO(b'not a workbook')
+        file.name = 'items.xlsx'
+        response = self.client.post(reverse('upload-collectible-items'), {'file': file}, format='multipart')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+
+class RecomputeRunsCommandTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.athletes = [User.objects.create(username=f'athlete{i}') for i in range(2)]
+        self.runs = [self.create_run(athlete, day) for athlete, day in [
+            (self.athletes[0], '2025-03-01'), (self.athletes[0], '2025-03-10'), (self.athletes[1], '2025-03-10')]]
+
+    def create_run(self, athlete, day):
+        run = Run.objects.create(athlete=athlete, status='finished', distance=99, run_time_seconds=1)
+        Run.objects.filter(pk=run.pk).update(created_at=f'{day}T10:00:00Z')
+        Position.objects.create(run=run, latitude=55.75, longitude=37.61, date_time=f'{day}T10:00:00Z')
+        Position.objects.create(run=run, latitude=55.77, longitude=37.61, date_time=f'{day}T10:10:00Z')
+        return run
+
+    def recompute(self, *args):
+        out = io.StringIO()
+        call_command('recompute_runs', '--workers', '0', *args, stdout=out)
+        return out.getvalue()
+
+    def distances(self):
+        return [Run.objects.get(pk=run.pk).distance for run in self.runs]
+
+    def test_dry_run_reports_changes(self):
+        out = self.recompute('--dry-run')
+        for run in self.runs:
+            self.assertIn(f'Run {run.id}: distance: 99.0000 -> 2.2', out)
+        self.assertIn('Checked 3 runs, would change 3', out)
+        self.assertEqual([99] * 3, self.distances())
+        self.assertFalse(RunSplits.objects.exists())
+
+    def test_runs_and_derived_data_updated(self):
+        self.assertIn('Checked 3 runs, changed 3', self.recompute())
+        distances = self.distances()
+        self.assertEqual(1, len(set(distances)))
+        self.assertAlmostEqual(2.227, float(distances[0]), places=3)
+        self.assertEqual(600, Run.objects.get(pk=self.runs[0].pk).run_time_seconds)
+        self.assertEqual([2, 2, 2], [len(RunSplits.objects.get(run=run).splits) for run in self.runs])
+        stats = AthleteStats.objects.get(athlete=self.athletes[0])
+        self.assertEqual((2, distances[0] * 2), (stats.runs_finished, stats.total_distance))
+        self.assertEqual(distances[0], LeaderboardEntry.objects.get(
+            board='distance_month', athlete=self.athletes[1]).score)
+        self.assertIn('Checked 3 runs, changed 0', self.recompute())
+
+    def test_checkpoint_resume(self):
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = Path(directory) / 'checkpoint'
+            checkpoint.write_text(str(self.runs[0].id))
+            out = self.recompute('--checkpoint', str(checkpoint), '--chunk', '1')
+            self.assertEqual(str(self.runs[-1].id), checkpoint.read_text())
+        self.assertIn(f'Resuming after run {self.runs[0].id}', out)
+        self.assertIn('Checked 2 runs, changed 2', out)
+        self.assertEqual(99, self.distances()[0])
+        # The interrupted pass's athletes are rebuilt too
+        self.assertEqual(99 + self.distances()[1], AthleteStats.objects.get(athlete=self.athletes[0]).total_distance)
+
+    def test_filters(self):
+        self.assertIn('Checked 1 runs, changed 1', self.recompute('--athlete', str(self.athletes[1].id)))
+        self.assertEqual([99, 99], self.distances()[:2])
+        self.assertIn('Checked 2 runs, changed 1', self.recompute('--since', '2025-03-05'))
+        self.assertEqual(99, self.distances()[0])
@@ -0,0 +1,233 @@
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, Greatest, Least
+from django.utils import timezone
+from rest_framework import status
+
+from app_run.collectibles import collect_items
+from app_run.distance import point_distance
+from app_run.models import Run, Position, PendingPosition, PositionFlushState
+from app_run.serializers import BulkPositionSerializer, PositionFixSerializer, PositionSerializer
+
+
+class RunNotInProgress(Exception):
+    """The run was stopped while a fix that passed validation waited for its lock."""
+
+
+def chain_position(previous, latitude, longitude, date_time, travelled):
+    """Cumulative distance (km) and segment speed (m/s) of a fix that follows ``previous``.
+
+    ``travelled`` is the unrounded distance (m) up to ``previous``; the cumulative distance is chained from it,
+    so the rounding of each fix does not add up. Also returns the unrounded distance up to the new fix.
+    """
+    if previous is None:
+        return Decimal('0.0000'), Decimal('0.00'), 0.0
+
+    distance_previous_to_current = point_distance([previous.latitude, previous.longitude], [latitude, longitude])
+    travelled += distance_previous_to_current
+    distance = Decimal(str(travelled))
+    time = (date_time - previous.date_time).total_seconds()
+    if time > 0 and distance_previous_to_current > 0:
+        speed = Decimal(str(distance_previous_to_current / time))
+    else:
+        speed = Decimal(previous.speed) if previous.speed else Decimal('0.00')
+
+    if distance == 0:
+        speed = Decimal('0.00')
+    return ((distance / 1000).quantize(Decimal('0.0001'), rounding=ROUND_HALF_UP),
+            speed.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP), travelled)
+
+
+def travelled_before(run, previous):
+    """Unrounded distance (m) of the locked ``run`` up to ``previous``, its last fix."""
+    if previous is None or run.positions_count:
+        return run.distance_meters
+    # Positions stored without the aggregates (before they existed, or not through the API)
+    return float(previous.distance) * 1000
+
+
+TAIL_CACHE_TIMEOUT = 60 * 60 * 12
+
+
+def _tail_key(run_id):
+    return f'run:{run_id}:tail'
+
+
+def _tail(position):
+    return {
+        'latitude': position.latitude,
+        'longitude': position.longitude,
+        'date_time': position.date_time,
+        'distance': position.distance,
+        'speed': position.speed,
+    }
+
+
+def remember_tail(position):
+    """Write the fix through to the run's tail cache unless a later fix is already there."""
+    tail = cache.get(_tail_key(position.run_id))
+    if tail is None or tail['date_time'] <= position.date_time:
+        cache.set(_tail_key(position.run_id), _tail(position), TAIL_CACHE_TIMEOUT)
+
+
+def forget_tail(run):
+    cache.delete(_tail_key(run.pk))
+
+
+def last_position(run):
+    """Latest fix of ``run``, which the caller has loaded under ``select_for_update``.
+
+    The cached tail is used only if it is the fix the locked run's ``last_position_at`` points to: another
+    process may have stored later fixes without this process's cache seeing them.
+    """
+    tail = cache.get(_tail_key(run.pk))
+    if tail is not None and run.last_position_at is not None and tail['date_time'] == run.last_position_at:
+        return Position(run_id=run.pk, **tail)
+    position = Position.objects.filter(run=run).order_by('date_time').last()
+    if position:
+        transaction.on_commit(lambda: remember_tail(position))
+    return position
+
+
+def accumulate(run, positions, travelled):
+    """Add freshly stored positions to the running aggregates of ``run``; ``travelled`` is the new chain length (m)."""
+    first_at = min(p.date_time for p in positions)
+    last_at = max(p.date_time for p in positions)
+    Run.objects.filter(pk=run.pk).update(
+        positions_count=F('positions_count') + len(positions),
+        distance_meters=travelled,
+        speed_sum=F('speed_sum') + sum(p.speed for p in positions),
+        distance=Greatest(F('distance'), Value(max(p.distance for p in positions))),
+        first_position_at=Coalesce(Least(F('first_position_at'), Value(first_at)), Value(first_at)),
+        last_position_at=Coalesce(Greatest(F('last_position_at'), Value(last_at)), Value(last_at)),
+    )
+
+
+def save_position(run, fix):
+    """Store one fix chained after the run's last position."""
+    with transaction.atomic():
+        locked = Run.objects.select_for_update().get(pk=run.pk)
+        if locked.status != Run.STATUS_IN_PROGRESS:
+            raise RunNotInProgress
+        previous = last_position(locked)
+        distance, speed, travelled = chain_position(previous, fix['latitude'], fix['longitude'], fix['date_time'],
+                                                    travelled_before(locked, previous))
+        position = Position.objects.create(run=run, distance=distance, speed=speed, **fix)
+        accumulate(run, [position], travelled)
+        collect_items(run.athlete, [[position.latitude, position.longitude]])
+        transaction.on_commit(lambda: remember_tail(position))
+    return position
+
+
+def ingest_positions(run, fixes):
+    """Store an ordered batch of fixes for ``run`` in one transaction, chained after its last stored position."""
+    with transaction.atomic():
+        # Serializes concurrent batches of the same run so both don't chain from the same tail
+        locked = Run.objects.select_for_update().get(pk=run.pk)
+        if locked.status != Run.STATUS_IN_PROGRESS:
+            raise RunNotInProgress
+        previous = last_position(locked)
+        travelled = travelled_before(locked, previous)
+        positions = []
+        for fix in fixes:
+            distance, speed, travelled = chain_position(previous, fix['latitude'], fix['longitude'],
+                                                        fix['date_time'], travelled)
+            previous = Position(run=run, latitude=fix['latitude'], longitude=fix['longitude'],
+                                date_time=fix['date_time'], distance=distance, speed=speed)
+            positions.append(previous)
+        Position.objects.bulk_create(positions)
+        if positions:
+            accumulate(run, positions, travelled)
+            collect_items(run.athlete, [[p.latitude, p.longitude] for p in positions])
+            tail = max(positions, key=lambda p: p.date_time)
+            transaction.on_commit(lambda: remember_tail(tail))
+    return positions
+
+
+def ingest_bulk(data):
+    """Validate a bulk upload of fixes and store the valid ones; returns per-item results and the response status."""
+    serializer = BulkPositionSerializer(data=data)
+    if not serializer.is_valid():
+        return serializer.errors, status.HTTP_400_BAD_REQUEST
+
+    results, fixes = [], []
+    for item in serializer.validated_data['positions']:
+        fix = PositionFixSerializer(data=item)
+        if fix.is_valid():
+            fixes.append(fix.validated_data)
+            results.append(None)
+        else:
+            results.append({'status': status.HTTP_400_BAD_REQUEST, 'errors': fix.errors})
+
+    try:
+        positions = iter(ingest_positions(serializer.validated_data['run'], fixes))
+    except RunNotInProgress:
+        return {'run': ['Забег не запущен']}, status.HTTP_400_BAD_REQUEST
+    for i, result in enumerate(results):
+        if result is None:
+            results[i] = {'status': status.HTTP_201_CREATED, 'data': PositionSerializer(next(positions)).data}
+
+    if not fixes:
+        return results, status.HTTP_400_BAD_REQUEST
+    if len(fixes) < len(results):
+        return results, status.HTTP_207_MULTI_STATUS
+    return results, status.HTTP_201_CREATED
+
+
+def flush_pending(run=None, limit=5000, skip_locked=True):
+    """Store up to ``limit`` queued fixes, oldest first, in per-run batches ordered by time; returns how many.
+
+    With ``skip_locked`` several workers drain the queue without waiting on each other, and fixes of a run
+    locked elsewhere (being stopped) stay queued. Stopping a run passes False: it waits for a worker holding
+    some of the run's fixes, then stores whatever is left itself.
+    """
+    skip_locked = skip_locked and connection.features.has_select_for_update_skip_locked
+    pending = PendingPosition.objects.order_by('id')
+    if run is not None:
+        pending = pending.filter(run=run)
+    with transaction.atomic():
+        rows = list(pending.select_for_update(skip_locked=skip_locked)[:limit])
+        if not rows:
+            return 0
+
+        by_run = defaultdict(list)
+        for row in rows:
+            by_run[row.run_id].append(row)
+        done = []
+        for run_id, run_rows in by_run.items():
+            # Locked before the status check, so a run cannot be finished while its fixes are stored
+            locked = Run.objects.select_related('athlete').select_for_update(
+                of=('self',), skip_locked=skip_locked).filter(pk=run_id).first()
+            if locked is None:
+                continue
+            # Fixes that raced with the run being stopped have nowhere to go
+            if locked.status == Run.STATUS_IN_PROGRESS:
+                run_rows.sort(key=lambda row: (row.date_time, row.id))
+                ingest_positions(locked, [{'latitude': row.latitude, 'longitude': row.longitude,
+                                           'date_time': row.date_time} for row in run_rows])
+            done += run_rows
+        PendingPosition.objects.filter(id__in=[row.id for row in done]).delete()
+
+    # Workers only: a stop would hold this row until its own transaction commits. Outside the flush
+    # transaction, so concurrent workers only queue on the row for this one update
+    if run is None:
+        flushed = {'last_flush_at': timezone.now(), 'last_flush_count': len(done)}
+        if not PositionFlushState.objects.filter(pk=1).update(**flushed):
+            PositionFlushState.objects.get_or_create(pk=1, defaults=flushed)
+    return len(done)
+
+
+def pending_stats():
+    """Back-pressure metrics of the write-behind queue; the last flush is the last one of a worker."""
+    oldest = PendingPosition.objects.order_by('received_at').values_list('received_at', flat=True).first()
+    last_flush = PositionFlushState.objects.filter(pk=1).values('last_flush_at', 'last_flush_count').first() or {}
+    return {
+        'queue_depth': PendingPosition.objects.count(),
+        'flush_lag_seconds': (timezone.now() - oldest).total_seconds() if oldest else 0,
+        'last_flush_at': last_flush.get('last_flush_at'),
+        'last_flush_count': last_flush.get('last_flush_count', 0),
+    }
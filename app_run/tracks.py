@@ -0,0 +1,206 @@
+"""
+Packed storage of finished tracks.
+
+A track is stored as five columns: latitude and longitude in 1e-4 degrees, time in
+microseconds since the epoch, speed in 1e-2 m/s and cumulative distance in 1e-4 km.
+These are the scales of the Position fields, so packing is lossless. Every column is
+delta encoded as zigzag varints and the whole blob is zlib compressed, which takes a
+1 Hz track to a few bytes per fix.
+
+Map views read tracks simplified with Douglas-Peucker (``simplify_track``), cached per
+tolerance once the run is finished, and may take them as a Google encoded polyline or as
+parallel arrays (``compact_track``) instead of one JSON object per fix.
+"""
+import math
+import zlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.core.cache import cache
+
+from app_run.models import Run, Position, RunTrack
+
+FORMAT_VERSION = 1
+POINT_FIELDS = ('latitude', 'longitude', 'date_time', 'speed', 'distance')
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+_EXPONENTS = (4, 4, None, 2, 4)
+_MICROSECOND = timedelta(microseconds=1)
+EARTH_RADIUS_METERS = 6371008.8
+SIMPLIFIED_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def write_varint(out, value):
+    value = value * 2 if value >= 0 else -value * 2 - 1
+    while value >= 0x80:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, offset):
+    value, shift = 0, 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return (value >> 1) ^ -(value & 1), offset
+        shift += 7
+
+
+def encode_track(points):
+    """Pack ``(latitude, longitude, date_time, speed, distance)`` tuples ordered by time."""
+    columns = [[] for _ in POINT_FIELDS]
+    for point in points:
+        for column, exponent, value in zip(columns, _EXPONENTS, point):
+            if exponent is None:
+                column.append((value - EPOCH) // _MICROSECOND)
+            else:
+                column.append(int(Decimal(value).scaleb(exponent).to_integral_value()))
+
+    out = bytearray([FORMAT_VERSION])
+    write_varint(out, len(columns[0]))
+    for column in columns:
+        previous = 0
+        for value in column:
+            write_varint(out, value - previous)
+            previous = value
+    return zlib.compress(bytes(out))
+
+
+def decode_track(data):
+    """Yield the tuples packed by ``encode_track``."""
+    data = zlib.decompress(bytes(data))
+    if data[0] != FORMAT_VERSION:
+        raise ValueError(f'Unknown track format {data[0]}')
+    count, offset = read_varint(data, 1)
+
+    columns = []
+    for exponent in _EXPONENTS:
+        column, value = [], 0
+        for _ in range(count):
+            delta, offset = read_varint(data, offset)
+            value += delta
+            column.append(EPOCH + value * _MICROSECOND if exponent is None else Decimal(value).scaleb(-exponent))
+        columns.append(column)
+    yield from zip(*columns)
+
+
+def pack_track(run):
+    points = list(Position.objects.filter(run=run).order_by('date_time', 'id').values_list(*POINT_FIELDS))
+    if not points:
+        return None
+    track, _ = RunTrack.objects.update_or_create(run=run, defaults={'points': len(points),
+                                                                    'data': encode_track(points)})
+    return track
+
+
+def track_points(run):
+    """Point tuples of the run, from its packed track if there is one and from the positions table otherwise."""
+    data = RunTrack.objects.filter(run=run).values_list('data', flat=True).first()
+    if data is not None:
+        return list(decode_track(data))
+    return list(Position.objects.filter(run=run).order_by('date_time', 'id').values_list(*POINT_FIELDS))
+
+
+def runs_track_points(run_ids):
+    """{run_id: point tuples} of several runs, read in two queries."""
+    points = {run_id: [] for run_id in run_ids}
+    packed = dict(RunTrack.objects.filter(run_id__in=run_ids).values_list('run_id', 'data'))
+    for run_id, data in packed.items():
+        points[run_id] = list(decode_track(data))
+    rows = Position.objects.filter(run_id__in=points.keys() - packed.keys()).order_by(
+        'run_id', 'date_time', 'id').values_list('run_id', *POINT_FIELDS)
+    for run_id, *point in rows.iterator(chunk_size=10000):
+        points[run_id].append(tuple(point))
+    return points
+
+
+def track_positions(run_id, points):
+    """Unsaved Position instances for serializing point tuples."""
+    return [Position(run_id=run_id, **dict(zip(POINT_FIELDS, point))) for point in points]
+
+
+def _segment_distance(point, start, end):
+    (x, y), (x1, y1), (x2, y2) = point, start, end
+    dx, dy = x2 - x1, y2 - y1
+    length = dx * dx + dy * dy
+    t = max(0.0, min(1.0, ((x - x1) * dx + (y - y1) * dy) / length)) if length else 0.0
+    return math.hypot(x - x1 - t * dx, y - y1 - t * dy)
+
+
+def simplify_track(points, tolerance):
+    """Douglas-Peucker simplification of point tuples with ``tolerance`` in meters."""
+    points = list(points)
+    if len(points) < 3:
+        return points
+
+    # Equirectangular projection around the track: exact enough at the scale of a run
+    scale = math.cos(math.radians(sum(float(point[0]) for point in points) / len(points)))
+    xy = [(math.radians(float(point[1])) * scale * EARTH_RADIUS_METERS,
+           math.radians(float(point[0])) * EARTH_RADIUS_METERS) for point in points]
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        farthest, index = 0.0, None
+        for i in range(first + 1, last):
+            distance = _segment_distance(xy[i], xy[first], xy[last])
+            if distance > farthest:
+                farthest, index = distance, i
+        if index is not None and farthest > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def simplified_track_points(run, tolerance):
+    """Simplified point tuples of the run; finished runs no longer change, so theirs are cached."""
+    finished = run.status == Run.STATUS_FINISHED
+    key = f'run:{run.pk}:simplified:{tolerance:g}'
+    if finished:
+        points = cache.get(key)
+        if points is not None:
+            return points
+    points = simplify_track(track_points(run), tolerance)
+    if finished:
+        cache.set(key, points, SIMPLIFIED_CACHE_TIMEOUT)
+    return points
+
+
+def encode_polyline(points):
+    """Google encoded polyline (precision 5) of the latitude/longitude of point tuples."""
+    out = []
+    previous_latitude = previous_longitude = 0
+    for point in points:
+        latitude = int(Decimal(point[0]).scaleb(5).to_integral_value())
+        longitude = int(Decimal(point[1]).scaleb(5).to_integral_value())
+        for value in (latitude - previous_latitude, longitude - previous_longitude):
+            value = ~(value << 1) if value < 0 else value << 1
+            while value >= 0x20:
+                out.append(chr((0x20 | value & 0x1f) + 63))
+                value >>= 5
+            out.append(chr(value + 63))
+        previous_latitude, previous_longitude = latitude, longitude
+    return ''.join(out)
+
+
+def compact_track(output_format, run_id, points):
+    """Response body of a track in the 'polyline' or 'columnar' output format."""
+    if output_format == 'polyline':
+        return {'run': run_id, 'count': len(points), 'polyline': encode_polyline(points)}
+
+    start = points[0][2] if points else None
+    return {
+        'run': run_id,
+        'count': len(points),
+        'start': start.isoformat() if start else None,
+        'time_offset_ms': [(point[2] - start) // timedelta(milliseconds=1) for point in points],
+        'latitude': [float(point[0]) for point in points],
+        'longitude': [float(point[1]) for point in points],
+        'speed': [float(point[3]) for point in points],
+        'distance': [float(point[4]) for point in points],
+    }
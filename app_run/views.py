@@ -1,25 +1,45 @@
-from decimal import Decimal, ROUND_HALF_UP
+from datetime import date, timedelta
+from zipfile import BadZipFile
 
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db.models import Count, Sum, Q, Avg, Max
+from django.db import DatabaseError, transaction
+from django.db.models.functions import Coalesce
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
-from geopy.distance import geodesic
-from openpyxl import load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
 from rest_framework import status
-from rest_framework.decorators import api_view
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.decorators import api_view, action
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import OrderingFilter
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
-from app_run.distance import calculate_distance
-from app_run.models import Run, AthleteInfo, Challenge, Position, CollectibleItem, Subscribe
+from app_run.analytics import coach_analytics, coach_trends, TREND_PERIODS
+from app_run.challenges import challenge_summary, SUMMARY_ATHLETES_LIMIT
+from app_run.finalization import complete_run, enqueue_finalization
+from app_run.heatmap import ZOOMS, TILE_CELLS, tile_cells
+from app_run.item_import import sheet_rows, import_items, ItemImportError
+from app_run.leaderboards import BOARDS, current_period, top_entries, athlete_rank
+from app_run.models import Run, AthleteInfo, Challenge, Position, CollectibleItem, Subscribe, RunTrack, \
+    PendingPosition, RunFinalizationJob, RunSplits, PersonalBest
+from app_run.profiles import user_detail
+from app_run.ratings import coach_rating, rate, subscribe
+from app_run.search import UserSearchFilter, autocomplete
+from app_run.pagination import RunCursorPagination, PositionCursorPagination
+from app_run.renderers import PolylineRenderer, ColumnarRenderer
 from app_run.serializers import RunSerializer, UserSerializer, AthleteInfoSerializer, ChallengeSerializer, \
-    PositionSerializer, CollectibleItemSerializer, AthleteDetailSerializer, CoachDetailSerializer, \
-    AthleteChallengeSerializer, SubscribeSerializer
+    PositionSerializer, CollectibleItemSerializer, \
+    AthleteChallengeSerializer, SubscribeSerializer, \
+    RunFinalizationJobSerializer, RunSplitsSerializer, PersonalBestSerializer
+from app_run.tracking import chain_position, travelled_before, last_position, ingest_bulk, accumulate, remember_tail, \
+    pending_stats
+from app_run.tracks import decode_track, track_positions, simplified_track_points, track_points, \
+    compact_track
 
 
 class RunUserPagination(PageNumberPagination):
@@ -42,36 +62,74 @@ class AnalyticsForCoachView(APIView):
         if error_response:
             return error_response
 
-        analytics = Run.objects.filter(athlete__coaches__coach=coach.id).values('athlete').annotate(
-            avg_speed=Avg('speed'),
-            total_distance=Sum('distance'),
-            max_distance=Max('distance'))
+        return Response(coach_analytics(coach), status=status.HTTP_200_OK)
 
-        total_run_value, total_run_user = 0, 0
-        speed_avg_value, speed_avg_user = 0, 0
-        longest_run_user, longest_run_value = 0, 0
 
-        for athlete in analytics:
-            if athlete['max_distance'] > longest_run_value:
-                longest_run_value = athlete['max_distance']
-                longest_run_user = athlete['athlete']
+class TrendsForCoachView(APIView):
+    def get(self, request, *args, **kwargs):
+        coach = User.objects.filter(id=self.kwargs.get('id'), is_superuser=False).first()
+
+        error_response = validate_coach(coach)
+        if error_response:
+            return error_response
 
-            if athlete['avg_speed'] > speed_avg_value:
-                speed_avg_value = athlete['avg_speed']
-                speed_avg_user = athlete['athlete']
+        period = request.query_params.get('period', 'week')
+        if period not in TREND_PERIODS:
+            return Response({'error': f'period должен быть одним из: {", ".join(TREND_PERIODS)}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            end = date.fromisoformat(request.query_params['end']) if 'end' in request.query_params \
+                else timezone.localdate()
+            start = date.fromisoformat(request.query_params['start']) if 'start' in request.query_params \
+                else end - timedelta(days=90)
+            athlete = int(request.query_params['athlete']) if 'athlete' in request.query_params else None
+        except ValueError:
+            return Response({'error': 'Даты в формате YYYY-MM-DD, athlete - число'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if start > end:
+            return Response({'error': 'start позже end'}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(coach_trends(coach, start, end, period, athlete), status=status.HTTP_200_OK)
+
+
+class LeaderboardView(APIView):
+    def get(self, request, board):
+        leaderboard = BOARDS.get(board)
+        if leaderboard is None:
+            return Response({'error': f'Нет такой таблицы, доступны: {", ".join(BOARDS)}'},
+                            status=status.HTTP_404_NOT_FOUND)
+        period = request.query_params.get('period') or current_period(leaderboard)
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), 100)
+            offset = int(request.query_params.get('offset', 0))
+            athlete = int(request.query_params['athlete']) if 'athlete' in request.query_params else None
+        except ValueError:
+            return Response({'error': 'limit, offset и athlete должны быть числами'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1 or offset < 0:
+            return Response({'error': 'limit должен быть больше 0, offset не меньше 0'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        data = {
+            'board': board,
+            'period': period,
+            'results': [{'rank': rank, 'score': entry.score, 'athlete': AthleteChallengeSerializer(entry.athlete).data}
+                        for rank, entry in top_entries(leaderboard, period, limit, offset)],
+        }
+        if athlete is not None:
+            ranked = athlete_rank(leaderboard, period, athlete)
+            data['athlete_rank'] = {'rank': ranked[0], 'score': ranked[1].score} if ranked else None
+        return Response(data, status=status.HTTP_200_OK)
 
-            if athlete['total_distance'] > total_run_value:
-                total_run_value = athlete['total_distance']
-                total_run_user = athlete['athlete']
 
-        return Response({
-            'longest_run_user': longest_run_user,
-            'longest_run_value': longest_run_value,
-            'total_run_user': total_run_user,
-            'total_run_value': total_run_value,
-            'speed_avg_user': speed_avg_user,
-            'speed_avg_value': speed_avg_value
-        }, status=status.HTTP_200_OK)
+class HeatmapTileView(APIView):
+    def get(self, request, zoom, x, y):
+        if zoom not in ZOOMS or not (0 <= x < 1 << zoom and 0 <= y < 1 << zoom):
+            return Response({'error': f'Тайлы есть для zoom {ZOOMS[0]}-{ZOOMS[-1]}'},
+                            status=status.HTTP_404_NOT_FOUND)
+        cells, counts = tile_cells(zoom, x, y)
+        return Response({'zoom': zoom, 'x': x, 'y': y, 'size': TILE_CELLS, 'cells': cells, 'counts': counts},
+                        status=status.HTTP_200_OK)
 
 
 class RateCoachView(APIView):
@@ -94,8 +152,7 @@ class RateCoachView(APIView):
                 return Response({'error': 'Рейтинг должен быть числом'}, status=status.HTTP_400_BAD_REQUEST)
             serializer = SubscribeSerializer(data={'coach': coach.id, 'athlete': athlete.id, 'rating': rating})
             if serializer.is_valid():
-                subscription.rating = rating
-                subscription.save()
+                subscription = rate(subscription, rating)
                 return Response({'rating': subscription.rating}, status=status.HTTP_200_OK)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         return Response({'error': 'Пользователь не подписан на этого тренера'}, status=status.HTTP_400_BAD_REQUEST)
@@ -103,23 +160,15 @@ class RateCoachView(APIView):
 
 class ChallengeSummaryView(APIView):
     def get(self, request, *args, **kwargs):
-        challenges = Challenge.objects.select_related('athlete').all().order_by('full_name')
-        challenge_athletes = {}
-        for challenge in challenges:
-            if challenge.full_name not in challenge_athletes:
-                challenge_athletes[challenge.full_name] = []
-            challenge_athletes[challenge.full_name].append(challenge.athlete)
-
-        answer = []
-
-        for challenge, athletes in challenge_athletes.items():
-            data = {
-                'name_to_display': challenge,
-                'athletes': AthleteChallengeSerializer(athletes, many=True).data
-            }
-            answer.append(data)
-
-        return Response(status=status.HTTP_200_OK, data=answer)
+        try:
+            offset = int(request.query_params.get('offset', 0))
+            limit = int(request.query_params.get('limit', SUMMARY_ATHLETES_LIMIT))
+        except ValueError:
+            return Response({'error': 'offset и limit должны быть числами'}, status=status.HTTP_400_BAD_REQUEST)
+        if offset < 0 or not 0 < limit <= SUMMARY_ATHLETES_LIMIT:
+            return Response({'error': f'offset не меньше 0, limit от 1 до {SUMMARY_ATHLETES_LIMIT}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response(status=status.HTTP_200_OK, data=challenge_summary(offset, limit))
 
 
 class SubscribeView(APIView):
@@ -134,7 +183,7 @@ class SubscribeView(APIView):
 
         if Subscribe.objects.filter(athlete=athlete, coach=coach).exists():
             return Response(status=status.HTTP_400_BAD_REQUEST)
-        Subscribe.objects.create(athlete=athlete, coach=coach)
+        subscribe(athlete, coach)
         return Response(status=status.HTTP_200_OK)
 
 
@@ -144,7 +193,17 @@ class RunViewSet(ModelViewSet):
     filter_backends = [DjangoFilterBackend, OrderingFilter]
     filterset_fields = ['status', 'athlete']
     ordering_fields = ['created_at']
-    pagination_class = RunUserPagination
+    pagination_class = RunCursorPagination
+
+    @action(detail=True, methods=['get'])
+    def splits(self, request, pk=None):
+        run = self.get_object()
+        splits = RunSplits.objects.filter(run=run).first()
+        if splits is None:
+            return Response({'error': 'Сплиты считаются после завершения забега'}, status=status.HTTP_404_NOT_FOUND)
+        data = RunSplitsSerializer(splits).data
+        data['personal_bests'] = sorted(PersonalBest.objects.filter(run=run).values_list('distance', flat=True))
+        return Response(data, status=status.HTTP_200_OK)
 
 
 class PositionViewSet(ModelViewSet):
@@ -152,64 +211,115 @@ class PositionViewSet(ModelViewSet):
     serializer_class = PositionSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['run']
+    pagination_class = PositionCursorPagination
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [PolylineRenderer, ColumnarRenderer]
 
-    def perform_create(self, serializer):
-        run = serializer.validated_data['run']
-        positions = Position.objects.filter(run=run).order_by('date_time')
-        if positions.exists():
-            previous_position = positions.last()
-            distance_previous_to_current = geodesic([previous_position.latitude, previous_position.longitude],
-                                                    [serializer.validated_data['latitude'],
-                                                     serializer.validated_data['longitude']]).m
-            previous_time = previous_position.date_time
-            last_time = serializer.validated_data['date_time']
-            distance = previous_position.distance * 1000 + Decimal(str(distance_previous_to_current))
-            time = (last_time - previous_time).total_seconds()
-            if time > 0 and distance_previous_to_current > 0:
-                speed = Decimal(str(distance_previous_to_current / time))
-            else:
-                speed = Decimal(previous_position.speed) if previous_position.speed else Decimal('0.00')
-
-            if distance == 0:
-                speed = Decimal('0.00')
+    def list(self, request, *args, **kwargs):
+        run_id = request.query_params.get('run')
+        run_id = int(run_id) if run_id and run_id.isdigit() else None
+        output_format = request.accepted_renderer.format
+        compact = output_format in (PolylineRenderer.format, ColumnarRenderer.format)
+        tolerance = request.query_params.get('simplify')
+
+        if tolerance is not None:
+            try:
+                tolerance = float(tolerance)
+            except ValueError:
+                tolerance = None
+            if tolerance is None or not 0 < tolerance < float('inf') or run_id is None:
+                return Response({'error': 'simplify - допуск в метрах, требует параметр run'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            points = simplified_track_points(get_object_or_404(Run, id=run_id), tolerance)
+        elif compact:
+            if run_id is None:
+                return Response({'error': 'Формат трека требует параметр run'}, status=status.HTTP_400_BAD_REQUEST)
+            points = track_points(get_object_or_404(Run, id=run_id))
         else:
-            distance, speed = Decimal('0.0000'), Decimal('0.00')
-        serializer.save(distance=(distance / 1000).quantize(Decimal('0.0001'), rounding=ROUND_HALF_UP),
-                        speed=speed.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
+            data = RunTrack.objects.filter(run_id=run_id).values_list('data', flat=True).first() if run_id else None
+            if data is None:
+                return super().list(request, *args, **kwargs)
+            points = decode_track(data)
+
+        if compact:
+            return Response(compact_track(output_format, run_id, points))
+        positions = track_positions(run_id, points)
+        page = self.paginate_queryset(positions)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(positions, many=True).data)
+
+    def create(self, request, *args, **kwargs):
+        if not settings.POSITIONS_WRITE_BEHIND:
+            return super().create(request, *args, **kwargs)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        pending = PendingPosition.objects.create(**serializer.validated_data)
+        return Response({'run': pending.run_id, 'queued': pending.id}, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['get'])
+    def queue(self, request):
+        return Response(pending_stats())
+
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            # Concurrent fixes of a run chain one after the other, each from the tail the previous one stored
+            run = Run.objects.select_for_update().get(pk=serializer.validated_data['run'].pk)
+            # Validation read the run unlocked: it may have been stopped since
+            if run.status != Run.STATUS_IN_PROGRESS:
+                raise ValidationError({'run': ['Забег не запущен']})
+            previous = last_position(run)
+            distance, speed, travelled = chain_position(previous, serializer.validated_data['latitude'],
+                                                        serializer.validated_data['longitude'],
+                                                        serializer.validated_data['date_time'],
+                                                        travelled_before(run, previous))
+            position = serializer.save(distance=distance, speed=speed)
+            accumulate(run, [position], travelled)
+            transaction.on_commit(lambda: remember_tail(position))
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request):
+        results, response_status = ingest_bulk(request.data)
+        return Response(results, status=response_status)
 
 
 class UserViewSet(ReadOnlyModelViewSet):
-    queryset = User.objects.all().annotate(runs_finished=Count('run', filter=Q(run__status='finished')))
+    queryset = User.objects.all().annotate(runs_finished=Coalesce('stats__runs_finished', 0))
     serializer_class = UserSerializer
-    filter_backends = [SearchFilter, OrderingFilter]
-    search_fields = ['first_name', 'last_name']
+    filter_backends = [UserSearchFilter, OrderingFilter]
     ordering_fields = ['date_joined']
     pagination_class = RunUserPagination
-
-    def get_serializer_class(self):
-        if self.action == 'list':
-            return UserSerializer
-        elif self.action == 'retrieve':
-            user = User.objects.filter(id=self.kwargs.get('pk'), is_staff=False).first()
-            return AthleteDetailSerializer if user else CoachDetailSerializer
-        return super().get_serializer_class()
+    autocomplete_limit = 10
+    max_autocomplete_limit = 50
+
+    def retrieve(self, request, *args, **kwargs):
+        detail = user_detail(kwargs['pk'])
+        if detail is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        return Response(detail, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'], url_path='autocomplete')
+    def autocomplete(self, request):
+        try:
+            limit = int(request.query_params.get('limit', self.autocomplete_limit))
+        except ValueError:
+            return Response({'error': 'Неверный limit'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, self.max_autocomplete_limit))
+        users = autocomplete(self.get_queryset(), request.query_params.get('q', ''), limit)
+        return Response(UserSerializer(users, many=True).data, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['get'], url_path='personal_bests')
+    def personal_bests(self, request, pk=None):
+        bests = PersonalBest.objects.filter(athlete_id=pk).select_related('run').order_by('distance')
+        return Response(PersonalBestSerializer(bests, many=True).data, status=status.HTTP_200_OK)
 
     def get_queryset(self):
         qs = self.queryset
         type = self.request.query_params.get('type', None)
-        if self.action == 'list':
+        if self.action in ('list', 'autocomplete'):
             if type == 'coach':
-                qs = qs.filter(is_staff=1).annotate(rating=Avg('athletes__rating'))
+                qs = qs.filter(is_staff=1).annotate(rating=coach_rating())
             elif type == 'athlete':
                 qs = qs.filter(is_staff=0)
-            return qs.filter(is_superuser=False)
-        elif self.action == 'retrieve':
-            user_id = self.kwargs.get('pk')
-            user = get_object_or_404(User, id=user_id)
-            if user.is_staff:
-                qs = qs.prefetch_related('athletes__athlete').annotate(rating=Avg('athletes__rating'))
-            else:
-                qs = qs.prefetch_related('coaches__coach')
         return qs.filter(is_superuser=False)
 
 
@@ -227,55 +337,20 @@ class RunStopView(APIView):
     def post(self, request, run_id):
         run = get_object_or_404(Run, id=run_id)
         if run.status == 'in_progress':
-
-            # --------------- Calculate distance and number of finished runs ---------------
-
-            run.status = 'finished'
-            run.distance = calculate_distance(run)
-            run.save()
-            finished_runs = Run.objects.filter(athlete=run.athlete, status='finished')
-            finished_runs_data = finished_runs.aggregate(Count('id'), Sum('distance'))
-            finished_runs_data['distance__sum'] = finished_runs_data['distance__sum'] or 0
-
-            # ------------------------- Calculate time and speed -------------------------
-
-            positions = Position.objects.filter(run=run).order_by('date_time')
-            if positions.count() >= 2:
-                min_date, max_date = positions.first().date_time, positions.last().date_time
-                time = (max_date - min_date).total_seconds()
-                if time > 0:
-                    run.run_time_seconds = int(time)
-                    avg_speed = positions.aggregate(avg_speed=Avg('speed'))['avg_speed']
-                    run.speed = round(avg_speed, 2) if avg_speed else 0
-                else:
-                    run.run_time_seconds, run.speed = 0, 0
-            else:
-                run.run_time_seconds, run.speed = 0, 0
-
-            run.save()
-
-            # ------------------------- Check Challenges -------------------------
-
-            if finished_runs_data.get('id__count') == 10 and not Challenge.objects.filter(
-                    athlete=run.athlete,
-                    full_name=Challenge.CHALLENGE_10_RUNS).exists():
-                Challenge.objects.create(full_name=Challenge.CHALLENGE_10_RUNS, athlete=run.athlete)
-
-            if finished_runs_data.get('distance__sum') >= 50 and not Challenge.objects.filter(
-                    athlete=run.athlete,
-                    full_name=Challenge.CHALLENGE_50KM).exists():
-                Challenge.objects.create(full_name=Challenge.CHALLENGE_50KM, athlete=run.athlete)
-
-            if (
-                    positions.count() >= 2 and run.run_time_seconds <= 600 and run.distance >= 2) and not Challenge.objects.filter(
-                athlete=run.athlete,
-                full_name=Challenge.CHALLENGE_2KM_10MIN).exists():
-                Challenge.objects.create(full_name=Challenge.CHALLENGE_2KM_10MIN, athlete=run.athlete)
-
+            if settings.RUN_FINALIZATION_ASYNC:
+                job = enqueue_finalization(run)
+                return Response(RunFinalizationJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+            complete_run(run)
             return Response(RunSerializer(run).data, status=status.HTTP_200_OK)
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
+class RunFinalizationJobView(APIView):
+    def get(self, request, job_id):
+        job = get_object_or_404(RunFinalizationJob, id=job_id)
+        return Response(RunFinalizationJobSerializer(job).data, status=status.HTTP_200_OK)
+
+
 class AthleteInfoView(APIView):
     def put(self, request, user_id):
         user = get_object_or_404(User, id=user_id)
@@ -303,27 +378,18 @@ def upload_collectible_items(request):
     if not file:
         return Response(status=status.HTTP_400_BAD_REQUEST, data={'error': 'Файл не передан'})
 
-    xl = load_workbook(file)
-    active_list = xl.active
-
-    invalid_rows = []
-
-    for row in active_list.iter_rows(min_row=2):
-        row_data = {
-            'name': row[0].value,
-            'uid': row[1].value,
-            'value': row[2].value,
-            'latitude': row[3].value,
-            'longitude': row[4].value,
-            'picture': row[5].value
-        }
-
-        serializer = CollectibleItemSerializer(data=row_data)
-        if serializer.is_valid():
-            serializer.save()
-        else:
-            invalid_rows.append([i.value for i in row])
-
+    try:
+        rows = sheet_rows(file)
+    except (InvalidFileException, BadZipFile, KeyError, OSError):
+        return Response(status=status.HTTP_400_BAD_REQUEST, data={'error': 'Не удалось прочитать файл'})
+    # ?upsert=1 updates the items whose uid already exists instead of adding new ones
+    upsert = request.query_params.get('upsert', '0').lower() in ('1', 'true')
+    try:
+        _, invalid_rows = import_items(rows, upsert)
+    except ItemImportError as exc:
+        response_status = status.HTTP_500_INTERNAL_SERVER_ERROR if isinstance(exc.cause, DatabaseError) \
+            else status.HTTP_400_BAD_REQUEST
+        return Response(status=response_status, data={'error': 'Импорт прерван', 'imported': exc.imported})
     return Response(status=status.HTTP_200_OK, data=invalid_rows)
 
 
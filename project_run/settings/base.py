@@ -30,6 +30,22 @@ COMPANY_NAME = 'Раз-Бег!'
 SLOGAN = 'Крылатые атлеты начинают свой разбег!'
 CONTACTS = 'Город Атлантида, улица Карла Маркса, дом 52'
 
+# Distance model for tracks: 'haversine', 'vincenty' or 'karney' (see app_run/distance.py)
+DISTANCE_MODEL = 'vincenty'
+
+# Queue single position posts and store them from the flush_positions worker instead of in the request
+POSITIONS_WRITE_BEHIND = False
+
+# Finish runs in the process_finalization_jobs worker: the stop endpoint answers 202 with a job to poll
+RUN_FINALIZATION_ASYNC = False
+RUN_FINALIZATION_MAX_ATTEMPTS = 3
+
+# Cache the serialized user detail (/api/users/<id>/) until the user's subscriptions, items or runs change
+USER_DETAIL_CACHE = False
+
+# Pack the positions of a run into a RunTrack when it finishes (see app_run/tracks.py)
+PACK_FINISHED_TRACKS = True
+
 # Application definition
 
 
@@ -77,6 +93,15 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'project_run.wsgi.application'
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -18,9 +18,11 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
+from app_run import async_views
 from app_run.views import company_details_view, RunViewSet, UserViewSet, RunStartView, RunStopView, AthleteInfoView, \
     show_challenges, PositionViewSet, show_collectible_items, upload_collectible_items, SubscribeView, \
-    ChallengeSummaryView, RateCoachView, AnalyticsForCoachView
+    ChallengeSummaryView, RateCoachView, AnalyticsForCoachView, RunFinalizationJobView, \
+    TrendsForCoachView, LeaderboardView, HeatmapTileView
 
 router = DefaultRouter()
 router.register('api/runs', RunViewSet)
@@ -32,6 +34,7 @@ urlpatterns = [
     path('api/company_details/', company_details_view),
     path('api/runs/<int:run_id>/start/', RunStartView.as_view(), name='run-start'),
     path('api/runs/<int:run_id>/stop/', RunStopView.as_view(), name='run-stop'),
+    path('api/finalization_jobs/<int:job_id>/', RunFinalizationJobView.as_view(), name='finalization-job'),
     path('api/athlete_info/<int:user_id>/', AthleteInfoView.as_view(), name='athlete-info'),
     path('api/challenges/', show_challenges, name='challenge-list'),
     path('api/collectible_item/', show_collectible_items, name='show-collectible-items'),
@@ -40,5 +43,13 @@ urlpatterns = [
     path('api/challenges_summary/', ChallengeSummaryView.as_view(), name='challenge-summary'),
     path('api/rate_coach/<int:id>/', RateCoachView.as_view(), name='rate-coach'),
     path('api/analytics_for_coach/<int:id>/', AnalyticsForCoachView.as_view(), name='analytics-coach'),
+    path('api/trends_for_coach/<int:id>/', TrendsForCoachView.as_view(), name='trends-coach'),
+    path('api/leaderboards/<str:board>/', LeaderboardView.as_view(), name='leaderboard'),
+    path('api/heatmap/<int:zoom>/<int:x>/<int:y>/', HeatmapTileView.as_view(), name='heatmap-tile'),
+    path('api/async/positions/', async_views.create_position, name='async-position-create'),
+    path('api/async/positions/bulk/', async_views.bulk_create_positions, name='async-position-bulk'),
+    path('api/async/runs/<int:run_id>/', async_views.retrieve_run, name='async-run-detail'),
+    path('api/async/runs/<int:run_id>/start/', async_views.start_run, name='async-run-start'),
+    path('api/async/runs/<int:run_id>/stop/', async_views.stop_run, name='async-run-stop'),
     path('', include(router.urls)),
 ]